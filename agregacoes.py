@@ -0,0 +1,326 @@
+# Agregações pré-calculadas (hora, dia, semana) das leituras dos sensores
+# Alimentam a página "Histórico e Relatórios" sem varrer os dados brutos
+
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from armazenamento_sensores import TANQUE_PADRAO
+
+NS_POR_HORA = 3_600 * 10**9
+NS_POR_DIA = 24 * NS_POR_HORA
+
+# Largura de cada resolução e deslocamento para alinhar as semanas na segunda-feira
+# (1970-01-01, origem dos timestamps, foi uma quinta-feira)
+RESOLUCOES = {
+    'hora': (NS_POR_HORA, 0),
+    'dia': (NS_POR_DIA, 0),
+    'semana': (7 * NS_POR_DIA, 3 * NS_POR_DIA),
+}
+
+# Faixas dos histogramas usados para estimar percentis; valores fora delas
+# caem nos compartimentos das pontas
+N_COMPARTIMENTOS = 128
+FAIXAS_HISTOGRAMA = {
+    'ph': (4.0, 10.0),
+    'temperatura': (15.0, 40.0),
+    'oxigenio': (0.0, 15.0),
+    'turbidez': (0.0, 100.0),
+}
+
+PERCENTIS = [0.25, 0.5, 0.75]
+
+# Baldes por partição (um arquivo .npz cada): um dia de horas, ~um mês de dias,
+# ~um ano de semanas. Uma sincronização regrava só as partições que mudaram
+BALDES_POR_PARTICAO = {'hora': 24, 'dia': 30, 'semana': 52}
+
+class AgregacoesSensores:
+    """
+    Mantém, para cada resolução, contagem, soma, soma dos quadrados, mínimo,
+    máximo e um histograma por balde de tempo e sensor. Todas essas
+    estatísticas são combináveis, então novas leituras atualizam apenas os
+    baldes afetados e qualquer período pode ser resumido a partir dos baldes
+    Os baldes ficam em partições de BALDES_POR_PARTICAO baldes, em memória e em
+    disco (<diretorio>/<tanque>/<resolução>/<partição>.npz): o custo de uma
+    sincronização depende das leituras novas, não do tamanho do histórico
+    Pode ser compartilhada entre threads: as atualizações são serializadas e
+    as partições existentes nunca são alteradas no lugar, só substituídas
+    """
+
+    def __init__(self, armazenamento, tanque=TANQUE_PADRAO, diretorio="dados_demo/agregacoes"):
+        self.armazenamento = armazenamento
+        self.tanque = tanque
+        self.diretorio = os.path.join(diretorio, str(tanque))
+        self.sensores = [c for c in armazenamento.colunas if c in FAIXAS_HISTOGRAMA]
+        self.posicao = None  # (partição, linhas) do armazenamento já agregadas (ver ler_desde)
+        self._baldes = {}  # resolução -> {partição: baldes}
+        self._lock = threading.RLock()
+        self._carregar()
+
+    def sincronizar(self):
+        """
+        Incorpora as leituras gravadas depois da última sincronização
+        Retorna quantas leituras novas foram agregadas
+        """
+        with self._lock:
+            # Retoma pela posição no armazenamento, não pelo último timestamp: leituras
+            # anexadas depois com o mesmo timestamp da última agregada também entram
+            novos, posicao = self.armazenamento.ler_desde(self.posicao, tanque=self.tanque)
+            return self.atualizar(novos, posicao)
+
+    def atualizar(self, dados, posicao):
+        """
+        Agrega um lote de leituras posteriores às já agregadas
+        posicao: posição do armazenamento logo após o lote (ArmazenamentoSensores.ler_desde)
+        """
+        if len(dados) == 0:
+            if posicao != self.posicao:
+                with self._lock:
+                    self.posicao = posicao
+                    self._salvar({})
+            return 0
+
+        timestamps = pd.to_datetime(dados['timestamp']).to_numpy('datetime64[ns]').view(np.int64)
+        valores = dados[self.sensores].to_numpy(dtype=np.float64)
+
+        with self._lock:
+            alteradas = {}
+            for resolucao in RESOLUCOES:
+                novos = self._agregar(timestamps, valores, resolucao)
+                # Cópia do índice de partições: quem está lendo continua com o anterior
+                particoes = dict(self._baldes.get(resolucao, {}))
+                alteradas[resolucao] = []
+                for particao, baldes in _dividir(novos, BALDES_POR_PARTICAO[resolucao]):
+                    existentes = particoes.get(particao)
+                    particoes[particao] = baldes if existentes is None else self._combinar(existentes, baldes)
+                    alteradas[resolucao].append(particao)
+                self._baldes[resolucao] = particoes
+
+            self.posicao = posicao
+            self._salvar(alteradas)
+        return len(timestamps)
+
+    def serie(self, resolucao, inicio=None, fim=None):
+        """
+        Série agregada no período: uma linha por balde com a média de cada sensor
+        (colunas com o nome do sensor) e as colunas <sensor>_min, _max, _p25, _p50, _p75
+        """
+        baldes = self._filtrar(resolucao, inicio, fim)
+        largura, deslocamento = RESOLUCOES[resolucao]
+
+        dados = {'timestamp': (baldes['id'] * largura - deslocamento).astype('datetime64[ns]')}
+        contagem = baldes['contagem'][:, None]
+        medias = baldes['soma'] / np.maximum(contagem, 1)
+        percentis = _percentis_histograma(baldes['histograma'], baldes['minimo'], baldes['maximo'], self.sensores)
+
+        for k, sensor in enumerate(self.sensores):
+            dados[sensor] = medias[:, k]
+            dados[f"{sensor}_min"] = baldes['minimo'][:, k]
+            dados[f"{sensor}_max"] = baldes['maximo'][:, k]
+            for q, valores in zip(PERCENTIS, percentis):
+                dados[f"{sensor}_p{int(q * 100)}"] = valores[:, k]
+
+        return pd.DataFrame(dados)
+
+    def estatisticas(self, inicio=None, fim=None, resolucao='dia'):
+        """
+        Equivalente a DataFrame.describe() para o período, calculado a partir
+        dos baldes. Contagem, média, desvio, mínimo e máximo são exatos quando o
+        período coincide com os limites dos baldes; os percentis são estimados
+        pelos histogramas
+        """
+        baldes = self._filtrar(resolucao, inicio, fim)
+
+        contagem = baldes['contagem'].sum()
+        soma = baldes['soma'].sum(axis=0)
+        soma_quadrados = baldes['soma_quadrados'].sum(axis=0)
+        minimo = baldes['minimo'].min(axis=0, initial=np.inf)
+        maximo = baldes['maximo'].max(axis=0, initial=-np.inf)
+        histograma = baldes['histograma'].sum(axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            media = soma / contagem
+            variancia = (soma_quadrados - contagem * media**2) / (contagem - 1)
+        desvio = np.sqrt(np.maximum(variancia, 0))
+        if contagem == 0:
+            minimo = maximo = np.full(len(self.sensores), np.nan)
+        percentis = _percentis_histograma(histograma[None], minimo[None], maximo[None], self.sensores)
+
+        linhas = [np.full(len(self.sensores), float(contagem)), media, desvio, minimo]
+        linhas += [valores[0] for valores in percentis]
+        linhas.append(maximo)
+
+        indice = ['count', 'mean', 'std', 'min'] + [f"{int(q * 100)}%" for q in PERCENTIS] + ['max']
+        return pd.DataFrame(np.vstack(linhas), index=indice, columns=self.sensores)
+
+    def _agregar(self, timestamps, valores, resolucao):
+        largura, deslocamento = RESOLUCOES[resolucao]
+        ids, inverso = np.unique((timestamps + deslocamento) // largura, return_inverse=True)
+        n_baldes, n_sensores = len(ids), valores.shape[1]
+
+        soma = np.zeros((n_baldes, n_sensores))
+        soma_quadrados = np.zeros((n_baldes, n_sensores))
+        minimo = np.full((n_baldes, n_sensores), np.inf)
+        maximo = np.full((n_baldes, n_sensores), -np.inf)
+        np.add.at(soma, inverso, valores)
+        np.add.at(soma_quadrados, inverso, valores**2)
+        np.minimum.at(minimo, inverso, valores)
+        np.maximum.at(maximo, inverso, valores)
+
+        histograma = np.zeros((n_baldes, n_sensores, N_COMPARTIMENTOS), dtype=np.int64)
+        compartimentos = _compartimentos(valores, self.sensores)
+        sensores = np.broadcast_to(np.arange(n_sensores), valores.shape)
+        np.add.at(histograma, (np.broadcast_to(inverso[:, None], valores.shape), sensores, compartimentos), 1)
+
+        return {
+            'id': ids,
+            'contagem': np.bincount(inverso, minlength=n_baldes),
+            'soma': soma,
+            'soma_quadrados': soma_quadrados,
+            'minimo': minimo,
+            'maximo': maximo,
+            'histograma': histograma,
+        }
+
+    def _combinar(self, existentes, novos):
+        # Os novos dados são posteriores, então só o último balde existente
+        # pode coincidir com o primeiro balde novo
+        if len(existentes['id']) and len(novos['id']) and existentes['id'][-1] == novos['id'][0]:
+            novos = {chave: valores.copy() for chave, valores in novos.items()}
+            for chave in ('contagem', 'soma', 'soma_quadrados', 'histograma'):
+                novos[chave][0] += existentes[chave][-1]
+            novos['minimo'][0] = np.minimum(novos['minimo'][0], existentes['minimo'][-1])
+            novos['maximo'][0] = np.maximum(novos['maximo'][0], existentes['maximo'][-1])
+            existentes = {chave: valores[:-1] for chave, valores in existentes.items()}
+
+        return {chave: np.concatenate([existentes[chave], novos[chave]]) for chave in existentes}
+
+    def _filtrar(self, resolucao, inicio, fim):
+        """Baldes do período, concatenando apenas as partições que o cobrem"""
+        particoes = self._baldes.get(resolucao, {})
+        largura, deslocamento = RESOLUCOES[resolucao]
+        por_particao = BALDES_POR_PARTICAO[resolucao]
+        id_inicio = None if inicio is None else (pd.Timestamp(inicio).value + deslocamento) // largura
+        id_fim = None if fim is None else (pd.Timestamp(fim).value + deslocamento) // largura
+        selecionadas = [
+            particoes[particao] for particao in sorted(particoes)
+            if (id_inicio is None or particao >= id_inicio // por_particao)
+            and (id_fim is None or particao <= id_fim // por_particao)
+        ]
+        if not selecionadas:
+            return self._agregar(np.empty(0, dtype=np.int64), np.empty((0, len(self.sensores))), resolucao)
+        baldes = {chave: np.concatenate([b[chave] for b in selecionadas]) for chave in selecionadas[0]}
+
+        primeiro = 0
+        ultimo = len(baldes['id'])
+        if id_inicio is not None:
+            primeiro = np.searchsorted(baldes['id'], id_inicio, side='left')
+        if id_fim is not None:
+            ultimo = np.searchsorted(baldes['id'], id_fim, side='right')
+        return {chave: valores[primeiro:ultimo] for chave, valores in baldes.items()}
+
+    def _meta(self):
+        return {
+            'sensores': self.sensores,
+            'compartimentos': N_COMPARTIMENTOS,
+            'baldes_por_particao': BALDES_POR_PARTICAO,
+            'retomada': 'posicao',
+        }
+
+    def _carregar(self):
+        caminho_meta = os.path.join(self.diretorio, "meta.json")
+        if not os.path.exists(caminho_meta):
+            return
+        with open(caminho_meta) as f:
+            meta = json.load(f)
+        if {chave: meta.get(chave) for chave in self._meta()} != self._meta():
+            # Formato ou sensores diferentes: as agregações são refeitas do zero
+            self._apagar()
+            return
+        self.posicao = None if meta['posicao'] is None else tuple(meta['posicao'])
+        for resolucao in RESOLUCOES:
+            diretorio = os.path.join(self.diretorio, resolucao)
+            particoes = {}
+            for nome in sorted(os.listdir(diretorio)) if os.path.isdir(diretorio) else []:
+                if nome.endswith(".npz"):
+                    with np.load(os.path.join(diretorio, nome)) as arquivo:
+                        particoes[int(nome[:-4])] = {chave: arquivo[chave] for chave in arquivo.files}
+            self._baldes[resolucao] = particoes
+
+    def _apagar(self):
+        for nome in list(RESOLUCOES) + ["meta.json"] + [f"{r}.npz" for r in RESOLUCOES]:
+            caminho = os.path.join(self.diretorio, nome)
+            if os.path.isdir(caminho):
+                shutil.rmtree(caminho)
+            elif os.path.exists(caminho):
+                os.remove(caminho)
+
+    def _salvar(self, alteradas):
+        """Grava as partições alteradas (resolução -> partições) e depois os metadados"""
+        for resolucao, particoes in alteradas.items():
+            diretorio = os.path.join(self.diretorio, resolucao)
+            os.makedirs(diretorio, exist_ok=True)
+            for particao in particoes:
+                caminho = os.path.join(diretorio, f"{particao}.npz")
+                with open(caminho + ".tmp", "wb") as f:
+                    np.savez(f, **self._baldes[resolucao][particao])
+                os.replace(caminho + ".tmp", caminho)
+
+        # Metadados por último: só apontam para agregações já gravadas
+        caminho_meta = os.path.join(self.diretorio, "meta.json")
+        with open(caminho_meta + ".tmp", "w") as f:
+            json.dump({'posicao': self.posicao, **self._meta()}, f)
+        os.replace(caminho_meta + ".tmp", caminho_meta)
+
+def escolher_resolucao(inicio, fim, max_pontos=2000):
+    """
+    Resolução mais fina cujo número de baldes cabe em max_pontos
+    Retorna None para períodos curtos, que podem ser exibidos com os dados brutos
+    """
+    duracao = pd.Timestamp(fim).value - pd.Timestamp(inicio).value
+    if duracao <= NS_POR_DIA:
+        return None
+    for resolucao, (largura, _) in RESOLUCOES.items():
+        if duracao / largura <= max_pontos:
+            return resolucao
+    return 'semana'
+
+def _dividir(baldes, por_particao):
+    """Separa baldes consecutivos em (partição, baldes) pelo id de cada balde"""
+    particoes = baldes['id'] // por_particao
+    cortes = np.flatnonzero(np.diff(particoes)) + 1
+    for inicio, fim in zip(np.r_[0, cortes], np.r_[cortes, len(particoes)]):
+        if fim > inicio:
+            yield int(particoes[inicio]), {chave: valores[inicio:fim] for chave, valores in baldes.items()}
+
+def _compartimentos(valores, sensores):
+    limites = np.array([FAIXAS_HISTOGRAMA[s] for s in sensores])
+    relativo = (valores - limites[:, 0]) / (limites[:, 1] - limites[:, 0])
+    return np.clip((relativo * N_COMPARTIMENTOS).astype(np.int64), 0, N_COMPARTIMENTOS - 1)
+
+def _percentis_histograma(histograma, minimo, maximo, sensores):
+    """
+    Estima percentis por interpolação linear dentro dos compartimentos
+    histograma: (baldes, sensores, compartimentos); retorna uma matriz por percentil
+    """
+    limites = np.array([FAIXAS_HISTOGRAMA[s] for s in sensores])
+    largura = (limites[:, 1] - limites[:, 0]) / N_COMPARTIMENTOS
+    acumulado = np.cumsum(histograma, axis=-1)
+    total = acumulado[..., -1:]
+
+    resultado = []
+    for q in PERCENTIS:
+        alvo = q * total
+        indice = np.minimum((acumulado < alvo).sum(axis=-1, keepdims=True), N_COMPARTIMENTOS - 1)
+        antes = np.take_along_axis(acumulado, indice, axis=-1) - np.take_along_axis(histograma, indice, axis=-1)
+        no_compartimento = np.take_along_axis(histograma, indice, axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fracao = np.where(no_compartimento > 0, (alvo - antes) / no_compartimento, 0.5)
+        estimado = (limites[:, 0][:, None] + (indice + fracao) * largura[:, None])[..., 0]
+        estimado = np.clip(estimado, minimo, maximo)
+        resultado.append(np.where(total[..., 0] > 0, estimado, np.nan))
+    return resultado
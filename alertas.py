@@ -0,0 +1,238 @@
+# Motor de alertas sobre os resultados da detecção de anomalias
+# Cada resultado anômalo abre ou atualiza o episódio de alerta do tanque;
+# resultados anômalos seguidos não geram alertas novos, só atualizam o
+# episódio, mesmo que o parâmetro crítico alterne entre sensores. O episódio
+# fecha depois de `fechar_apos` resultados seguidos do tanque sem anomalia (histerese).
+#
+# Estado em memória: índice dos episódios ativos por tanque e um histórico
+# circular dos episódios encerrados. Eventos (aberto, atualizado, escalado,
+# fechado) vão para um log JSONL que só cresce; outros processos, como o
+# dashboard, reconstroem o estado lendo o log de forma incremental. As
+# atualizações de um episódio em andamento são gravadas no máximo uma vez a
+# cada `intervalo_atualizacao`, para o log não crescer a cada leitura
+
+import json
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass
+
+import pandas as pd
+
+from resultados import SENSORES, ResultadoAnomalia, NivelAlerta
+
+CAMINHO_LOG = "dados_demo/alertas/eventos.jsonl"
+FECHAR_APOS = 3  # resultados seguidos sem anomalia para encerrar um episódio
+INTERVALO_ATUALIZACAO = pd.Timedelta(minutes=5)  # entre eventos 'atualizado' do mesmo episódio
+CAPACIDADE_HISTORICO = 1000
+
+@dataclass(slots=True)
+class EpisodioAlerta:
+    """
+    Um alerta do tanque do início ao fim
+    parametro: índice em SENSORES do parâmetro crítico no score máximo do episódio
+    """
+    id: int
+    tanque: str
+    parametro: int
+    inicio: pd.Timestamp
+    ultimo: pd.Timestamp
+    nivel: NivelAlerta
+    nivel_maximo: NivelAlerta
+    score_maximo: float
+    n_ocorrencias: int = 1
+    fim: pd.Timestamp = None
+    _sem_anomalia: int = 0
+    _gravado_em: pd.Timestamp = None  # momento do último evento do episódio no log
+
+    @property
+    def ativo(self):
+        return self.fim is None
+
+    def para_dict(self):
+        return {
+            'id': self.id,
+            'tanque': self.tanque,
+            'parametro': SENSORES[self.parametro],
+            'inicio': self.inicio.isoformat(),
+            'ultimo': self.ultimo.isoformat(),
+            'fim': None if self.fim is None else self.fim.isoformat(),
+            'nivel': self.nivel.name,
+            'nivel_maximo': self.nivel_maximo.name,
+            'score_maximo': self.score_maximo,
+            'n_ocorrencias': self.n_ocorrencias,
+        }
+
+class MotorAlertas:
+    """
+    Abre, atualiza e encerra um episódio de alerta por tanque
+    ativos() custa O(episódios ativos), sem reler séries nem o log
+    gravar=False: apenas acompanha o log escrito por outro processo (sincronizar)
+    """
+
+    def __init__(self, caminho_log=CAMINHO_LOG, fechar_apos=FECHAR_APOS,
+                 capacidade_historico=CAPACIDADE_HISTORICO, gravar=True,
+                 intervalo_atualizacao=INTERVALO_ATUALIZACAO):
+        self.caminho_log = caminho_log
+        self.fechar_apos = fechar_apos
+        self.gravar = gravar
+        self.intervalo_atualizacao = pd.Timedelta(intervalo_atualizacao)
+        self._ativos = {}  # tanque -> episódio
+        self._historico = deque(maxlen=capacidade_historico)
+        self._proximo_id = 1
+        self._posicao_log = 0
+        self._lock = threading.Lock()
+
+        # Retoma os episódios que estavam abertos quando o processo anterior parou
+        self.sincronizar()
+        if gravar and os.path.dirname(caminho_log):
+            os.makedirs(os.path.dirname(caminho_log), exist_ok=True)
+
+    def avaliar(self, tanque, resultado, momento=None):
+        """
+        Aplica um resultado da detecção do tanque; retorna os eventos gerados
+        Resultados que não são ResultadoAnomalia (dados insuficientes, erros) são ignorados
+        """
+        if not isinstance(resultado, ResultadoAnomalia):
+            return []
+        tanque = str(tanque)
+        momento = pd.Timestamp.now() if momento is None else pd.Timestamp(momento)
+        eventos = []
+
+        with self._lock:
+            episodio = self._ativos.get(tanque)
+            if resultado.anomalia_detectada:
+                if episodio is None:
+                    episodio = self._abrir(
+                        tanque, resultado.parametro_critico, momento, resultado.nivel_alerta, resultado.score_anomalia
+                    )
+                    eventos.append(self._evento('aberto', episodio))
+                else:
+                    episodio.ultimo = momento
+                    episodio.nivel = resultado.nivel_alerta
+                    if resultado.score_anomalia > episodio.score_maximo:
+                        episodio.score_maximo = float(resultado.score_anomalia)
+                        episodio.parametro = resultado.parametro_critico
+                    episodio.n_ocorrencias += 1
+                    episodio._sem_anomalia = 0
+                    if resultado.nivel_alerta > episodio.nivel_maximo:
+                        episodio.nivel_maximo = resultado.nivel_alerta
+                        eventos.append(self._evento('escalado', episodio))
+                    elif momento - episodio._gravado_em >= self.intervalo_atualizacao:
+                        eventos.append(self._evento('atualizado', episodio))
+            elif episodio is not None:
+                episodio._sem_anomalia += 1
+                if episodio._sem_anomalia >= self.fechar_apos:
+                    self._fechar(episodio, momento)
+                    eventos.append(self._evento('fechado', episodio))
+
+            self._gravar(eventos)
+        return eventos
+
+    def ativos(self, tanque=None):
+        """Episódios abertos, do mais grave para o menos grave"""
+        with self._lock:
+            if tanque is None:
+                episodios = list(self._ativos.values())
+            else:
+                episodios = [self._ativos[str(tanque)]] if str(tanque) in self._ativos else []
+        return sorted(episodios, key=lambda e: (-e.nivel, e.inicio))
+
+    def historico(self, n=None):
+        """Episódios encerrados, do mais recente para o mais antigo"""
+        with self._lock:
+            encerrados = list(reversed(self._historico))
+        return encerrados if n is None else encerrados[:n]
+
+    def episodios(self, tanque, inicio, fim):
+        """Episódios do tanque, ativos ou encerrados, que se sobrepõem ao período [inicio, fim]"""
+        tanque, inicio, fim = str(tanque), pd.Timestamp(inicio), pd.Timestamp(fim)
+        return [
+            e for e in self.historico() + self.ativos(tanque)
+            if e.tanque == tanque and e.inicio <= fim and (e.fim is None or e.fim >= inicio)
+        ]
+
+    def versao_periodo(self, tanque, inicio, fim):
+        """
+        Identificador do estado dos episódios do período (para chaves de cache):
+        muda quando um deles abre, é atualizado ou fecha
+        """
+        return tuple(
+            (e.id, e.ultimo.value, e.n_ocorrencias, None if e.fim is None else e.fim.value)
+            for e in sorted(self.episodios(tanque, inicio, fim), key=lambda e: e.id)
+        )
+
+    def sincronizar(self):
+        """Aplica os eventos acrescentados ao log desde a última leitura; retorna quantos"""
+        with self._lock:
+            try:
+                with open(self.caminho_log, "rb") as f:
+                    f.seek(self._posicao_log)
+                    conteudo = f.read()
+            except FileNotFoundError:
+                return 0
+
+            # Uma linha ainda sendo escrita fica para a próxima sincronização
+            completo = conteudo[:conteudo.rfind(b"\n") + 1]
+            n_eventos = 0
+            for linha in completo.splitlines():
+                if not linha.strip():
+                    continue
+                # Uma linha corrompida (queda do processo, dois escritores) é pulada:
+                # sem isso a posição do log nunca passaria dela
+                try:
+                    self._aplicar(json.loads(linha))
+                except (ValueError, KeyError, TypeError) as e:  # inclui json.JSONDecodeError
+                    print(f"❌ Evento inválido no log de alertas ignorado: {e}")
+                    continue
+                n_eventos += 1
+            self._posicao_log += len(completo)
+        return n_eventos
+
+    def _abrir(self, tanque, parametro, momento, nivel, score, id=None):
+        if id is None:
+            id = self._proximo_id
+        self._proximo_id = max(self._proximo_id, id + 1)
+        episodio = EpisodioAlerta(id, tanque, parametro, momento, momento, nivel, nivel, float(score))
+        self._ativos[tanque] = episodio
+        return episodio
+
+    def _fechar(self, episodio, momento):
+        episodio.fim = momento
+        del self._ativos[episodio.tanque]
+        self._historico.append(episodio)
+
+    def _evento(self, tipo, episodio):
+        momento = episodio.fim or episodio.ultimo
+        episodio._gravado_em = momento
+        return {'evento': tipo, 'momento': momento.isoformat(), **episodio.para_dict()}
+
+    def _aplicar(self, evento):
+        """Reproduz um evento do log no estado em memória"""
+        episodio = self._ativos.get(evento['tanque'])
+        if episodio is None:
+            if evento['evento'] != 'aberto':
+                return
+            episodio = self._abrir(
+                evento['tanque'], SENSORES.index(evento['parametro']), pd.Timestamp(evento['inicio']),
+                NivelAlerta[evento['nivel']], evento['score_maximo'], id=evento['id']
+            )
+
+        episodio.parametro = SENSORES.index(evento['parametro'])
+        episodio._gravado_em = pd.Timestamp(evento['momento'])
+        episodio.ultimo = pd.Timestamp(evento['ultimo'])
+        episodio.nivel = NivelAlerta[evento['nivel']]
+        episodio.nivel_maximo = NivelAlerta[evento['nivel_maximo']]
+        episodio.score_maximo = evento['score_maximo']
+        episodio.n_ocorrencias = evento['n_ocorrencias']
+        if evento['evento'] == 'fechado':
+            self._fechar(episodio, pd.Timestamp(evento['fim']))
+
+    def _gravar(self, eventos):
+        if not eventos or not self.gravar:
+            return
+        linhas = "".join(json.dumps(evento, ensure_ascii=False) + "\n" for evento in eventos).encode("utf-8")
+        # Uma única escrita em modo append: leitores nunca veem eventos intercalados
+        with open(self.caminho_log, "ab") as f:
+            f.write(linhas)
+            self._posicao_log = f.tell()
@@ -0,0 +1,297 @@
+# Armazenamento colunar das leituras dos sensores de qualidade da água
+# Substitui as releituras do qualidade_agua.csv por arquivos binários
+# particionados por dia e lidos via memmap
+
+import json
+import os
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+import pandas as pd
+
+from instrumentacao import cronometrado, medir
+
+COLUNAS_SENSORES = ['ph', 'temperatura', 'oxigenio', 'turbidez']
+TANQUE_PADRAO = 'principal'
+NS_POR_DIA = 86_400 * 10**9
+
+class ArmazenamentoSensores:
+    """
+    Séries de sensores gravadas como um arquivo binário por coluna, particionadas por dia:
+        <raiz>/<tanque>/<AAAA-MM-DD>/timestamp.bin, ph.bin, ...
+    Os timestamps (int64, ns) formam o índice de cada partição. Leituras por
+    intervalo abrem apenas as partições necessárias e fatiam via memmap
+    """
+
+    def __init__(self, raiz="dados_demo/sensores", colunas=COLUNAS_SENSORES):
+        self.raiz = raiz
+        self.colunas = list(colunas)
+
+    def _diretorio_tanque(self, tanque):
+        # O nome do tanque pode vir de fora (serviço de ingestão): nunca sair da raiz
+        raiz = os.path.realpath(self.raiz)
+        diretorio = os.path.realpath(os.path.join(raiz, str(tanque)))
+        if os.path.dirname(diretorio) != raiz:
+            raise ValueError(f"Nome de tanque inválido: {tanque!r}")
+        return diretorio
+
+    def tanques(self):
+        """Lista os tanques com dados gravados"""
+        if not os.path.isdir(self.raiz):
+            return []
+        return sorted(
+            nome for nome in os.listdir(self.raiz)
+            if os.path.isdir(os.path.join(self.raiz, nome))
+        )
+
+    def particoes(self, tanque=TANQUE_PADRAO):
+        """Nomes das partições (AAAA-MM-DD) do tanque em ordem cronológica"""
+        diretorio = self._diretorio_tanque(tanque)
+        if not os.path.isdir(diretorio):
+            return []
+        return sorted(nome for nome in os.listdir(diretorio) if not nome.endswith('.json'))
+
+    def vazio(self, tanque=TANQUE_PADRAO):
+        return not self.particoes(tanque)
+
+    def anexar(self, dados, tanque=TANQUE_PADRAO):
+        """
+        Acrescenta leituras ao final da série do tanque
+        dados: DataFrame com 'timestamp' e as colunas do armazenamento, em ordem cronológica
+        """
+        if len(dados) == 0:
+            return 0
+
+        timestamps = pd.to_datetime(dados['timestamp']).to_numpy('datetime64[ns]').view(np.int64)
+        if np.any(np.diff(timestamps) < 0):
+            raise ValueError("Leituras devem estar em ordem cronológica")
+
+        ultimo = self._ultimo_timestamp(tanque)
+        if ultimo is not None and timestamps[0] < ultimo:
+            raise ValueError(f"Leituras anteriores ao último registro do tanque '{tanque}'")
+
+        diretorio_tanque = self._diretorio_tanque(tanque)
+        os.makedirs(diretorio_tanque, exist_ok=True)
+        self._gravar_esquema(diretorio_tanque)
+
+        valores = {coluna: dados[coluna].to_numpy(dtype=np.float64) for coluna in self.colunas}
+
+        # Quebrar o lote nas fronteiras de dia
+        dias = timestamps // NS_POR_DIA
+        cortes = np.flatnonzero(np.diff(dias)) + 1
+        for inicio, fim in zip(np.r_[0, cortes], np.r_[cortes, len(timestamps)]):
+            diretorio = os.path.join(diretorio_tanque, self._nome_particao(dias[inicio]))
+            os.makedirs(diretorio, exist_ok=True)
+
+            for coluna in self.colunas:
+                with open(os.path.join(diretorio, f"{coluna}.bin"), "ab") as f:
+                    valores[coluna][inicio:fim].tofile(f)
+
+            # O índice é gravado por último: seu tamanho define as linhas válidas
+            with open(os.path.join(diretorio, "timestamp.bin"), "ab") as f:
+                timestamps[inicio:fim].tofile(f)
+
+        return len(timestamps)
+
+    @cronometrado("armazenamento.ler")
+    def ler(self, inicio=None, fim=None, tanque=TANQUE_PADRAO):
+        """
+        Lê as leituras com inicio <= timestamp <= fim (limites opcionais)
+        Somente as partições que cobrem o intervalo são abertas
+        """
+        inicio_ns = None if inicio is None else pd.Timestamp(inicio).value
+        fim_ns = None if fim is None else pd.Timestamp(fim).value
+        blocos = [
+            self._ler_particao(tanque, nome, inicio_ns, fim_ns)
+            for nome in self._particoes_periodo(tanque, inicio_ns, fim_ns)
+        ]
+        return self._montar_frame(blocos)
+
+    def ler_desde(self, posicao=None, inicio=None, tanque=TANQUE_PADRAO):
+        """
+        Leituras gravadas depois de posicao, para quem acompanha a série de forma incremental
+        posicao: retornada pela chamada anterior; None lê desde inicio (ou desde o começo)
+        Retorna (dados, nova posição). A posição é (partição, linhas) do fim da série
+        lida, não um timestamp: leituras anexadas depois com o mesmo timestamp da
+        última já lida (várias sondas, micro-lotes) não são perdidas
+        """
+        if posicao is not None:
+            particao, linhas = posicao
+            nomes = self.particoes(tanque)
+            nomes = nomes[bisect_left(nomes, particao):]
+            inicio_ns = None
+        else:
+            particao, linhas = None, 0
+            inicio_ns = None if inicio is None else pd.Timestamp(inicio).value
+            nomes = self._particoes_periodo(tanque, inicio_ns)
+
+        blocos = []
+        for nome in nomes:
+            # O tamanho do índice é lido uma vez: define o bloco e a nova posição
+            indice = self._indice(tanque, nome).view(np.int64)
+            i0 = linhas if nome == particao else 0
+            if inicio_ns is not None:
+                i0 = max(i0, int(np.searchsorted(indice, inicio_ns, side='left')))
+            blocos.append(self._ler_particao(tanque, nome, linhas=(i0, len(indice))))
+            posicao = (nome, len(indice))
+        return self._montar_frame(blocos), posicao
+
+    @cronometrado("armazenamento.ultimos")
+    def ultimos(self, n, tanque=TANQUE_PADRAO):
+        """Lê as n leituras mais recentes, abrindo partições do fim para o início"""
+        blocos = []
+        restantes = n
+        for nome in reversed(self.particoes(tanque)):
+            if restantes <= 0:
+                break
+            timestamps, colunas = self._ler_particao(tanque, nome)
+            blocos.append((timestamps[-restantes:], {c: v[-restantes:] for c, v in colunas.items()}))
+            restantes -= len(timestamps)
+        return self._montar_frame(blocos[::-1])
+
+    def intervalo(self, tanque=TANQUE_PADRAO):
+        """Primeiro e último timestamp gravados, ou (None, None) se vazio"""
+        # Partições ainda sem índice (anexo em andamento) são puladas
+        indices = (self._indice(tanque, nome) for nome in self.particoes(tanque))
+        primeiro = next((indice for indice in indices if len(indice)), None)
+        ultimo = self._ultimo_timestamp(tanque)
+        if primeiro is None or ultimo is None:
+            return None, None
+        return pd.Timestamp(primeiro[0]), pd.Timestamp(ultimo)
+
+    def ultimo(self, tanque=TANQUE_PADRAO):
+        """Timestamp da leitura mais recente (só o índice da última partição), ou None"""
+        ultimo = self._ultimo_timestamp(tanque)
+        return None if ultimo is None else pd.Timestamp(ultimo)
+
+    def versao(self, tanque=TANQUE_PADRAO):
+        """
+        Identificador barato do estado atual dos dados do tanque
+        Muda sempre que novas leituras são anexadas
+        """
+        particoes = self.particoes(tanque)
+        if not particoes:
+            return None
+        return (particoes[-1], self._tamanho_indice(tanque, particoes[-1]))
+
+    def versao_periodo(self, inicio=None, fim=None, tanque=TANQUE_PADRAO):
+        """
+        Como versao(), mas só das partições que cobrem o período: leituras
+        novas fora dele não mudam o identificador
+        """
+        inicio_ns = None if inicio is None else pd.Timestamp(inicio).value
+        fim_ns = None if fim is None else pd.Timestamp(fim).value
+        return tuple(
+            (nome, self._tamanho_indice(tanque, nome))
+            for nome in self._particoes_periodo(tanque, inicio_ns, fim_ns)
+        )
+
+    def reparar(self, tanque=TANQUE_PADRAO):
+        """
+        Descarta valores gravados além do índice na última partição (escrita
+        interrompida antes do timestamp.bin), para que novos anexos fiquem alinhados
+        Retorna quantas colunas foram truncadas
+        """
+        particoes = self.particoes(tanque)
+        if not particoes:
+            return 0
+        diretorio = os.path.join(self._diretorio_tanque(tanque), particoes[-1])
+        truncadas = 0
+        indice = os.path.join(diretorio, "timestamp.bin")
+        if self._tamanho_indice(tanque, particoes[-1]) % 8:
+            os.truncate(indice, os.path.getsize(indice) // 8 * 8)
+            truncadas += 1
+        tamanho = len(self._indice(tanque, particoes[-1])) * np.dtype(np.float64).itemsize
+        for coluna in self.colunas:
+            caminho = os.path.join(diretorio, f"{coluna}.bin")
+            if os.path.exists(caminho) and os.path.getsize(caminho) > tamanho:
+                os.truncate(caminho, tamanho)
+                truncadas += 1
+        return truncadas
+
+    def _particoes_periodo(self, tanque, inicio_ns=None, fim_ns=None):
+        particoes = self.particoes(tanque)
+        primeira = 0 if inicio_ns is None else bisect_left(particoes, self._nome_particao(inicio_ns // NS_POR_DIA))
+        ultima = len(particoes) if fim_ns is None else bisect_right(particoes, self._nome_particao(fim_ns // NS_POR_DIA))
+        return particoes[primeira:ultima]
+
+    def _nome_particao(self, dia):
+        return str(np.datetime64(int(dia), 'D'))
+
+    def _gravar_esquema(self, diretorio_tanque):
+        caminho = os.path.join(diretorio_tanque, "esquema.json")
+        if not os.path.exists(caminho):
+            with open(caminho, "w") as f:
+                json.dump({'colunas': self.colunas, 'dtype': 'float64'}, f)
+
+    def _tamanho_indice(self, tanque, nome):
+        # Uma partição recém-criada ainda sem timestamp.bin (anexo em andamento) tem 0 linhas
+        try:
+            return os.path.getsize(os.path.join(self._diretorio_tanque(tanque), nome, "timestamp.bin"))
+        except FileNotFoundError:
+            return 0
+
+    def _indice(self, tanque, nome):
+        n_linhas = self._tamanho_indice(tanque, nome) // 8
+        if n_linhas == 0:
+            return np.empty(0, dtype='datetime64[ns]')
+        caminho = os.path.join(self._diretorio_tanque(tanque), nome, "timestamp.bin")
+        return np.memmap(caminho, dtype=np.int64, mode='r', shape=(n_linhas,)).view('datetime64[ns]')
+
+    def _ultimo_timestamp(self, tanque):
+        # Partições do fim ainda vazias (anexo em andamento) não contam
+        for nome in reversed(self.particoes(tanque)):
+            indice = self._indice(tanque, nome)
+            if len(indice):
+                return int(indice[-1].view(np.int64))
+        return None
+
+    def _ler_particao(self, tanque, nome, inicio_ns=None, fim_ns=None, linhas=None):
+        """Linhas da partição no intervalo de tempo, ou as linhas [i0, i1) dadas por linhas"""
+        diretorio = os.path.join(self._diretorio_tanque(tanque), nome)
+        indice = self._indice(tanque, nome)
+        n_linhas = len(indice)
+
+        if linhas is not None:
+            i0, i1 = linhas  # o índice só cresce: i1 já lido continua válido
+        else:
+            # Busca binária no índice de tempo da partição
+            inteiros = indice.view(np.int64)
+            i0 = 0 if inicio_ns is None else np.searchsorted(inteiros, inicio_ns, side='left')
+            i1 = n_linhas if fim_ns is None else np.searchsorted(inteiros, fim_ns, side='right')
+
+        colunas = {}
+        for coluna in self.colunas:
+            if i1 > i0:
+                valores = np.memmap(os.path.join(diretorio, f"{coluna}.bin"), dtype=np.float64, mode='r')
+                colunas[coluna] = np.array(valores[:n_linhas][i0:i1])
+            else:
+                colunas[coluna] = np.empty(0)
+        return np.array(indice[i0:i1]), colunas
+
+    def _montar_frame(self, blocos):
+        if not blocos:
+            return pd.DataFrame({'timestamp': pd.Series(dtype='datetime64[ns]'), **{c: pd.Series(dtype=float) for c in self.colunas}})
+        dados = {'timestamp': np.concatenate([timestamps for timestamps, _ in blocos])}
+        for coluna in self.colunas:
+            dados[coluna] = np.concatenate([colunas[coluna] for _, colunas in blocos])
+        return pd.DataFrame(dados)
+
+def abrir_armazenamento_demo(caminho_csv="dados_demo/qualidade_agua.csv", raiz="dados_demo/sensores"):
+    """
+    Abre o armazenamento dos dados de demonstração, importando o CSV
+    uma única vez caso o armazenamento ainda esteja vazio
+    Com a coluna 'tanque' (gerar_dados_demo.py --tanques N) cada tanque vira uma série própria
+    """
+    armazenamento = ArmazenamentoSensores(raiz)
+    if armazenamento.vazio() and os.path.exists(caminho_csv):
+        with medir("armazenamento.csv"):
+            dados = pd.read_csv(caminho_csv, parse_dates=['timestamp'])
+        if 'tanque' not in dados.columns:
+            armazenamento.anexar(dados)
+            return armazenamento
+        # O CSV é gravado em blocos intercalados por tanque; a ordenação estável
+        # mantém a ordem cronológica dentro de cada tanque
+        for tanque, leituras in dados.groupby('tanque', sort=False):
+            armazenamento.anexar(leituras.sort_values('timestamp', kind='stable'), tanque=str(tanque))
+    return armazenamento
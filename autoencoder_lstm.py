@@ -0,0 +1,251 @@
+# Autoencoder LSTM para a qualidade da água, com inferência em NumPy puro
+# Uso: python autoencoder_lstm.py --dados dados_demo/qualidade_agua.csv --saida modelo_qualidade_lstm.npz
+#
+# Arquitetura (mesma disposição de pesos de um autoencoder Keras):
+#   LSTM codificador (sensores -> ocultos, só o último estado)
+#   -> repetição do estado por `lookback` passos
+#   -> LSTM decodificador (ocultos -> ocultos, sequência completa)
+#   -> Dense por passo de tempo (ocultos -> sensores)
+# O erro de reconstrução de cada janela é a média dos quadrados da diferença
+# entre a janela normalizada e sua reconstrução
+
+import argparse
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+SENSORES = ['ph', 'temperatura', 'oxigenio', 'turbidez']
+LOOKBACK = 24
+DESVIOS_THRESHOLD = 3.0
+
+def _sigmoide(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+def _passo_lstm(entrada, h, c, recorrente):
+    """
+    Um passo da célula LSTM para todas as janelas do lote
+    entrada: projeção x @ W + b já calculada (janelas, 4*ocultos), portas na ordem i, f, c, o
+    """
+    z = entrada + h @ recorrente
+    i, f, g, o = np.split(z, 4, axis=1)
+    c = _sigmoide(f) * c + _sigmoide(i) * np.tanh(g)
+    h = _sigmoide(o) * np.tanh(c)
+    return h, c
+
+class AutoencoderLSTM:
+    """
+    Pesos:
+        codificador: kernel (sensores, 4*ocultos), recorrente (ocultos, 4*ocultos), bias (4*ocultos)
+        decodificador: kernel (ocultos, 4*ocultos), recorrente (ocultos, 4*ocultos), bias (4*ocultos)
+        saida: kernel (ocultos, sensores), bias (sensores)
+    minimo/maximo: faixa de cada sensor usada na normalização do treino
+    threshold: erro de reconstrução acima do qual a janela é anômala
+    """
+
+    NOMES_PESOS = [
+        'codificador_kernel', 'codificador_recorrente', 'codificador_bias',
+        'decodificador_kernel', 'decodificador_recorrente', 'decodificador_bias',
+        'saida_kernel', 'saida_bias',
+    ]
+
+    def __init__(self, pesos, minimo, maximo, threshold, lookback=LOOKBACK, sensores=SENSORES):
+        self.pesos = {nome: np.ascontiguousarray(pesos[nome], dtype=np.float32) for nome in self.NOMES_PESOS}
+        self.minimo = np.asarray(minimo, dtype=np.float64)
+        self.maximo = np.asarray(maximo, dtype=np.float64)
+        self.threshold = float(threshold)
+        self.lookback = int(lookback)
+        self.sensores = list(sensores)
+
+        amplitude = self.maximo - self.minimo
+        self._amplitude = np.where(amplitude > 0, amplitude, 1.0)
+
+    @property
+    def n_ocultos(self):
+        return self.pesos['codificador_recorrente'].shape[0]
+
+    @classmethod
+    def carregar(cls, caminho):
+        with np.load(caminho) as arquivo:
+            return cls(
+                {nome: arquivo[nome] for nome in cls.NOMES_PESOS},
+                arquivo['minimo'], arquivo['maximo'],
+                threshold=arquivo['threshold'],
+                lookback=arquivo['lookback'],
+                sensores=[str(s) for s in arquivo['sensores']]
+            )
+
+    @classmethod
+    def de_keras(cls, modelo, minimo, maximo, threshold, sensores=SENSORES):
+        """
+        Converte um autoencoder Keras treinado (LSTM -> RepeatVector -> LSTM -> TimeDistributed(Dense))
+        Os pesos vêm de modelo.get_weights(), na ordem das camadas
+        """
+        pesos = dict(zip(cls.NOMES_PESOS, modelo.get_weights()))
+        lookback = modelo.input_shape[1]
+        return cls(pesos, minimo, maximo, threshold, lookback=lookback, sensores=sensores)
+
+    def salvar(self, caminho):
+        np.savez(
+            caminho,
+            minimo=self.minimo, maximo=self.maximo,
+            threshold=self.threshold, lookback=self.lookback,
+            sensores=np.array(self.sensores),
+            **self.pesos
+        )
+
+    def normalizar(self, valores):
+        """Leituras brutas (..., sensores) na escala usada no treino"""
+        return ((np.asarray(valores, dtype=np.float64) - self.minimo) / self._amplitude).astype(np.float32)
+
+    def janelas(self, valores):
+        """
+        Todas as janelas de `lookback` leituras consecutivas da série, já normalizadas
+        Retorna uma visão (janelas, lookback, sensores), sem copiar as janelas
+        """
+        normalizados = self.normalizar(valores)
+        if len(normalizados) < self.lookback:
+            return np.empty((0, self.lookback, len(self.sensores)), dtype=np.float32)
+        return sliding_window_view(normalizados, self.lookback, axis=0).transpose(0, 2, 1)
+
+    def estados_decodificador(self, janelas):
+        """Estados ocultos do decodificador (janelas, lookback, ocultos) para janelas normalizadas"""
+        p = self.pesos
+        n_janelas, n_passos, _ = janelas.shape
+        n_ocultos = self.n_ocultos
+
+        # Projeção das entradas de todos os passos em uma única multiplicação
+        entradas = janelas.reshape(-1, janelas.shape[2]) @ p['codificador_kernel'] + p['codificador_bias']
+        entradas = entradas.reshape(n_janelas, n_passos, -1)
+
+        h = np.zeros((n_janelas, n_ocultos), dtype=np.float32)
+        c = np.zeros_like(h)
+        for t in range(n_passos):
+            h, c = _passo_lstm(entradas[:, t], h, c, p['codificador_recorrente'])
+
+        # A entrada do decodificador é o mesmo vetor latente em todos os passos
+        entrada = h @ p['decodificador_kernel'] + p['decodificador_bias']
+        estados = np.empty((n_janelas, n_passos, n_ocultos), dtype=np.float32)
+        h = np.zeros_like(h)
+        c = np.zeros_like(c)
+        for t in range(n_passos):
+            h, c = _passo_lstm(entrada, h, c, p['decodificador_recorrente'])
+            estados[:, t] = h
+        return estados
+
+    def reconstruir(self, janelas):
+        """Reconstrução (janelas, lookback, sensores) de janelas normalizadas"""
+        estados = self.estados_decodificador(np.asarray(janelas, dtype=np.float32))
+        return estados @ self.pesos['saida_kernel'] + self.pesos['saida_bias']
+
+    def erros_por_sensor(self, janelas, tamanho_lote=4096):
+        """
+        Erro quadrático médio de reconstrução de cada janela, por sensor (janelas, sensores)
+        As janelas são processadas em lotes para limitar a memória intermediária
+        """
+        erros = np.empty((len(janelas), len(self.sensores)), dtype=np.float64)
+        for inicio in range(0, len(janelas), tamanho_lote):
+            lote = np.asarray(janelas[inicio:inicio + tamanho_lote], dtype=np.float32)
+            erros[inicio:inicio + len(lote)] = np.mean((self.reconstruir(lote) - lote)**2, axis=1)
+        return erros
+
+    def erros_reconstrucao(self, janelas, tamanho_lote=4096):
+        """Erro de reconstrução de cada janela normalizada (janelas,)"""
+        return self.erros_por_sensor(janelas, tamanho_lote).mean(axis=1)
+
+    def erros_serie(self, valores, tamanho_lote=4096):
+        """
+        Erro de reconstrução de todas as janelas de uma série bruta (leituras, sensores)
+        O elemento k corresponde às leituras k .. k+lookback-1
+        """
+        return self.erros_reconstrucao(self.janelas(valores), tamanho_lote)
+
+def ajustar_autoencoder(series, lookback=LOOKBACK, n_ocultos=32, regularizacao=1e-2,
+                        max_janelas=50_000, semente=0, desvios=DESVIOS_THRESHOLD):
+    """
+    Ajusta um autoencoder às séries históricas (lista de arrays (leituras, sensores))
+    As LSTMs recebem pesos aleatórios fixos (reservatório) e apenas a camada
+    de saída é ajustada, por mínimos quadrados regularizados sobre todos os passos
+    das janelas: não exige treino por retropropagação e termina em segundos.
+    O threshold é mediana + `desvios` x MAD dos erros nas próprias janelas de
+    treino, robusto aos eventos anômalos que o histórico já contém
+    """
+    rng = np.random.default_rng(semente)
+    concatenadas = np.concatenate([np.asarray(s, dtype=np.float64) for s in series])
+    n_sensores = concatenadas.shape[1]
+
+    def kernel(n_entradas):
+        limite = np.sqrt(6 / (n_entradas + 4 * n_ocultos))
+        return rng.uniform(-limite, limite, (n_entradas, 4 * n_ocultos))
+
+    def recorrente():
+        # Ortogonal por porta, como na inicialização padrão das LSTMs
+        return np.hstack([np.linalg.qr(rng.normal(size=(n_ocultos, n_ocultos)))[0] for _ in range(4)])
+
+    def bias():
+        b = np.zeros(4 * n_ocultos)
+        b[n_ocultos:2 * n_ocultos] = 1.0  # porta de esquecimento
+        return b
+
+    pesos = {
+        'codificador_kernel': kernel(n_sensores), 'codificador_recorrente': recorrente(), 'codificador_bias': bias(),
+        'decodificador_kernel': kernel(n_ocultos), 'decodificador_recorrente': recorrente(), 'decodificador_bias': bias(),
+        'saida_kernel': np.zeros((n_ocultos, n_sensores)), 'saida_bias': np.zeros(n_sensores),
+    }
+    modelo = AutoencoderLSTM(
+        pesos, np.nanmin(concatenadas, axis=0), np.nanmax(concatenadas, axis=0),
+        threshold=np.inf, lookback=lookback, sensores=SENSORES[:n_sensores]
+    )
+
+    janelas = np.concatenate([modelo.janelas(s) for s in series])
+    if len(janelas) > max_janelas:
+        janelas = janelas[np.sort(rng.choice(len(janelas), max_janelas, replace=False))]
+    janelas = np.ascontiguousarray(janelas)
+
+    # Mínimos quadrados com bias: [estados, 1] @ [W; b] ~ janelas
+    estados = modelo.estados_decodificador(janelas).reshape(-1, n_ocultos).astype(np.float64)
+    alvos = janelas.reshape(-1, n_sensores).astype(np.float64)
+    estados = np.hstack([estados, np.ones((len(estados), 1))])
+    gram = estados.T @ estados + regularizacao * len(estados) * np.eye(n_ocultos + 1)
+    solucao = np.linalg.solve(gram, estados.T @ alvos)
+
+    modelo.pesos['saida_kernel'] = solucao[:-1].astype(np.float32)
+    modelo.pesos['saida_bias'] = solucao[-1].astype(np.float32)
+    erros = modelo.erros_reconstrucao(janelas)
+    mediana = np.median(erros)
+    mad = 1.4826 * np.median(np.abs(erros - mediana))
+    modelo.threshold = float(mediana + desvios * mad)
+    return modelo
+
+def main(argv=None):
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Ajusta o autoencoder LSTM da qualidade da água")
+    parser.add_argument("--dados", default="dados_demo/qualidade_agua.csv")
+    parser.add_argument("--saida", default="modelo_qualidade_lstm.npz")
+    parser.add_argument("--lookback", type=int, default=LOOKBACK)
+    parser.add_argument("--ocultos", type=int, default=32)
+    parser.add_argument("--desvios", type=float, default=DESVIOS_THRESHOLD, help="desvios (MAD) acima da mediana dos erros de treino")
+    parser.add_argument("--semente", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    dados = pd.read_csv(args.dados)
+    grupos = dados.groupby('tanque', sort=False) if 'tanque' in dados.columns else [(None, dados)]
+    series = [g[SENSORES].ffill().to_numpy(dtype=float) for _, g in grupos]
+
+    inicio = time.perf_counter()
+    modelo = ajustar_autoencoder(series, args.lookback, args.ocultos, semente=args.semente, desvios=args.desvios)
+    print(f"Autoencoder ajustado em {time.perf_counter() - inicio:.1f}s (threshold {modelo.threshold:.4f})")
+
+    janelas = np.concatenate([modelo.janelas(s) for s in series])
+    inicio = time.perf_counter()
+    erros = modelo.erros_reconstrucao(janelas)
+    duracao = time.perf_counter() - inicio
+    print(f"{len(janelas)} janelas em {duracao:.2f}s ({len(janelas) / duracao:,.0f} janelas/s), "
+          f"{np.mean(erros > modelo.threshold):.1%} acima do threshold")
+
+    modelo.salvar(args.saida)
+    print(f"Modelo salvo em {args.saida}")
+
+if __name__ == "__main__":
+    main()
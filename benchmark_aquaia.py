@@ -0,0 +1,333 @@
+# Benchmarks do caminho crítico do AquaIA
+# Uso: python benchmark_aquaia.py [--escalas 1_dia 30_dias] [--etapas carga_csv ...] [--comparar resultado_anterior.json]
+#
+# Cada caso (etapa x escala) roda em um processo novo, para que o pico de
+# memória (RSS) medido seja apenas dele. Os resultados são gravados em JSON
+# junto com o commit atual, permitindo comparar execuções entre commits
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+SENSORES = ['ph', 'temperatura', 'oxigenio', 'turbidez']
+INICIO_SERIE = pd.Timestamp("2025-01-01")
+SEMENTE = 42
+
+ESCALAS = {
+    '1_dia': {'tanques': 1, 'dias': 1, 'imagens': 12},
+    '30_dias': {'tanques': 1, 'dias': 30, 'imagens': 120},
+    '1_ano': {'tanques': 1, 'dias': 365, 'imagens': 1200},
+    '1000_tanques': {'tanques': 1000, 'dias': 2, 'imagens': 1200},
+}
+
+class EtapaIgnorada(Exception):
+    """A etapa não se aplica à escala ou depende de um modelo ausente"""
+
+# Dados sintéticos
+
+def gerar_serie(config, frequencia_minutos):
+    """Série longa (uma linha por tanque e leitura), sempre a mesma para a mesma configuração"""
+    from gerar_dados_demo import gerar_bloco_qualidade_agua, nome_tanque
+
+    n_leituras = int(config['dias'] * 24 * 60 / frequencia_minutos)
+    indices = np.arange(n_leituras)
+    blocos = []
+    for tanque in range(config['tanques']):
+        rng = np.random.default_rng([SEMENTE, tanque])
+        bloco = gerar_bloco_qualidade_agua(indices, frequencia_minutos, INICIO_SERIE, rng)
+        bloco.insert(1, 'tanque', nome_tanque(tanque, config['tanques']))
+        blocos.append(bloco)
+    return pd.concat(blocos, ignore_index=True)
+
+def gerar_imagens_teste(config, diretorio):
+    from gerar_dados_demo import TIPOS, gerar_imagens
+
+    gerar_imagens(max(1, config['imagens'] // len(TIPOS)), SEMENTE, diretorio)
+    return sorted(
+        os.path.join(diretorio, tipo, nome)
+        for tipo in TIPOS
+        for nome in os.listdir(os.path.join(diretorio, tipo))
+    )
+
+def sistema_com_modelos():
+    from modelos_orange import SistemaMonitoramentoIA
+
+    sistema = SistemaMonitoramentoIA()
+    sistema.carregar_modelos()
+    return sistema
+
+# Etapas: cada uma prepara os dados e retorna (função medida, itens processados por chamada)
+# e, opcionalmente, uma observação gravada junto com o caso
+
+def etapa_criar_sequencias_lstm(config, frequencia, diretorio):
+    from Orange.data.pandas_compat import table_from_frame
+    from preparar_dados import criar_sequencias_lstm
+
+    tabela = table_from_frame(gerar_serie(config, frequencia)[SENSORES])
+    return (lambda: criar_sequencias_lstm(tabela)), len(tabela)
+
+def etapa_detectar_anomalia_agua(config, frequencia, diretorio):
+    if config['tanques'] > 1:
+        raise EtapaIgnorada("um tanque por chamada; ver detectar_anomalia_lote")
+    sistema = sistema_com_modelos()
+    if not sistema.modelo_lstm:
+        raise EtapaIgnorada("modelo_qualidade_lstm (.npz ou .pkcls) não encontrado")
+
+    # Mesmo uso do dashboard: últimas 48 leituras, repetido em sequência
+    janela = gerar_serie(config, frequencia).tail(48)
+    n_chamadas = 100
+
+    def executar():
+        for _ in range(n_chamadas):
+            sistema.detectar_anomalia_agua(janela)
+    return executar, n_chamadas
+
+def etapa_detector_streaming(config, frequencia, diretorio):
+    if config['tanques'] > 1:
+        raise EtapaIgnorada("um detector por tanque; ver detectar_anomalia_lote")
+    from modelos_orange import DetectorAnomaliaStreaming
+
+    leituras = gerar_serie(config, frequencia)[SENSORES].to_dict('records')
+
+    def executar():
+        detector = DetectorAnomaliaStreaming()
+        for leitura in leituras:
+            detector.push(leitura)
+    return executar, len(leituras)
+
+def etapa_autoencoder_lstm(config, frequencia, diretorio):
+    from autoencoder_lstm import ajustar_autoencoder
+
+    # Erro de reconstrução de todas as janelas de todos os tanques
+    dados = gerar_serie(config, frequencia)
+    series = [g[SENSORES].to_numpy(dtype=float) for _, g in dados.groupby('tanque', sort=False)]
+    modelo = ajustar_autoencoder(series)
+    janelas = np.concatenate([modelo.janelas(s) for s in series])
+    return (lambda: modelo.erros_reconstrucao(janelas)), len(janelas)
+
+def etapa_detectar_anomalia_lote(config, frequencia, diretorio):
+    sistema = sistema_com_modelos()
+    if not sistema.modelo_lstm:
+        raise EtapaIgnorada("modelo_qualidade_lstm (.npz ou .pkcls) não encontrado")
+
+    dados = gerar_serie(config, frequencia)
+    return (lambda: sistema.detectar_anomalia_lote(dados)), config['tanques']
+
+def etapa_extrair_caracteristicas(config, frequencia, diretorio):
+    from diagnostico_imagens import extrair_caracteristicas_lote
+
+    imagens = gerar_imagens_teste(config, os.path.join(diretorio, "imagens"))
+    return (lambda: extrair_caracteristicas_lote(imagens)), len(imagens)
+
+def etapa_diagnosticar_parasito(config, frequencia, diretorio):
+    sistema = sistema_com_modelos()
+    if not sistema.modelo_cnn:
+        raise EtapaIgnorada("modelo_parasitos_cnn.pkcls não encontrado")
+    sistema.cache = None  # Medir a inferência, não o cache
+
+    imagem = gerar_imagens_teste({'imagens': 3}, os.path.join(diretorio, "imagens"))[0]
+    n_chamadas = 10
+
+    def executar():
+        for _ in range(n_chamadas):
+            sistema.diagnosticar_parasito(imagem)
+    return executar, n_chamadas
+
+def etapa_diagnosticar_lote(config, frequencia, diretorio):
+    sistema = sistema_com_modelos()
+    if not sistema.modelo_cnn:
+        raise EtapaIgnorada("modelo_parasitos_cnn.pkcls não encontrado")
+    sistema.cache = None
+
+    imagens = gerar_imagens_teste(config, os.path.join(diretorio, "imagens"))
+    return (lambda: sistema.diagnosticar_lote(imagens)), len(imagens)
+
+def etapa_carga_csv(config, frequencia, diretorio):
+    # Carga feita pelo dashboard antes do armazenamento colunar
+    caminho = os.path.join(diretorio, "qualidade_agua.csv")
+    gerar_serie(config, frequencia).to_csv(caminho, index=False)
+
+    def executar():
+        dados = pd.read_csv(caminho)
+        dados['timestamp'] = pd.to_datetime(dados['timestamp'])
+        return dados
+    return executar, sum(1 for _ in open(caminho)) - 1
+
+def etapa_armazenamento_ultimos(config, frequencia, diretorio):
+    from armazenamento_sensores import ArmazenamentoSensores
+
+    armazenamento = ArmazenamentoSensores(os.path.join(diretorio, "sensores"))
+    serie = gerar_serie(config, frequencia)
+    for tanque, dados in serie.groupby('tanque'):
+        armazenamento.anexar(dados, tanque=tanque)
+    tanque = armazenamento.tanques()[0]
+    armazenadas = int((serie['tanque'] == tanque).sum())
+
+    # Última semana de um tanque, como na página principal
+    n_semana = int(7 * 24 * 60 / frequencia)
+    observacao = []
+    if armazenadas <= n_semana:
+        observacao = [f"série com {armazenadas} leituras, menos que a semana pedida ({n_semana}): lê a série inteira"]
+    return (lambda: armazenamento.ultimos(n_semana, tanque=tanque)), min(n_semana, armazenadas), *observacao
+
+def etapa_reducao_series(config, frequencia, diretorio):
+    from reducao_series import PONTOS_GRAFICO, reduzir_frame
+
+    # Mesma redução aplicada aos gráficos do dashboard
+    dados = gerar_serie(config, frequencia)
+    if len(dados) <= PONTOS_GRAFICO:
+        raise EtapaIgnorada(f"{len(dados)} leituras já cabem em {PONTOS_GRAFICO} pontos: nada a reduzir")
+    return (lambda: reduzir_frame(dados, 'timestamp', ['ph', 'temperatura', 'oxigenio'])), len(dados)
+
+def etapa_gerar_imagens(config, frequencia, diretorio):
+    from gerar_dados_demo import TIPOS, gerar_imagens
+
+    por_classe = max(1, config['imagens'] // len(TIPOS))
+    saida = os.path.join(diretorio, "imagens_geradas")
+    return (lambda: gerar_imagens(por_classe, SEMENTE, saida)), por_classe * len(TIPOS)
+
+ETAPAS = {
+    'criar_sequencias_lstm': etapa_criar_sequencias_lstm,
+    'detectar_anomalia_agua': etapa_detectar_anomalia_agua,
+    'detector_streaming': etapa_detector_streaming,
+    'autoencoder_lstm': etapa_autoencoder_lstm,
+    'detectar_anomalia_lote': etapa_detectar_anomalia_lote,
+    'extrair_caracteristicas': etapa_extrair_caracteristicas,
+    'diagnosticar_parasito': etapa_diagnosticar_parasito,
+    'diagnosticar_lote': etapa_diagnosticar_lote,
+    'carga_csv': etapa_carga_csv,
+    'armazenamento_ultimos': etapa_armazenamento_ultimos,
+    'reducao_series': etapa_reducao_series,
+    'gerar_imagens': etapa_gerar_imagens,
+}
+
+# Execução
+
+def _rss_mb():
+    # ru_maxrss é dado em KB no Linux e em bytes no macOS
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 1024**2 if sys.platform == 'darwin' else pico / 1024
+
+def executar_caso(etapa, escala, frequencia, repeticoes):
+    """Roda um caso no processo atual (chamado em um processo novo para cada caso)"""
+    caso = {'etapa': etapa, 'escala': escala}
+    with tempfile.TemporaryDirectory(prefix="aquaia_bench_") as diretorio:
+        try:
+            executar, n_itens, *observacao = ETAPAS[etapa](ESCALAS[escala], frequencia, diretorio)
+        except EtapaIgnorada as e:
+            return {**caso, 'status': 'ignorado', 'motivo': str(e)}
+        if observacao:
+            caso['observacao'] = observacao[0]
+
+        rss_preparacao = _rss_mb()
+        latencias = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            executar()
+            latencias.append(time.perf_counter() - inicio)
+
+    mediana = statistics.median(latencias)
+    return {
+        **caso,
+        'status': 'ok',
+        'itens': n_itens,
+        'latencia_min_s': min(latencias),
+        'latencia_mediana_s': mediana,
+        'latencias_s': latencias,
+        'vazao_itens_s': n_itens / mediana if mediana > 0 else None,
+        'rss_preparacao_mb': rss_preparacao,
+        'pico_rss_mb': _rss_mb(),
+    }
+
+def _commit_atual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def comparar(atual, anterior, tolerancia):
+    """Imprime a variação da latência mediana de cada caso e retorna as regressões"""
+    base = {
+        (caso['etapa'], caso['escala']): caso
+        for caso in anterior['casos'] if caso['status'] == 'ok'
+    }
+    regressoes = []
+    print(f"\nComparação com {anterior.get('commit')} (tolerância {tolerancia:.0%}):")
+    for caso in atual['casos']:
+        referencia = base.get((caso['etapa'], caso['escala']))
+        if caso['status'] != 'ok' or referencia is None:
+            continue
+        razao = caso['latencia_mediana_s'] / referencia['latencia_mediana_s']
+        marcador = "REGRESSÃO" if razao > 1 + tolerancia else ""
+        print(f"  {caso['etapa']:<24} {caso['escala']:<13} {razao:6.2f}x {marcador}")
+        if marcador:
+            regressoes.append(caso)
+    return regressoes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks do caminho crítico do AquaIA")
+    parser.add_argument("--etapas", nargs="+", choices=list(ETAPAS), default=list(ETAPAS))
+    parser.add_argument("--escalas", nargs="+", choices=list(ESCALAS), default=list(ESCALAS))
+    parser.add_argument("--frequencia", type=float, default=1, help="minutos entre leituras dos dados sintéticos")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--saida", default="resultados_benchmark", help="diretório dos resultados JSON")
+    parser.add_argument("--comparar", default=None, help="JSON de uma execução anterior")
+    parser.add_argument("--tolerancia", type=float, default=0.10, help="aumento de latência aceito na comparação")
+    args = parser.parse_args(argv)
+
+    resultado = {
+        'commit': _commit_atual(),
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'frequencia_minutos': args.frequencia,
+        'repeticoes': args.repeticoes,
+        'casos': [],
+    }
+
+    for escala in args.escalas:
+        for etapa in args.etapas:
+            # Processo novo por caso: o pico de RSS não mistura casos
+            with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+                caso = pool.submit(executar_caso, etapa, escala, args.frequencia, args.repeticoes).result()
+            resultado['casos'].append(caso)
+
+            if caso['status'] == 'ok':
+                print(f"{etapa:<24} {escala:<13} {caso['latencia_mediana_s']*1000:10.2f} ms "
+                      f"{caso['vazao_itens_s']:14.1f} itens/s {caso['pico_rss_mb']:8.1f} MB")
+                if 'observacao' in caso:
+                    print(f"{'':<38} obs.: {caso['observacao']}")
+            else:
+                print(f"{etapa:<24} {escala:<13} ignorado: {caso['motivo']}")
+
+    os.makedirs(args.saida, exist_ok=True)
+    nome = f"{datetime.now():%Y%m%d_%H%M%S}_{resultado['commit'] or 'sem_commit'}.json"
+    caminho = os.path.join(args.saida, nome)
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados gravados em {caminho}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anterior = json.load(f)
+        if comparar(resultado, anterior, args.tolerancia):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
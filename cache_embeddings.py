@@ -0,0 +1,191 @@
+# Cache em disco das características e diagnósticos das imagens microscópicas
+# Indexado pelo hash do conteúdo: a mesma lâmina reenviada não é decodificada de novo
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from diagnostico_imagens import VERSAO_PREPROCESSAMENTO
+
+LIMITE_PADRAO_BYTES = 512 * 1024**2
+TAMANHO_BLOCO_HASH = 1024 * 1024
+
+def hash_conteudo(conteudo):
+    return hashlib.sha256(conteudo).hexdigest()
+
+def hash_origem(origem):
+    """
+    Hash do conteúdo da imagem, a partir de um caminho ou de um arquivo em memória
+    Arquivos são lidos em blocos: a imagem não é carregada inteira só para o hash
+    """
+    if isinstance(origem, (bytes, bytearray, memoryview)):
+        return hash_conteudo(origem)
+    if isinstance(origem, (str, os.PathLike)):
+        with open(origem, "rb") as f:
+            return _hash_blocos(f)
+    if hasattr(origem, "getbuffer"):
+        # BytesIO (e UploadedFile do Streamlit): hash sobre o próprio buffer, sem cópia
+        with origem.getbuffer() as buffer:
+            return hash_conteudo(buffer)
+    posicao = origem.tell()
+    try:
+        return _hash_blocos(origem)
+    finally:
+        origem.seek(posicao)
+
+def _hash_blocos(arquivo):
+    h = hashlib.sha256()
+    while bloco := arquivo.read(TAMANHO_BLOCO_HASH):
+        h.update(bloco)
+    return h.hexdigest()
+
+class CacheEmbeddings:
+    """
+    Cache LRU com tamanho máximo em bytes, organizado como:
+        <diretorio>/caracteristicas/<versao_preprocessamento>/<hash>.npy
+        <diretorio>/diagnosticos/<versao_preprocessamento>-<versao_modelo>/<hash>.json
+    O limite vale para todas as versões juntas: entradas de outras versões do
+    pré-processamento ou do modelo não são mais usadas por este processo (mas
+    podem ser por outro, ex.: após um rollback) e saem primeiro por serem as
+    menos recentes. A ordem de uso é mantida pelo mtime dos arquivos
+    """
+
+    def __init__(self, diretorio="dados_demo/cache_embeddings", limite_bytes=LIMITE_PADRAO_BYTES,
+                 versao_preprocessamento=VERSAO_PREPROCESSAMENTO, versao_modelo=None):
+        self.diretorio = diretorio
+        self.limite_bytes = limite_bytes
+        self.dir_caracteristicas = os.path.join(diretorio, "caracteristicas", versao_preprocessamento)
+        self.dir_diagnosticos = None
+        if versao_modelo is not None:
+            self.dir_diagnosticos = os.path.join(
+                diretorio, "diagnosticos", f"{versao_preprocessamento}-{versao_modelo}"
+            )
+
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # caminho -> tamanho, do menos para o mais recente
+        self._total_bytes = 0
+
+        self._indexar()
+
+    def chave(self, origem):
+        """Chave da imagem no cache: hash do seu conteúdo"""
+        return hash_origem(origem)
+
+    def obter_caracteristicas(self, chave):
+        caminho = os.path.join(self.dir_caracteristicas, f"{chave}.npy")
+        if not self._usar(caminho):
+            return None
+        return np.load(caminho)
+
+    def guardar_caracteristicas(self, chave, vetor):
+        caminho = os.path.join(self.dir_caracteristicas, f"{chave}.npy")
+        self._gravar(caminho, lambda f: np.save(f, np.asarray(vetor)))
+
+    def obter_diagnostico(self, chave):
+        if self.dir_diagnosticos is None:
+            return None
+        caminho = os.path.join(self.dir_diagnosticos, f"{chave}.json")
+        if not self._usar(caminho):
+            return None
+        with open(caminho, encoding="utf-8") as f:
+            return json.load(f)
+
+    def guardar_diagnostico(self, chave, diagnostico):
+        if self.dir_diagnosticos is None:
+            return
+        caminho = os.path.join(self.dir_diagnosticos, f"{chave}.json")
+        conteudo = json.dumps(diagnostico, ensure_ascii=False).encode("utf-8")
+        self._gravar(caminho, lambda f: f.write(conteudo))
+
+    def tamanho_bytes(self):
+        return self._total_bytes
+
+    def _usar(self, caminho):
+        """Marca a entrada como usada recentemente; False se não existir"""
+        with self._lock:
+            conhecida = caminho in self._entradas
+            if conhecida:
+                self._entradas.move_to_end(caminho)
+        if not conhecida and not self._adotar(caminho):
+            return False
+        try:
+            os.utime(caminho)
+        except FileNotFoundError:
+            with self._lock:
+                self._remover_entrada(caminho)
+            return False
+        return True
+
+    def _gravar(self, caminho, escrever):
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, "wb") as f:
+            escrever(f)
+        os.replace(temporario, caminho)
+
+        with self._lock:
+            self._remover_entrada(caminho)
+            tamanho = os.path.getsize(caminho)
+            self._entradas[caminho] = tamanho
+            self._total_bytes += tamanho
+            self._despejar()
+
+    def _adotar(self, caminho):
+        """
+        Entrada gravada por outro processo (retreino, reprocessamento, outro
+        worker do Streamlit) depois da indexação: passa a fazer parte do LRU
+        """
+        try:
+            tamanho = os.stat(caminho).st_size
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self._remover_entrada(caminho)
+            self._entradas[caminho] = tamanho
+            self._total_bytes += tamanho
+            self._despejar()
+        return True
+
+    def _despejar(self):
+        # Remove as entradas usadas há mais tempo até caber no limite
+        while self._total_bytes > self.limite_bytes and len(self._entradas) > 1:
+            caminho, tamanho = self._entradas.popitem(last=False)
+            self._total_bytes -= tamanho
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+
+    def _remover_entrada(self, caminho):
+        tamanho = self._entradas.pop(caminho, None)
+        if tamanho is not None:
+            self._total_bytes -= tamanho
+
+    def _diretorios_versoes(self):
+        for tipo in ("caracteristicas", "diagnosticos"):
+            pai = os.path.join(self.diretorio, tipo)
+            if os.path.isdir(pai):
+                for nome in os.listdir(pai):
+                    yield os.path.join(pai, nome)
+
+    def _indexar(self):
+        # Todas as versões entram no LRU; nenhuma é apagada só por ser de outra versão
+        arquivos = []
+        for diretorio in self._diretorios_versoes():
+            if not os.path.isdir(diretorio):
+                continue
+            with os.scandir(diretorio) as entradas:
+                for entrada in entradas:
+                    if entrada.name.endswith(".tmp"):
+                        continue
+                    info = entrada.stat()
+                    arquivos.append((info.st_mtime, entrada.path, info.st_size))
+
+        for _, caminho, tamanho in sorted(arquivos):
+            self._entradas[caminho] = tamanho
+            self._total_bytes += tamanho
+        self._despejar()
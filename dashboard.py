@@ -6,8 +6,18 @@ import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
-import time
+import io
+from concurrent.futures import ThreadPoolExecutor
 from modelos_orange import SistemaMonitoramentoIA
+from armazenamento_sensores import TANQUE_PADRAO, abrir_armazenamento_demo
+from agregacoes import AgregacoesSensores, escolher_resolucao
+from reducao_series import PONTOS_GRAFICO, reduzir, reduzir_frame
+from resultados import PARAMETROS, NivelAlerta, ResultadoAnomalia, ResultadoDiagnostico, formatar_valores
+from alertas import MotorAlertas
+from relatorios import GeradorRelatorios
+from preprocessamento_imagens import LIMITE_PIXELS_LAMINA, dimensoes, miniatura
+import instrumentacao
+from instrumentacao import cronometrado
 
 st.set_page_config(
     page_title="AquaIA - Monitoramento Inteligente",
@@ -19,23 +29,141 @@ st.set_page_config(
 def init_sistema_ia():
     sistema = SistemaMonitoramentoIA()
     sistema.carregar_modelos()
+    
+    # Novas versões dos modelos entram em uso sem reiniciar o dashboard
+    sistema.iniciar_registro()
     return sistema
 
+@st.cache_resource
+def init_armazenamento():
+    return abrir_armazenamento_demo()
+
+@st.cache_resource
+def init_agregacoes():
+    return AgregacoesSensores(init_armazenamento())
+
+@st.cache_resource
+def init_alertas():
+    # Somente leitura: os episódios são abertos e fechados pelo serviço de ingestão
+    return MotorAlertas(gravar=False)
+
+@st.cache_resource
+def init_relatorios():
+    # Relatórios montados em segundo plano a partir das agregações já em uso
+    return GeradorRelatorios(
+        init_armazenamento(),
+        agregacoes={TANQUE_PADRAO: init_agregacoes()},
+        alertas=init_alertas()
+    )
+
+@st.cache_resource
+def init_executor():
+    # Inferência fora da thread do script: a página continua respondendo
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="inferencia")
+
 sistema_ia = init_sistema_ia()
+armazenamento = init_armazenamento()
 
-st.sidebar.title("🐟 AquaIA Amapá")
-st.sidebar.markdown("Sistema Inteligente de Monitoramento Aquícola")
+INTERVALO_ATUALIZACAO = 30  # segundos entre atualizações do painel principal
+JANELA_PAINEL = pd.Timedelta(days=7)
 
-opcao = st.sidebar.selectbox(
-    "Selecione a funcionalidade:",
-    ["Dashboard Principal", "Diagnóstico de Parasitos", "Histórico e Relatórios"]
-)
+@cronometrado("dashboard.dados_recentes")
+def dados_recentes(tanque=TANQUE_PADRAO):
+    """
+    Última semana de leituras, mantida na sessão
+    Quando a versão dos dados muda, só as leituras gravadas depois da última
+    posição lida do armazenamento são lidas
+    """
+    versao = armazenamento.versao(tanque)
+    estado = st.session_state.setdefault(f"dados_{tanque}", {'versao': None, 'dados': None, 'posicao': None})
+    if estado['versao'] == versao:
+        return estado['dados'], versao
+    
+    if estado['dados'] is None or estado['dados'].empty:
+        ultimo = armazenamento.ultimo(tanque)
+        dados, posicao = armazenamento.ler_desde(
+            inicio=None if ultimo is None else ultimo - JANELA_PAINEL, tanque=tanque
+        )
+    else:
+        # Pela posição no armazenamento: leituras novas com o mesmo timestamp da última vista também entram
+        novos, posicao = armazenamento.ler_desde(estado['posicao'], tanque=tanque)
+        dados = pd.concat([estado['dados'], novos], ignore_index=True)
+        # A janela é de tempo, não de linhas: com sensores por minuto são ~10 mil leituras
+        inicio = dados['timestamp'].iloc[-1] - JANELA_PAINEL
+        dados = dados[dados['timestamp'] >= inicio].reset_index(drop=True)
+    
+    estado.update(versao=versao, dados=dados, posicao=posicao)
+    return dados, versao
 
-if opcao == "Dashboard Principal":
-    st.title("📊 Dashboard de Monitoramento em Tempo Real")
+# Resultados derivados dos dados: recalculados apenas quando a versão muda
+
+@st.cache_data(max_entries=8, show_spinner=False)
+@cronometrado("dashboard.analisar_anomalia")
+def analisar_anomalia(versao, versao_deteccao, tanque, _dados):
+    # versao_deteccao: trocar o modelo ou os limiares também invalida o resultado
+    return sistema_ia.detectar_anomalia_agua(_dados.tail(48), tanque=tanque)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+@cronometrado("dashboard.graficos")
+def figuras_tendencias(versao, _dados):
+    # Cada curva leva ao navegador no máximo PONTOS_GRAFICO pontos, com os picos preservados
+    fig_o2 = px.line(
+        reduzir_frame(_dados, 'timestamp', ['oxigenio']), x='timestamp', y='oxigenio',
+        title='Oxigênio Dissolvido (mg/L)',
+        color_discrete_sequence=['blue']
+    )
+    fig_o2.add_hline(y=4.0, line_dash="dash", line_color="red", 
+                     annotation_text="Limite Crítico")
     
-    dados_agua = pd.read_csv("dados_demo/qualidade_agua.csv")
-    dados_agua['timestamp'] = pd.to_datetime(dados_agua['timestamp'])
+    fig_ph = px.line(reduzir_frame(_dados, 'timestamp', ['ph']), x='timestamp', y='ph', title='pH')
+    fig_ph.add_hline(y=6.5, line_dash="dash", line_color="orange")
+    fig_ph.add_hline(y=8.5, line_dash="dash", line_color="orange")
+    
+    fig_temp = px.line(reduzir_frame(_dados, 'timestamp', ['temperatura']), x='timestamp', y='temperatura', 
+                      title='Temperatura (°C)', color_discrete_sequence=['red'])
+    return fig_o2, fig_ph, fig_temp
+
+@st.cache_data(max_entries=16, show_spinner=False)
+@cronometrado("dashboard.estatisticas_periodo")
+def estatisticas_periodo(versao, inicio, fim):
+    # Incorporar às agregações apenas as leituras novas
+    agregacoes = init_agregacoes()
+    agregacoes.sincronizar()
+    return agregacoes.estatisticas(inicio, fim)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+@cronometrado("dashboard.serie_periodo")
+def serie_periodo(versao, inicio, fim):
+    """Períodos longos são exibidos com médias por hora, dia ou semana"""
+    resolucao = escolher_resolucao(inicio, fim)
+    if resolucao is None:
+        return armazenamento.ler(inicio=inicio, fim=fim), None
+    
+    agregacoes = init_agregacoes()
+    agregacoes.sincronizar()
+    return agregacoes.serie(resolucao, inicio, fim), resolucao
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def miniatura_upload(file_id, _arquivo):
+    """Prévia reduzida do upload: fotos de dezenas de MP não vão inteiras ao navegador"""
+    return miniatura(_arquivo), dimensoes(_arquivo)
+
+def tabela_alertas(episodios):
+    return pd.DataFrame({
+        'Parâmetro': [PARAMETROS[e.parametro] for e in episodios],
+        'Nível': [e.nivel.rotulo for e in episodios],
+        'Nível máximo': [e.nivel_maximo.rotulo for e in episodios],
+        'Início': [e.inicio for e in episodios],
+        'Última ocorrência': [e.ultimo for e in episodios],
+        'Fim': [e.fim for e in episodios],
+        'Ocorrências': [e.n_ocorrencias for e in episodios],
+        'Score máximo': [round(e.score_maximo, 4) for e in episodios],
+    })
+
+@st.fragment(run_every=INTERVALO_ATUALIZACAO)
+def painel_tempo_real(tanque=TANQUE_PADRAO):
+    """Métricas, anomalias e tendências; reexecutado sozinho a cada atualização"""
+    dados_agua, versao = dados_recentes(tanque)
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -72,54 +200,106 @@ if opcao == "Dashboard Principal":
         )
     
     st.subheader("🚨 Análise de Anomalias (IA)")
-    resultado_anomalia = sistema_ia.detectar_anomalia_agua(dados_agua.tail(48))
+    resultado_anomalia = analisar_anomalia(versao, sistema_ia.versao_deteccao(), tanque, dados_agua)
     
-    if isinstance(resultado_anomalia, dict):
-        nivel = resultado_anomalia.get('nivel_alerta', 'NORMAL')
+    if isinstance(resultado_anomalia, ResultadoAnomalia):
+        nivel = resultado_anomalia.nivel_alerta
         
-        if nivel == 'CRÍTICO':
+        if nivel == NivelAlerta.CRITICO:
             st.error(f"⚠️ ALERTA CRÍTICO: Anomalia detectada!")
-        elif nivel == 'ATENÇÃO':
+        elif nivel == NivelAlerta.ATENCAO:
             st.warning(f"⚠️ ATENÇÃO: Condições anômalas detectadas")
         else:
             st.success("✅ Condições normais")
         
         col1, col2 = st.columns(2)
         with col1:
-            st.write(f"**Score de Anomalia:** {resultado_anomalia.get('score_anomalia', 'N/A')}")
-            st.write(f"**Parâmetro Crítico:** {resultado_anomalia.get('parametro_critico', 'N/A')}")
+            st.write(f"**Score de Anomalia:** {resultado_anomalia.score_anomalia:.4f}")
+            st.write(f"**Parâmetro Crítico:** {resultado_anomalia.nome_parametro_critico}")
         
         with col2:
-            valores = resultado_anomalia.get('valores_atuais', {})
+            valores = formatar_valores(resultado_anomalia.valores_atuais)
             for param, valor in valores.items():
                 st.write(f"**{param}:** {valor}")
     
-    st.subheader("📈 Tendências dos Últimos 7 Dias")
+    # Episódios abertos pelo serviço de ingestão, lidos do log de eventos
+    alertas = init_alertas()
+    alertas.sincronizar()
+    ativos = alertas.ativos(tanque)
+    if ativos:
+        st.markdown(f"**Alertas ativos:** {len(ativos)}")
+        st.dataframe(tabela_alertas(ativos), hide_index=True, use_container_width=True)
     
-    dados_semana = dados_agua.tail(7*24)  # Últimos 7 dias
+    st.subheader("📈 Tendências dos Últimos 7 Dias")
     
-    fig_o2 = px.line(
-        dados_semana, x='timestamp', y='oxigenio',
-        title='Oxigênio Dissolvido (mg/L)',
-        color_discrete_sequence=['blue']
-    )
-    fig_o2.add_hline(y=4.0, line_dash="dash", line_color="red", 
-                     annotation_text="Limite Crítico")
+    fig_o2, fig_ph, fig_temp = figuras_tendencias(versao, dados_agua)
     st.plotly_chart(fig_o2, use_container_width=True)
     
     col1, col2 = st.columns(2)
     
     with col1:
-        fig_ph = px.line(dados_semana, x='timestamp', y='ph', title='pH')
-        fig_ph.add_hline(y=6.5, line_dash="dash", line_color="orange")
-        fig_ph.add_hline(y=8.5, line_dash="dash", line_color="orange")
         st.plotly_chart(fig_ph, use_container_width=True)
     
     with col2:
-        fig_temp = px.line(dados_semana, x='timestamp', y='temperatura', 
-                          title='Temperatura (°C)', color_discrete_sequence=['red'])
         st.plotly_chart(fig_temp, use_container_width=True)
 
+@st.fragment(run_every=0.5)
+def aguardar_diagnostico():
+    """Acompanha a inferência em andamento sem bloquear a página"""
+    if st.session_state['diagnostico'][1].done():
+        st.rerun()
+    st.info("🔄 Analisando imagem com IA...")
+
+@st.fragment(run_every=0.5)
+def aguardar_relatorio():
+    """Mostra o progresso do relatório em andamento"""
+    pedido = st.session_state['relatorio']
+    if pedido.concluido:
+        st.rerun()
+    st.progress(pedido.progresso, text=f"🔄 {pedido.etapa}...")
+
+def exibir_diagnostico(resultado):
+    if isinstance(resultado, ResultadoDiagnostico):
+        st.subheader("📋 Resultado do Diagnóstico")
+        
+        diagnostico = resultado.diagnostico
+        confianca = f"{resultado.confianca:.2%}"
+        
+        if diagnostico == 'saudavel':
+            st.success(f"✅ **{diagnostico.upper()}** (Confiança: {confianca})")
+        else:
+            st.error(f"⚠️ **{diagnostico.upper()}** detectado (Confiança: {confianca})")
+        
+        st.subheader("📊 Probabilidades por Classe")
+        
+        df_probs = pd.DataFrame({
+            'Classe': [classe.title() for classe in resultado.classes],
+            'Probabilidade': resultado.probabilidades
+        })
+        
+        fig_probs = px.bar(df_probs, x='Classe', y='Probabilidade', 
+                          title='Distribuição de Probabilidades')
+        fig_probs.update_yaxes(tickformat='.0%')
+        st.plotly_chart(fig_probs, use_container_width=True)
+        
+        st.subheader("💊 Recomendações de Tratamento")
+        st.info(resultado.recomendacao)
+    else:
+        st.error(resultado)
+
+st.sidebar.title("🐟 AquaIA Amapá")
+st.sidebar.markdown("Sistema Inteligente de Monitoramento Aquícola")
+
+opcao = st.sidebar.selectbox(
+    "Selecione a funcionalidade:",
+    ["Dashboard Principal", "Diagnóstico de Parasitos", "Histórico e Relatórios"]
+)
+
+if opcao == "Dashboard Principal":
+    st.title("📊 Dashboard de Monitoramento em Tempo Real")
+    
+    painel_tempo_real()
+
 elif opcao == "Diagnóstico de Parasitos":
     st.title("🔬 Diagnóstico Rápido de Parasitos")
     st.markdown("Faça upload de uma imagem microscópica para diagnóstico automático")
@@ -135,41 +315,31 @@ elif opcao == "Diagnóstico de Parasitos":
         col1, col2 = st.columns([1, 1])
         
         with col1:
-            st.image(uploaded_file, caption="Imagem carregada", use_column_width=True)
+            try:
+                previa, (largura, altura) = miniatura_upload(uploaded_file.file_id, uploaded_file)
+            except Exception as e:
+                # Ex.: PNG acima do orçamento de pixels decodificados
+                st.error(f"Não foi possível abrir a imagem: {e}")
+                st.stop()
+            st.image(previa, caption=f"Imagem carregada ({largura}×{altura})", use_column_width=True)
+            if largura * altura > LIMITE_PIXELS_LAMINA:
+                st.caption("Lâmina grande: a análise é feita por ladrilhos")
         
         with col2:
             if st.button("🔍 Analisar Imagem", type="primary"):
-                with st.spinner("Analisando imagem com IA..."):
-                    time.sleep(2)  
-                    resultado = sistema_ia.diagnosticar_parasito(uploaded_file.name)
-                
-                if isinstance(resultado, dict):
-                    st.subheader("📋 Resultado do Diagnóstico")
-                    
-                    diagnostico = resultado['diagnostico']
-                    confianca = resultado['confianca']
-                    
-                    if diagnostico == 'saudavel':
-                        st.success(f"✅ **{diagnostico.upper()}** (Confiança: {confianca})")
-                    else:
-                        st.error(f"⚠️ **{diagnostico.upper()}** detectado (Confiança: {confianca})")
-                    
-                    st.subheader("📊 Probabilidades por Classe")
-                    probs = resultado['probabilidades']
-                    
-                    df_probs = pd.DataFrame([
-                        {'Classe': k.title(), 'Probabilidade': v} 
-                        for k, v in probs.items()
-                    ])
-                    
-                    fig_probs = px.bar(df_probs, x='Classe', y='Probabilidade', 
-                                      title='Distribuição de Probabilidades')
-                    st.plotly_chart(fig_probs, use_container_width=True)
-                    
-                    st.subheader("💊 Recomendações de Tratamento")
-                    st.info(resultado['recomendacao'])
+                # A imagem é copiada para a memória e analisada em segundo plano
+                conteudo = io.BytesIO(uploaded_file.getvalue())
+                st.session_state['diagnostico'] = (
+                    uploaded_file.file_id,
+                    init_executor().submit(sistema_ia.diagnosticar_parasito, conteudo)
+                )
+            
+            pedido = st.session_state.get('diagnostico')
+            if pedido is not None and pedido[0] == uploaded_file.file_id:
+                if pedido[1].done():
+                    exibir_diagnostico(pedido[1].result())
                 else:
-                    st.error(resultado)
+                    aguardar_diagnostico()
     
     st.subheader("📚 Guia de Referência")
     
@@ -202,8 +372,7 @@ elif opcao == "Diagnóstico de Parasitos":
 elif opcao == "Histórico e Relatórios":
     st.title("📈 Histórico e Análise de Tendências")
     
-    dados_agua = pd.read_csv("dados_demo/qualidade_agua.csv")
-    dados_agua['timestamp'] = pd.to_datetime(dados_agua['timestamp'])
+    primeiro_registro, ultimo_registro = armazenamento.intervalo()
     
     # Filtros
     col1, col2 = st.columns(2)
@@ -211,51 +380,62 @@ elif opcao == "Histórico e Relatórios":
     with col1:
         data_inicio = st.date_input(
             "Data de início",
-            value=dados_agua['timestamp'].min().date()
+            value=primeiro_registro.date()
         )
     
     with col2:
         data_fim = st.date_input(
             "Data de fim",
-            value=dados_agua['timestamp'].max().date()
+            value=ultimo_registro.date()
         )
     
-    # Filtrar dados
-    mask = (dados_agua['timestamp'].dt.date >= data_inicio) & \
-           (dados_agua['timestamp'].dt.date <= data_fim)
-    dados_filtrados = dados_agua.loc[mask]
+    inicio = pd.Timestamp(data_inicio)
+    fim = pd.Timestamp(data_fim) + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+    
+    versao = armazenamento.versao()
     
     # Estatísticas resumo
     st.subheader("📊 Estatísticas do Período")
     
-    stats = dados_filtrados[['ph', 'temperatura', 'oxigenio', 'turbidez']].describe()
+    stats = estatisticas_periodo(versao, inicio, fim)
     st.dataframe(stats.round(2))
     
+    dados_filtrados, resolucao = serie_periodo(versao, inicio, fim)
+    
     # Gráfico combinado
     st.subheader("📈 Tendências Históricas")
+    if resolucao is not None:
+        st.caption(f"Médias por {resolucao}; a faixa mostra o mínimo e o máximo de cada {resolucao}")
     
     fig = go.Figure()
     
-    fig.add_trace(go.Scatter(
-        x=dados_filtrados['timestamp'], 
-        y=dados_filtrados['ph'],
-        name='pH', 
-        yaxis='y'
-    ))
-    
-    fig.add_trace(go.Scatter(
-        x=dados_filtrados['timestamp'], 
-        y=dados_filtrados['temperatura'],
-        name='Temperatura (°C)', 
-        yaxis='y2'
-    ))
-    
-    fig.add_trace(go.Scatter(
-        x=dados_filtrados['timestamp'], 
-        y=dados_filtrados['oxigenio'],
-        name='O₂ (mg/L)', 
-        yaxis='y3'
-    ))
+    # Cada curva é reduzida separadamente ao número de pontos que o gráfico consegue mostrar
+    for coluna, nome, eixo in [('ph', 'pH', 'y'), ('temperatura', 'Temperatura (°C)', 'y2'), ('oxigenio', 'O₂ (mg/L)', 'y3')]:
+        if resolucao is not None:
+            # Com agregações, a média sozinha esconde picos: desenha a faixa entre
+            # o mínimo e o máximo de cada balde (máximo primeiro, o mínimo preenche até ele)
+            for sufixo, preenchimento in (('_max', None), ('_min', 'tonexty')):
+                x, y = reduzir(dados_filtrados['timestamp'], dados_filtrados[coluna + sufixo], PONTOS_GRAFICO)
+                fig.add_trace(go.Scatter(
+                    x=x,
+                    y=y,
+                    name=f"{nome} {sufixo[1:]}",
+                    yaxis=eixo,
+                    fill=preenchimento,
+                    mode='lines',
+                    line=dict(width=0),
+                    opacity=0.3,
+                    legendgroup=coluna,
+                    showlegend=False
+                ))
+        x, y = reduzir(dados_filtrados['timestamp'], dados_filtrados[coluna], PONTOS_GRAFICO)
+        fig.add_trace(go.Scatter(
+            x=x, 
+            y=y,
+            name=nome, 
+            yaxis=eixo,
+            legendgroup=coluna
+        ))
     
     # Layout com múltiplos eixos Y
     fig.update_layout(
@@ -269,10 +449,39 @@ elif opcao == "Histórico e Relatórios":
     
     st.plotly_chart(fig, use_container_width=True)
     
-    # Exportar relatório
+    # Alertas encerrados no período (histórico limitado aos episódios mais recentes)
+    alertas = init_alertas()
+    alertas.sincronizar()
+    encerrados = [e for e in alertas.historico() if inicio <= e.fim <= fim]
+    st.subheader("🚨 Alertas Encerrados")
+    if encerrados:
+        st.dataframe(tabela_alertas(encerrados).assign(Tanque=[e.tanque for e in encerrados]),
+                     hide_index=True, use_container_width=True)
+    else:
+        st.caption("Nenhum alerta encerrado no período")
+    
+    # Exportar relatório: gerado em segundo plano, reaproveitado se já existir
     if st.button("📄 Gerar Relatório PDF"):
-        st.success("Relatório gerado! (Funcionalidade simulada)")
-        st.balloons()
+        st.session_state['relatorio'] = init_relatorios().solicitar(inicio, fim)
+    
+    pedido = st.session_state.get('relatorio')
+    if pedido is not None and (pedido.inicio, pedido.fim) == (inicio, fim):
+        if not pedido.concluido:
+            aguardar_relatorio()
+        elif pedido.pronto:
+            st.download_button("⬇️ Baixar Relatório", pedido.conteudo(), pedido.nome_arquivo, "application/pdf")
+        else:
+            st.error(pedido.erro or "Relatório não encontrado: gere novamente")
+
+# Métricas de instrumentação (AQUAIA_INSTRUMENTACAO=1)
+if instrumentacao.ativa():
+    with st.sidebar.expander("⏱️ Instrumentação"):
+        metricas = instrumentacao.exportar_json()
+        st.dataframe(
+            pd.DataFrame(metricas['etapas']).T[['contagem', 'media_s', 'maximo_s']],
+            use_container_width=True
+        )
+        st.download_button("Prometheus", instrumentacao.exportar_prometheus(), "metricas.prom", "text/plain")
 
 # Footer
 st.sidebar.markdown("---")
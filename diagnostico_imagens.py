@@ -0,0 +1,112 @@
+# Pipeline de inferência do diagnóstico de parasitos a partir de imagens microscópicas
+# Decodifica as imagens, calcula o vetor de características e aplica o modelo
+# treinado no Orange (Random Forest/SVM do parasitos_cnn_workflow.ows) em lote
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from preprocessamento_imagens import decodificar, ladrilhos, normalizar
+
+# Descritor: média de cada canal numa grade 8x8 + histograma de cor por canal
+GRADE_EMBEDDING = 8
+N_COMPARTIMENTOS_COR = 16
+FAIXA_HISTOGRAMA = (-2.2, 2.7)  # Faixa dos pixels após a normalização
+
+CLASSE_SAUDAVEL = 'saudavel'
+
+# Alterar sempre que o pré-processamento ou o descritor mudarem
+VERSAO_PREPROCESSAMENTO = "4"
+
+DIMENSAO_EMBEDDING = GRADE_EMBEDDING * GRADE_EMBEDDING * 3 + N_COMPARTIMENTOS_COR * 3
+NOMES_CARACTERISTICAS = [f"emb_{i:03d}" for i in range(DIMENSAO_EMBEDDING)]
+
+def calcular_embedding(pixels):
+    """Vetor de características de uma imagem já pré-processada"""
+    altura, largura, canais = pixels.shape
+    g = GRADE_EMBEDDING
+    recorte = pixels[:altura - altura % g, :largura - largura % g]
+    grade = recorte.reshape(g, altura // g, g, largura // g, canais).mean(axis=(1, 3))
+
+    histogramas = [
+        np.histogram(pixels[..., canal], bins=N_COMPARTIMENTOS_COR, range=FAIXA_HISTOGRAMA)[0]
+        for canal in range(canais)
+    ]
+    histogramas = np.concatenate(histogramas) / (altura * largura)
+
+    return np.concatenate([grade.ravel(), histogramas]).astype(np.float32)
+
+def embedding_imagem(origem):
+    """Decodifica e calcula o vetor de características de uma imagem"""
+    # Os pixels normalizados só vivem até o cálculo: buffer reaproveitado da thread
+    return calcular_embedding(normalizar(decodificar(origem)))
+
+def embeddings_ladrilhos(origem):
+    """Vetores de características de cada ladrilho de uma lâmina grande (n_ladrilhos, DIMENSAO_EMBEDDING)"""
+    return np.stack([calcular_embedding(pixels) for pixels in ladrilhos(origem)])
+
+def extrair_caracteristicas_lote(origens, n_processos=None, tamanho_lote=32, cache=None, chaves=None):
+    """
+    Calcula os vetores de características de várias imagens
+    Caminhos são distribuídos entre processos (todos os núcleos por padrão);
+    arquivos em memória são processados no próprio processo
+    cache: CacheEmbeddings opcional; imagens já vistas não são decodificadas
+    chaves: chaves de cache já calculadas para as origens
+    Retorna um array (n_imagens, DIMENSAO_EMBEDDING)
+    """
+    origens = list(origens)
+    if not origens:
+        return np.empty((0, DIMENSAO_EMBEDDING), dtype=np.float32)
+
+    if cache is not None:
+        chaves = chaves if chaves is not None else [cache.chave(o) for o in origens]
+        vetores = [cache.obter_caracteristicas(chave) for chave in chaves]
+        faltando = [i for i, vetor in enumerate(vetores) if vetor is None]
+        if faltando:
+            novos = extrair_caracteristicas_lote([origens[i] for i in faltando], n_processos, tamanho_lote)
+            for i, vetor in zip(faltando, novos):
+                cache.guardar_caracteristicas(chaves[i], vetor)
+                vetores[i] = vetor
+        return np.stack(vetores)
+
+    paralelizavel = all(isinstance(o, (str, os.PathLike)) for o in origens)
+    n_processos = n_processos or os.cpu_count() or 1
+
+    if not paralelizavel or n_processos == 1 or len(origens) == 1:
+        return np.stack([embedding_imagem(o) for o in origens])
+
+    # Lotes menores que tamanho_lote quando há poucas imagens por núcleo
+    chunksize = max(1, min(tamanho_lote, len(origens) // (4 * n_processos)))
+    with ProcessPoolExecutor(max_workers=min(n_processos, len(origens))) as pool:
+        return np.stack(list(pool.map(embedding_imagem, origens, chunksize=chunksize)))
+
+def prever_probabilidades(modelo, caracteristicas):
+    """
+    Aplica o modelo Orange a todas as linhas de uma só vez
+    Retorna (nomes das classes, matriz de probabilidades)
+    """
+    from Orange.base import Model
+    from Orange.data import Domain, Table
+
+    atributos = modelo.original_domain.attributes
+    if len(atributos) != caracteristicas.shape[1]:
+        raise ValueError(
+            f"Modelo espera {len(atributos)} características, "
+            f"o pré-processamento gera {caracteristicas.shape[1]}"
+        )
+
+    dados = Table.from_numpy(Domain(atributos), caracteristicas)
+    probabilidades = modelo(dados, Model.Probs)
+    return list(modelo.domain.class_var.values), probabilidades
+
+def probabilidades_lamina(classes, probabilidades):
+    """
+    Probabilidades de uma lâmina a partir das de seus ladrilhos: as do ladrilho
+    mais suspeito (menor probabilidade de saudável), para que um parasito em
+    um único campo não seja diluído pelos demais
+    """
+    classes = list(classes)
+    if CLASSE_SAUDAVEL not in classes:
+        return probabilidades.mean(axis=0)
+    return probabilidades[np.argmin(probabilidades[:, classes.index(CLASSE_SAUDAVEL)])]
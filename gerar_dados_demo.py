@@ -1,102 +1,195 @@
 # Script para gerar dados simulados
 # Salve como: gerar_dados_demo.py
+# Uso: python gerar_dados_demo.py --imagens 50 --tanques 1 --dias 30 --frequencia 60 --semente 42
 
-import pandas as pd
-import numpy as np
+import argparse
 import os
-from PIL import Image, ImageDraw
-import random
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
-# Criar diretório para dados
-os.makedirs("dados_demo", exist_ok=True)
-os.makedirs("dados_demo/imagens/saudavel", exist_ok=True)
-os.makedirs("dados_demo/imagens/ictio", exist_ok=True)
-os.makedirs("dados_demo/imagens/monogenoidea", exist_ok=True)
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw
+
+TIPOS = ['saudavel', 'ictio', 'monogenoidea']
+INICIO_REPRODUTIVEL = "2024-01-01"  # início padrão quando a semente é informada
 
 # 1. Gerar imagens sintéticas de parasitos
-def criar_imagem_parasito(tipo, idx):
+def criar_imagem_parasito(tipo, idx, semente, diretorio="dados_demo/imagens"):
+    # Gerador próprio por imagem: o resultado não depende da ordem de execução
+    rng = np.random.default_rng([semente, TIPOS.index(tipo), idx])
     img = Image.new('RGB', (224, 224), color='lightblue')
     draw = ImageDraw.Draw(img)
-    
+
     if tipo == 'saudavel':
         # Imagem limpa, apenas algumas células normais
         for _ in range(5):
-            x, y = random.randint(20, 200), random.randint(20, 200)
+            x, y = rng.integers(20, 201, size=2)
             draw.ellipse([x-10, y-10, x+10, y+10], fill='lightgreen')
-    
+
     elif tipo == 'ictio':
         # Pontos brancos característicos do íctio
         for _ in range(15):
-            x, y = random.randint(20, 200), random.randint(20, 200)
+            x, y = rng.integers(20, 201, size=2)
             draw.ellipse([x-5, y-5, x+5, y+5], fill='white')
             draw.ellipse([x-3, y-3, x+3, y+3], fill='gray')
-    
+
     elif tipo == 'monogenoidea':
         # Estruturas alongadas típicas de monogenoidea
         for _ in range(8):
-            x, y = random.randint(20, 200), random.randint(20, 200)
+            x, y = rng.integers(20, 201, size=2)
             draw.rectangle([x-15, y-3, x+15, y+3], fill='darkred')
             draw.ellipse([x-20, y-5, x-10, y+5], fill='red')
-    
-    img.save(f"dados_demo/imagens/{tipo}/amostra_{idx:03d}.jpg")
 
-# Gerar 50 imagens de cada tipo
-for tipo in ['saudavel', 'ictio', 'monogenoidea']:
-    for i in range(50):
-        criar_imagem_parasito(tipo, i)
+    img.save(os.path.join(diretorio, tipo, f"amostra_{idx:03d}.jpg"))
+
+def _criar_imagem(tarefa):
+    criar_imagem_parasito(*tarefa)
+
+def gerar_imagens(n_por_classe, semente, diretorio="dados_demo/imagens", n_processos=None):
+    """Desenha as imagens de todas as classes em um pool de processos"""
+    for tipo in TIPOS:
+        os.makedirs(os.path.join(diretorio, tipo), exist_ok=True)
+
+    tarefas = [(tipo, i, semente, diretorio) for tipo in TIPOS for i in range(n_por_classe)]
+    n_processos = n_processos or os.cpu_count() or 1
+    chunksize = max(1, len(tarefas) // (4 * n_processos))
+
+    with ProcessPoolExecutor(max_workers=n_processos) as pool:
+        for _ in pool.map(_criar_imagem, tarefas, chunksize=chunksize):
+            pass
+
+    return len(tarefas)
+
+# 2. Gerar dados de qualidade da água
+def nome_tanque(indice, n_tanques):
+    return 'principal' if n_tanques == 1 else f"tanque_{indice:03d}"
 
-print("Imagens sintéticas criadas!")
+def gerar_bloco_qualidade_agua(indices, frequencia_minutos, inicio, rng, deslocamento_horas=0):
+    """
+    Gera as leituras de um trecho da série de forma vetorizada
+    indices: posições das leituras na série (0, 1, 2, ...)
+    deslocamento_horas: atraso dos eventos críticos em relação ao início
+    """
+    n = len(indices)
+    horas = indices * (frequencia_minutos / 60)
 
-# 2. Gerar dados de qualidade da água (30 dias, leituras a cada hora)
-def gerar_dados_qualidade_agua():
-    start_date = datetime.now() - timedelta(days=30)
-    dados = []
-    
     # Parâmetros base normais
     ph_base = 7.2
     temp_base = 28.0
     o2_base = 6.5
     turbidez_base = 15.0
-    
-    for i in range(30 * 24):  # 30 dias * 24 horas
-        timestamp = start_date + timedelta(hours=i)
-        
-        # Variação natural + algumas anomalias
-        ph = ph_base + np.random.normal(0, 0.3)
-        temp = temp_base + np.random.normal(0, 1.5) + 3*np.sin(2*np.pi*i/24)  # ciclo diário
-        o2 = o2_base + np.random.normal(0, 0.8) - 2*np.sin(2*np.pi*i/24)  # menos O2 de noite
-        turbidez = turbidez_base + np.random.normal(0, 5)
-        
-        # Inserir algumas anomalias (eventos críticos)
-        if 200 <= i <= 220:  # Evento de baixo oxigênio (dia 8-9)
-            o2 *= 0.4
-            ph += 0.8
-        elif 400 <= i <= 430:  # Evento de alta turbidez (dia 16-17)
-            turbidez *= 2.5
-            temp += 2
-        
-        # Garantir limites realistas
-        ph = np.clip(ph, 5.5, 9.0)
-        temp = np.clip(temp, 20, 35)
-        o2 = np.clip(o2, 0.5, 12)
-        turbidez = np.clip(turbidez, 2, 80)
-        
-        dados.append({
-            'timestamp': timestamp,
-            'ph': round(ph, 2),
-            'temperatura': round(temp, 2),
-            'oxigenio': round(o2, 2),
-            'turbidez': round(turbidez, 2)
-        })
-    
-    df = pd.DataFrame(dados)
-    df.to_csv("dados_demo/qualidade_agua.csv", index=False)
+
+    # Variação natural + algumas anomalias
+    ciclo_diario = np.sin(2*np.pi*horas/24)
+    ph = ph_base + rng.normal(0, 0.3, n)
+    temp = temp_base + rng.normal(0, 1.5, n) + 3*ciclo_diario  # ciclo diário
+    o2 = o2_base + rng.normal(0, 0.8, n) - 2*ciclo_diario  # menos O2 de noite
+    turbidez = turbidez_base + rng.normal(0, 5, n)
+
+    # Inserir algumas anomalias (eventos críticos)
+    horas_evento = horas - deslocamento_horas
+    baixo_o2 = (horas_evento >= 200) & (horas_evento <= 220)  # Evento de baixo oxigênio (dia 8-9)
+    alta_turbidez = (horas_evento >= 400) & (horas_evento <= 430)  # Evento de alta turbidez (dia 16-17)
+    o2 = np.where(baixo_o2, o2 * 0.4, o2)
+    ph = ph + 0.8 * baixo_o2
+    turbidez = np.where(alta_turbidez, turbidez * 2.5, turbidez)
+    temp = temp + 2 * alta_turbidez
+
+    # Garantir limites realistas
+    return pd.DataFrame({
+        'timestamp': inicio + pd.to_timedelta(indices * frequencia_minutos, unit='min'),
+        'ph': np.round(np.clip(ph, 5.5, 9.0), 2),
+        'temperatura': np.round(np.clip(temp, 20, 35), 2),
+        'oxigenio': np.round(np.clip(o2, 0.5, 12), 2),
+        'turbidez': np.round(np.clip(turbidez, 2, 80), 2)
+    })
+
+def gerar_dados_qualidade_agua(semente, dias=30, frequencia_minutos=60, n_tanques=1, inicio=None,
+                               caminho_csv="dados_demo/qualidade_agua.csv", armazenamento=None,
+                               tamanho_bloco=100_000):
+    """
+    Gera a série de cada tanque em blocos e grava cada bloco assim que fica
+    pronto, sem manter a série inteira em memória
+    Com mais de um tanque o CSV ganha a coluna 'tanque'
+    armazenamento: ArmazenamentoSensores opcional que também recebe os blocos
+    """
+    inicio = pd.Timestamp(inicio if inicio is not None else datetime.now() - timedelta(days=dias))
+    n_leituras = int(dias * 24 * 60 / frequencia_minutos)
+
+    # Eventos críticos em momentos diferentes para cada tanque
+    rng_eventos = np.random.default_rng([semente, n_tanques])
+    deslocamentos = np.r_[0, rng_eventos.integers(0, 24 * 7, n_tanques - 1)]
+
+    if os.path.dirname(caminho_csv):
+        os.makedirs(os.path.dirname(caminho_csv), exist_ok=True)
+
+    total = 0
+    primeiro_bloco = None
+    for n_bloco, inicio_bloco in enumerate(range(0, n_leituras, tamanho_bloco)):
+        indices = np.arange(inicio_bloco, min(inicio_bloco + tamanho_bloco, n_leituras))
+
+        for tanque in range(n_tanques):
+            rng = np.random.default_rng([semente, tanque, n_bloco])
+            bloco = gerar_bloco_qualidade_agua(indices, frequencia_minutos, inicio, rng, deslocamentos[tanque])
+
+            if armazenamento is not None:
+                armazenamento.anexar(bloco, tanque=nome_tanque(tanque, n_tanques))
+            if n_tanques > 1:
+                bloco.insert(1, 'tanque', nome_tanque(tanque, n_tanques))
+
+            bloco.to_csv(caminho_csv, mode='w' if total == 0 else 'a', header=total == 0, index=False)
+            total += len(bloco)
+            if primeiro_bloco is None:
+                primeiro_bloco = bloco.head()
+
     print("Dados de qualidade da água criados!")
-    return df
+    return total, primeiro_bloco
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera dados simulados (imagens e qualidade da água) para o AquaIA")
+    parser.add_argument("--imagens", type=int, default=50, help="imagens por classe de parasito")
+    parser.add_argument("--tanques", type=int, default=1, help="quantidade de tanques")
+    parser.add_argument("--dias", type=float, default=30, help="dias de leituras por tanque")
+    parser.add_argument("--frequencia", type=float, default=60, help="minutos entre leituras")
+    parser.add_argument("--semente", type=int, default=None, help="semente para dados reprodutíveis")
+    parser.add_argument("--inicio", default=None,
+                        help=f"data/hora da primeira leitura (padrão: {INICIO_REPRODUTIVEL} com --semente, senão agora - dias)")
+    parser.add_argument("--saida", default="dados_demo", help="diretório de saída")
+    parser.add_argument("--processos", type=int, default=None, help="processos para desenhar as imagens")
+    parser.add_argument("--tamanho-bloco", type=int, default=100_000, help="leituras por bloco gravado")
+    parser.add_argument("--armazenamento", action="store_true",
+                        help="também grava as leituras no armazenamento colunar (<saida>/sensores)")
+    args = parser.parse_args(argv)
+
+    semente = args.semente if args.semente is not None else int(np.random.SeedSequence().entropy % 2**32)
+    # Com semente a série inteira é reprodutível, inclusive as datas
+    inicio = args.inicio
+    if inicio is None and args.semente is not None:
+        inicio = INICIO_REPRODUTIVEL
+    print(f"Semente: {semente}")
+
+    n_imagens = gerar_imagens(args.imagens, semente, os.path.join(args.saida, "imagens"), args.processos)
+    print(f"Imagens sintéticas criadas! ({n_imagens})")
+
+    armazenamento = None
+    if args.armazenamento:
+        from armazenamento_sensores import ArmazenamentoSensores
+        armazenamento = ArmazenamentoSensores(os.path.join(args.saida, "sensores"))
+
+    total, primeiras = gerar_dados_qualidade_agua(
+        semente,
+        dias=args.dias,
+        frequencia_minutos=args.frequencia,
+        n_tanques=args.tanques,
+        inicio=inicio,
+        caminho_csv=os.path.join(args.saida, "qualidade_agua.csv"),
+        armazenamento=armazenamento,
+        tamanho_bloco=args.tamanho_bloco
+    )
+    print(f"Dataset criado com {total} registros")
+    print("\nPrimeiras 5 linhas:")
+    print(primeiras)
 
-# Gerar os dados
-df_agua = gerar_dados_qualidade_agua()
-print(f"Dataset criado com {len(df_agua)} registros")
-print("\nPrimeiras 5 linhas:")
-print(df_agua.head())
\ No newline at end of file
+if __name__ == "__main__":
+    main()
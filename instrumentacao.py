@@ -0,0 +1,277 @@
+# Instrumentação do caminho crítico: tempos e contadores por etapa
+# Ativada pela variável de ambiente AQUAIA_INSTRUMENTACAO:
+#   (vazia) ou 0   desativada: medir() devolve um contexto vazio compartilhado
+#                  e os contadores retornam na primeira linha
+#   1              tempos (histogramas) e contadores por etapa
+#   perfil         também acumula um cProfile das etapas medidas (arquivo .prof)
+#   amostragem     também amostra as pilhas de todas as threads em segundo
+#                  plano e grava no formato "folded" (flamegraph.pl, speedscope,
+#                  o mesmo do py-spy record -f raw)
+# Os perfis são gravados em AQUAIA_PERFIL_DIR (padrão resultados_perfil/) ao
+# sair do processo ou ao chamar salvar_perfis()
+#
+# Exportação: exportar_prometheus() (formato texto do Prometheus) e exportar_json()
+
+import atexit
+import bisect
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+MODOS = ('0', '1', 'perfil', 'amostragem')
+LIMITES_HISTOGRAMA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+INTERVALO_AMOSTRAGEM = 0.005  # segundos entre amostras de pilha
+DIRETORIO_PERFIL = os.environ.get("AQUAIA_PERFIL_DIR", "resultados_perfil")
+
+_NULO = contextlib.nullcontext()
+
+class _Estado:
+    ativa = False
+    modo = '0'
+
+_estado = _Estado()
+_lock = threading.Lock()
+_tempos = {}  # etapa -> [contagem, soma, máximo, contagens por faixa do histograma]
+_contadores = Counter()
+_local = threading.local()
+
+# Medição
+
+def ativa():
+    return _estado.ativa
+
+def medir(etapa):
+    """
+    Contexto que mede a duração de uma etapa
+    Desativada, custa uma verificação de atributo e devolve um contexto vazio
+    """
+    if not _estado.ativa:
+        return _NULO
+    return _Medicao(etapa)
+
+def cronometrado(etapa):
+    """Decorador equivalente a envolver a função em medir(etapa)"""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            if not _estado.ativa:
+                return funcao(*args, **kwargs)
+            with _Medicao(etapa):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+def contar(evento, n=1):
+    if not _estado.ativa:
+        return
+    with _lock:
+        _contadores[evento] += n
+
+def registrar_tempo(etapa, segundos):
+    with _lock:
+        registro = _tempos.get(etapa)
+        if registro is None:
+            registro = _tempos[etapa] = [0, 0.0, 0.0, [0] * (len(LIMITES_HISTOGRAMA) + 1)]
+        registro[0] += 1
+        registro[1] += segundos
+        registro[2] = max(registro[2], segundos)
+        registro[3][bisect.bisect_left(LIMITES_HISTOGRAMA, segundos)] += 1
+
+class _Medicao:
+    __slots__ = ('etapa', 'inicio', 'perfil', 'aninhada')
+
+    def __init__(self, etapa):
+        self.etapa = etapa
+        self.perfil = None
+        self.aninhada = False
+
+    def __enter__(self):
+        if _estado.modo == 'perfil':
+            self._iniciar_perfil()
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excecao):
+        registrar_tempo(self.etapa, time.perf_counter() - self.inicio)
+        if self.aninhada:
+            _local.profundidade -= 1
+        if self.perfil is not None:
+            self.perfil.disable()
+        if excecao[0] is not None:
+            contar(f"{self.etapa}.erros")
+        return False
+
+    def _iniciar_perfil(self):
+        # O cProfile cobre só a etapa mais externa de cada thread
+        profundidade = getattr(_local, 'profundidade', 0)
+        _local.profundidade = profundidade + 1
+        self.aninhada = True
+        if profundidade == 0:
+            try:
+                self.perfil = _perfil_da_thread()
+                self.perfil.enable()
+            except ValueError:
+                # Outro profiler já ativo no processo (ex.: cProfile externo)
+                self.perfil = None
+
+# Controle
+
+def configurar(modo=None):
+    """
+    Ativa ou desativa a instrumentação (modo: um de MODOS; padrão: AQUAIA_INSTRUMENTACAO)
+    """
+    if modo is None:
+        modo = os.environ.get("AQUAIA_INSTRUMENTACAO", "0").strip().lower() or '0'
+    if modo not in MODOS:
+        raise ValueError(f"Modo de instrumentação desconhecido: {modo} (use um de {MODOS})")
+
+    _amostrador.parar()
+    _estado.modo = modo
+    _estado.ativa = modo != '0'
+    if modo == 'amostragem':
+        _amostrador.iniciar()
+
+def zerar():
+    with _lock:
+        _tempos.clear()
+        _contadores.clear()
+
+# Exportação
+
+def exportar_json():
+    with _lock:
+        return {
+            'modo': _estado.modo,
+            'etapas': {
+                etapa: {
+                    'contagem': contagem,
+                    'soma_s': soma,
+                    'media_s': soma / contagem if contagem else 0.0,
+                    'maximo_s': maximo,
+                    'histograma': dict(zip([*map(str, LIMITES_HISTOGRAMA), '+Inf'], faixas)),
+                }
+                for etapa, (contagem, soma, maximo, faixas) in sorted(_tempos.items())
+            },
+            'contadores': dict(sorted(_contadores.items())),
+        }
+
+def _rotulo(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def exportar_prometheus(prefixo="aquaia"):
+    """Métricas no formato texto do Prometheus (histograma por etapa e contadores)"""
+    with _lock:
+        tempos = sorted((etapa, registro[0], registro[1], list(registro[3])) for etapa, registro in _tempos.items())
+        contadores = sorted(_contadores.items())
+
+    linhas = [
+        f"# HELP {prefixo}_etapa_segundos Duração de cada etapa instrumentada",
+        f"# TYPE {prefixo}_etapa_segundos histogram",
+    ]
+    for etapa, contagem, soma, faixas in tempos:
+        rotulo = _rotulo(etapa)
+        acumulado = 0
+        for limite, n in zip([*map(str, LIMITES_HISTOGRAMA), '+Inf'], faixas):
+            acumulado += n
+            linhas.append(f'{prefixo}_etapa_segundos_bucket{{etapa="{rotulo}",le="{limite}"}} {acumulado}')
+        linhas.append(f'{prefixo}_etapa_segundos_sum{{etapa="{rotulo}"}} {soma:.9f}')
+        linhas.append(f'{prefixo}_etapa_segundos_count{{etapa="{rotulo}"}} {contagem}')
+
+    linhas += [
+        f"# HELP {prefixo}_eventos_total Contadores de eventos instrumentados",
+        f"# TYPE {prefixo}_eventos_total counter",
+    ]
+    linhas += [f'{prefixo}_eventos_total{{evento="{_rotulo(evento)}"}} {n}' for evento, n in contadores]
+    return "\n".join(linhas) + "\n"
+
+# Perfis
+
+_perfis = []
+
+def _perfil_da_thread():
+    perfil = getattr(_local, 'perfil', None)
+    if perfil is None:
+        import cProfile
+        perfil = _local.perfil = cProfile.Profile()
+        with _lock:
+            _perfis.append(perfil)
+    return perfil
+
+class Amostrador:
+    """
+    Perfil por amostragem: uma thread em segundo plano lê as pilhas de todas as
+    threads a cada `intervalo` segundos e conta as pilhas iguais. O custo não
+    depende de quantas funções são chamadas, só da frequência das amostras
+    """
+
+    def __init__(self, intervalo=INTERVALO_AMOSTRAGEM):
+        self.intervalo = intervalo
+        self.pilhas = Counter()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        if self._thread is not None:
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="aquaia-amostrador", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        if self._thread is None:
+            return
+        self._parar.set()
+        self._thread.join()
+        self._thread = None
+
+    def _executar(self):
+        proprio = threading.get_ident()
+        while not self._parar.wait(self.intervalo):
+            nomes = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, quadro in sys._current_frames().items():
+                if ident == proprio:
+                    continue
+                pilha = []
+                while quadro is not None:
+                    codigo = quadro.f_code
+                    pilha.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                    quadro = quadro.f_back
+                pilha.append(nomes.get(ident, str(ident)))
+                self.pilhas[";".join(reversed(pilha))] += 1
+
+    def salvar(self, caminho):
+        """Pilhas no formato folded: "raiz;...;folha contagem" por linha"""
+        with open(caminho, "w", encoding="utf-8") as f:
+            for pilha, n in self.pilhas.most_common():
+                f.write(f"{pilha} {n}\n")
+
+_amostrador = Amostrador()
+
+def salvar_perfis(diretorio=DIRETORIO_PERFIL):
+    """Grava o cProfile acumulado e/ou as pilhas amostradas; retorna os arquivos gravados"""
+    gravados = []
+    carimbo = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+    with _lock:
+        perfis = list(_perfis)
+    if perfis:
+        import pstats
+        os.makedirs(diretorio, exist_ok=True)
+        estatisticas = pstats.Stats(perfis[0])
+        for perfil in perfis[1:]:
+            estatisticas.add(perfil)
+        caminho = os.path.join(diretorio, f"perfil_{carimbo}.prof")
+        estatisticas.dump_stats(caminho)
+        gravados.append(caminho)
+    if _amostrador.pilhas:
+        os.makedirs(diretorio, exist_ok=True)
+        caminho = os.path.join(diretorio, f"amostras_{carimbo}.folded")
+        _amostrador.salvar(caminho)
+        gravados.append(caminho)
+    return gravados
+
+configurar()
+atexit.register(salvar_perfis)
@@ -0,0 +1,289 @@
+# Limiares de anomalia adaptados ao histórico de cada tanque
+# Os scores de reconstrução de cada tanque (geral e por sensor) alimentam
+# estimadores de quantis P² em memória constante: cinco marcadores por quantil
+# e por série, sem guardar o histórico de scores. O nível ATENÇÃO passa a ser o
+# quantil 95% dos scores do próprio tanque e o CRÍTICO o quantil 99%
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+SENSORES = ['ph', 'temperatura', 'oxigenio', 'turbidez']
+QUANTIL_ATENCAO = 0.95
+QUANTIL_CRITICO = 0.99
+AQUECIMENTO = 168  # uma semana de leituras horárias antes de confiar nos quantis
+THRESHOLD_PADRAO = 0.015
+
+class QuantilP2:
+    """
+    Estimador P² (Jain & Chlamtac, 1985) de um quantil, para muitas séries de uma vez
+    Cada série mantém 5 marcadores (alturas e posições); cada observação ajusta
+    os marcadores por interpolação parabólica, com custo e memória constantes
+    """
+
+    def __init__(self, p, n_series=0):
+        self.p = p
+        self._incrementos = np.array([0.0, p / 2, p, (1 + p) / 2, 1.0])
+        self.alturas = np.zeros((n_series, 5))
+        self.posicoes = np.tile(np.arange(1.0, 6.0), (n_series, 1))
+        self.desejadas = np.tile(self._desejadas_iniciais(), (n_series, 1))
+        self.contagem = np.zeros(n_series, dtype=np.int64)
+
+    def _desejadas_iniciais(self):
+        p = self.p
+        return np.array([1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0])
+
+    def redimensionar(self, n_series):
+        """Acrescenta séries vazias ao final"""
+        novas = n_series - len(self.contagem)
+        if novas <= 0:
+            return
+        self.alturas = np.vstack([self.alturas, np.zeros((novas, 5))])
+        self.posicoes = np.vstack([self.posicoes, np.tile(np.arange(1.0, 6.0), (novas, 1))])
+        self.desejadas = np.vstack([self.desejadas, np.tile(self._desejadas_iniciais(), (novas, 1))])
+        self.contagem = np.concatenate([self.contagem, np.zeros(novas, dtype=np.int64)])
+
+    def atualizar(self, indices, valores):
+        """
+        Uma observação para cada série em `indices` (sem repetições)
+        Valores NaN são ignorados
+        """
+        indices = np.asarray(indices)
+        valores = np.asarray(valores, dtype=np.float64)
+        validos = ~np.isnan(valores)
+        indices, valores = indices[validos], valores[validos]
+
+        # As 5 primeiras observações de cada série apenas preenchem os marcadores
+        contagem = self.contagem[indices]
+        iniciando = contagem < 5
+        if iniciando.any():
+            linhas = indices[iniciando]
+            self.alturas[linhas, contagem[iniciando]] = valores[iniciando]
+            completas = linhas[contagem[iniciando] == 4]
+            self.alturas[completas] = np.sort(self.alturas[completas], axis=1)
+        self.contagem[indices] += 1
+
+        linhas, x = indices[~iniciando], valores[~iniciando]
+        if len(linhas) == 0:
+            return
+
+        q = self.alturas[linhas]
+        n = self.posicoes[linhas]
+        desejadas = self.desejadas[linhas] + self._incrementos
+
+        # Célula k do novo valor (q[k] <= x < q[k+1]), estendendo os extremos se preciso
+        q[:, 0] = np.minimum(q[:, 0], x)
+        q[:, 4] = np.maximum(q[:, 4], x)
+        k = (x[:, None] >= q[:, 1:4]).sum(axis=1)
+        n += np.arange(5)[None, :] > k[:, None]
+
+        # Ajusta os marcadores centrais que se afastaram da posição desejada
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in (1, 2, 3):
+                d = desejadas[:, i] - n[:, i]
+                subir = (d >= 1) & (n[:, i + 1] - n[:, i] > 1)
+                descer = (d <= -1) & (n[:, i - 1] - n[:, i] < -1)
+                mover = subir | descer
+                if not mover.any():
+                    continue
+                s = np.where(subir, 1.0, -1.0)
+
+                parabolica = q[:, i] + s / (n[:, i + 1] - n[:, i - 1]) * (
+                    (n[:, i] - n[:, i - 1] + s) * (q[:, i + 1] - q[:, i]) / (n[:, i + 1] - n[:, i])
+                    + (n[:, i + 1] - n[:, i] - s) * (q[:, i] - q[:, i - 1]) / (n[:, i] - n[:, i - 1])
+                )
+                vizinho = np.where(subir, i + 1, i - 1)
+                q_vizinho = np.take_along_axis(q, vizinho[:, None], axis=1)[:, 0]
+                n_vizinho = np.take_along_axis(n, vizinho[:, None], axis=1)[:, 0]
+                linear = q[:, i] + s * (q_vizinho - q[:, i]) / (n_vizinho - n[:, i])
+
+                dentro = (q[:, i - 1] < parabolica) & (parabolica < q[:, i + 1])
+                q[:, i] = np.where(mover, np.where(dentro, parabolica, linear), q[:, i])
+                n[:, i] += np.where(mover, s, 0.0)
+
+        self.alturas[linhas] = q
+        self.posicoes[linhas] = n
+        self.desejadas[linhas] = desejadas
+
+    def estimativa(self, indices):
+        """Quantil estimado de cada série (NaN com menos de 5 observações)"""
+        indices = np.asarray(indices)
+        return np.where(self.contagem[indices] >= 5, self.alturas[indices, 2], np.nan)
+
+class LimiaresAdaptativos:
+    """
+    Limiares ATENÇÃO/CRÍTICO por tanque, a partir dos quantis dos scores do próprio tanque
+    Cada tanque tem 1 + len(sensores) séries: o score geral e o score de cada sensor
+    Enquanto um tanque tem menos de `aquecimento` scores, vale o threshold padrão
+    (e o dobro dele para CRÍTICO), como antes
+    """
+
+    def __init__(self, sensores=SENSORES, quantil_atencao=QUANTIL_ATENCAO, quantil_critico=QUANTIL_CRITICO,
+                 aquecimento=AQUECIMENTO, versao_modelo=None):
+        self.sensores = list(sensores)
+        self.aquecimento = aquecimento
+        self.versao_modelo = versao_modelo
+        self.tanques = {}
+        self._atencao = QuantilP2(quantil_atencao)
+        self._critico = QuantilP2(quantil_critico)
+
+    @property
+    def _series_por_tanque(self):
+        return 1 + len(self.sensores)
+
+    def _indices(self, tanques, criar=False):
+        """Linha de cada tanque (-1 para tanques ainda sem scores, se criar=False)"""
+        linhas = np.empty(len(tanques), dtype=np.int64)
+        for i, tanque in enumerate(tanques):
+            tanque = str(tanque)
+            linha = self.tanques.get(tanque, -1)
+            if linha < 0 and criar:
+                linha = self.tanques[tanque] = len(self.tanques)
+            linhas[i] = linha
+
+        # Capacidade cresce em dobro para não realocar a cada tanque novo
+        necessarias = len(self.tanques) * self._series_por_tanque
+        if necessarias > len(self._atencao.contagem):
+            capacidade = max(necessarias, 2 * len(self._atencao.contagem))
+            self._atencao.redimensionar(capacidade)
+            self._critico.redimensionar(capacidade)
+        return linhas
+
+    def atualizar(self, tanque, score, scores_sensor):
+        self.atualizar_lote([tanque], [score], [scores_sensor])
+
+    def atualizar_lote(self, tanques, scores, scores_sensor):
+        """
+        Um score por tanque (sem tanques repetidos)
+        scores: (tanques,)   scores_sensor: (tanques, sensores)
+        """
+        linhas = self._indices(list(tanques), criar=True)
+        valores = np.column_stack([np.asarray(scores, dtype=np.float64), np.asarray(scores_sensor, dtype=np.float64)])
+        series = linhas[:, None] * self._series_por_tanque + np.arange(self._series_por_tanque)[None, :]
+
+        self._atencao.atualizar(series.ravel(), valores.ravel())
+        self._critico.atualizar(series.ravel(), valores.ravel())
+
+    def _quantis(self, linhas):
+        """Quantis (ATENÇÃO, CRÍTICO) de todas as séries dos tanques, NaN durante o aquecimento"""
+        series = np.maximum(linhas, 0)[:, None] * self._series_por_tanque + np.arange(self._series_por_tanque)[None, :]
+        if len(self._atencao.contagem) == 0:
+            vazio = np.full(series.shape, np.nan)
+            return vazio, vazio
+
+        aquecido = (linhas[:, None] >= 0) & (self._atencao.contagem[series] >= self.aquecimento)
+        atencao = np.where(aquecido, self._atencao.estimativa(series), np.nan)
+        critico = np.where(aquecido, self._critico.estimativa(series), np.nan)
+        return atencao, np.fmax(critico, atencao)
+
+    def limiares_lote(self, tanques, padrao=THRESHOLD_PADRAO):
+        """Limiares (ATENÇÃO, CRÍTICO) do score geral de cada tanque, arrays (tanques,)"""
+        atencao, critico = self._quantis(self._indices(list(tanques)))
+        return np.where(np.isnan(atencao[:, 0]), padrao, atencao[:, 0]), np.where(np.isnan(critico[:, 0]), 2 * padrao, critico[:, 0])
+
+    def limiares(self, tanque, padrao=THRESHOLD_PADRAO):
+        atencao, critico = self.limiares_lote([tanque], padrao)
+        return float(atencao[0]), float(critico[0])
+
+    def relativos_lote(self, tanques, scores_sensor):
+        """
+        Score de cada sensor dividido pelo seu próprio limiar ATENÇÃO, para apontar
+        o parâmetro mais fora do normal do tanque; durante o aquecimento, o score bruto
+        """
+        atencao, _ = self._quantis(self._indices(list(tanques)))
+        scores_sensor = np.asarray(scores_sensor, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relativos = scores_sensor / atencao[:, 1:]
+        return np.where(np.isnan(atencao[:, 1:]) | (atencao[:, 1:] <= 0), scores_sensor, relativos)
+
+    def relativos(self, tanque, scores_sensor):
+        return self.relativos_lote([tanque], [scores_sensor])[0]
+
+    @property
+    def versao(self):
+        """Muda a cada score incorporado ou troca de modelo (para chaves de cache)"""
+        return self.versao_modelo, int(self._atencao.contagem.sum())
+
+    def assinatura(self):
+        """SHA-256 do estado completo: iguais só se classificam os scores da mesma forma"""
+        resumo = hashlib.sha256(json.dumps(
+            [self.sensores, list(self.tanques), self.aquecimento, self.versao_modelo]
+        ).encode("utf-8"))
+        # Só as séries em uso: a capacidade reservada além delas não muda a classificação
+        n_series = len(self.tanques) * self._series_por_tanque
+        for estimador in (self._atencao, self._critico):
+            resumo.update(np.float64(estimador.p).tobytes())
+            for valores in (estimador.alturas, estimador.posicoes, estimador.desejadas, estimador.contagem):
+                resumo.update(np.ascontiguousarray(valores[:n_series]).tobytes())
+        return resumo.hexdigest()
+
+    def separar(self, tanque):
+        """Cópia só com o estado de um tanque, para aprendê-lo em outro processo (ver incorporar)"""
+        copia = LimiaresAdaptativos(self.sensores, self._atencao.p, self._critico.p, self.aquecimento, self.versao_modelo)
+        linha = self.tanques.get(str(tanque))
+        if linha is None:
+            return copia
+        copia._indices([tanque], criar=True)
+        series = slice(linha * self._series_por_tanque, (linha + 1) * self._series_por_tanque)
+        for origem, destino in ((self._atencao, copia._atencao), (self._critico, copia._critico)):
+            for nome in ('alturas', 'posicoes', 'desejadas', 'contagem'):
+                getattr(destino, nome)[:self._series_por_tanque] = getattr(origem, nome)[series]
+        return copia
+
+    def incorporar(self, outro, tanque):
+        """Substitui o estado do tanque pelo aprendido em outro (uma cópia de separar)"""
+        if str(tanque) not in outro.tanques:
+            return
+        linha = self._indices([tanque], criar=True)[0]
+        series = slice(linha * self._series_por_tanque, (linha + 1) * self._series_por_tanque)
+        origem_series = outro.tanques[str(tanque)] * self._series_por_tanque
+        for origem, destino in ((outro._atencao, self._atencao), (outro._critico, self._critico)):
+            for nome in ('alturas', 'posicoes', 'desejadas', 'contagem'):
+                getattr(destino, nome)[series] = getattr(origem, nome)[origem_series:origem_series + self._series_por_tanque]
+
+    def n_scores(self, tanque):
+        linha = self.tanques.get(str(tanque))
+        return 0 if linha is None else int(self._atencao.contagem[linha * self._series_por_tanque])
+
+    def salvar(self, caminho):
+        if os.path.dirname(caminho):
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = caminho + ".tmp.npz"
+        estado = {}
+        for nome, estimador in (('atencao', self._atencao), ('critico', self._critico)):
+            estado.update({
+                f"{nome}_p": estimador.p,
+                f"{nome}_alturas": estimador.alturas,
+                f"{nome}_posicoes": estimador.posicoes,
+                f"{nome}_desejadas": estimador.desejadas,
+                f"{nome}_contagem": estimador.contagem,
+            })
+        np.savez(
+            temporario,
+            sensores=np.array(self.sensores),
+            tanques=np.array(list(self.tanques), dtype=str),
+            aquecimento=self.aquecimento,
+            versao_modelo=self.versao_modelo or "",
+            **estado
+        )
+        os.replace(temporario, caminho)
+
+    @classmethod
+    def carregar(cls, caminho):
+        with np.load(caminho) as arquivo:
+            limiares = cls(
+                [str(s) for s in arquivo['sensores']],
+                quantil_atencao=float(arquivo['atencao_p']),
+                quantil_critico=float(arquivo['critico_p']),
+                aquecimento=int(arquivo['aquecimento']),
+                versao_modelo=str(arquivo['versao_modelo']) or None
+            )
+            limiares.tanques = {str(t): i for i, t in enumerate(arquivo['tanques'])}
+            for nome, estimador in (('atencao', limiares._atencao), ('critico', limiares._critico)):
+                estimador.alturas = arquivo[f"{nome}_alturas"]
+                estimador.posicoes = arquivo[f"{nome}_posicoes"]
+                estimador.desejadas = arquivo[f"{nome}_desejadas"]
+                estimador.contagem = arquivo[f"{nome}_contagem"]
+        return limiares
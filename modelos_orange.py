@@ -1,123 +1,734 @@
 # arquivo: usar_modelos_orange.py
 
+import hashlib
+import os
 import pickle
-import Orange
+import threading
 import numpy as np
-from PIL import Image
+from collections import deque
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
+from diagnostico_imagens import (embeddings_ladrilhos, extrair_caracteristicas_lote, prever_probabilidades,
+                                 probabilidades_lamina)
+from preprocessamento_imagens import eh_lamina
+from cache_embeddings import CacheEmbeddings
+from autoencoder_lstm import AutoencoderLSTM
+from limiares_adaptativos import LimiaresAdaptativos
+from instrumentacao import contar, cronometrado, medir
+from resultados import (DadosInsuficientes, NivelAlerta, ResultadoAnomalia, ResultadoDiagnostico, SEM_NIVEL,
+                        formatar_anomalia, formatar_diagnostico, formatar_lote, novo_lote, resultado_anomalia)
 
-class SistemaMonitoramentoIA:
-    def __init__(self):
-        self.modelo_cnn = None
-        self.modelo_lstm = None
-        self.scaler = MinMaxScaler()
+# Orange, PIL e scikit-learn só são importados quando um modelo ou imagem é
+# de fato usado: importar este módulo não paga esse custo
+
+CAMINHO_MODELO_CNN = "modelo_parasitos_cnn.pkcls"
+CAMINHO_MODELO_LSTM = "modelo_qualidade_lstm.pkcls"
+CAMINHO_AUTOENCODER_LSTM = "modelo_qualidade_lstm.npz"  # pesos do autoencoder (ver autoencoder_lstm.py)
+CAMINHO_LIMIARES = "dados_demo/limiares_adaptativos.npz"
+
+SENSORES = ['ph', 'temperatura', 'oxigenio', 'turbidez']
+HORAS_JANELA = 24
+THRESHOLD_ANOMALIA = 0.015
+
+def _montar_resultado_anomalia(erro_reconstrucao, diferencas, ultima_leitura, threshold=THRESHOLD_ANOMALIA,
+                               limiares=None, tanque=None):
+    """
+    Monta o ResultadoAnomalia da detecção
+    diferencas: diferença absoluta entre as médias normalizadas por sensor
+    ultima_leitura: leitura mais recente (Series ou dict com as colunas de SENSORES)
+    limiares: LimiaresAdaptativos; com ele, os níveis seguem o histórico do tanque
+    e threshold vale apenas durante o aquecimento
+    """
+    threshold_critico = threshold * 2
+    if limiares is not None:
+        threshold, threshold_critico = limiares.limiares(tanque, threshold)
+        diferencas = limiares.relativos(tanque, diferencas)
+
+    # O parâmetro mais crítico é o de maior diferença
+    return resultado_anomalia(
+        erro_reconstrucao, threshold, threshold_critico, diferencas,
+        [ultima_leitura[sensor] for sensor in SENSORES]
+    )
+
+def _pontuar_janelas(janelas, n_leituras, horas_janela=HORAS_JANELA, threshold=THRESHOLD_ANOMALIA,
+                     limiares=None, tanques=None):
+    """
+    Pontua várias janelas de uma só vez, com a mesma lógica de detectar_anomalia_agua
+    janelas: array (tanques, 2*horas_janela, sensores) alinhado à direita
+    n_leituras: quantas posições finais de cada janela contêm leituras reais
+    limiares/tanques: limiares adaptativos e o tanque de cada janela
+    """
+    erro_reconstrucao, diferencas, suficiente = _erros_janelas(janelas, n_leituras, horas_janela)
+    return _classificar_janelas(erro_reconstrucao, diferencas, suficiente, threshold, limiares, tanques)
+
+def _erros_janelas(janelas, n_leituras, horas_janela=HORAS_JANELA):
+    """(erro de reconstrução, diferenças por sensor, dados suficientes) de cada janela"""
+    n_tanques, tamanho_janela, _ = janelas.shape
+    validos = np.arange(tamanho_janela)[None, :] >= (tamanho_janela - n_leituras)[:, None]
+    
+    # Mínimo e máximo por tanque e sensor, ignorando o preenchimento
+    minimo = np.where(validos[:, :, None], janelas, np.inf).min(axis=1)
+    maximo = np.where(validos[:, :, None], janelas, -np.inf).max(axis=1)
+    amplitude = maximo - minimo
+    amplitude[~(amplitude >= 10 * np.finfo(float).eps)] = 1.0
+    
+    media_atual = (janelas[:, -horas_janela:].mean(axis=1) - minimo) / amplitude
+    media_anterior = (janelas[:, :horas_janela].mean(axis=1) - minimo) / amplitude
+    janela_completa = n_leituras >= tamanho_janela
+    media_anterior = np.where(janela_completa[:, None], media_anterior, media_atual)
+    
+    diferencas = np.abs(media_atual - media_anterior)
+    erro_reconstrucao = np.mean(diferencas**2, axis=1)
+    return erro_reconstrucao, diferencas, n_leituras >= horas_janela
+
+def _pontuar_janelas_autoencoder(autoencoder, janelas, n_leituras, limiares=None, tanques=None):
+    """
+    Pontua as últimas `lookback` leituras de cada janela com o autoencoder,
+    todas em uma única passada em lote
+    """
+    erro_reconstrucao, erros_sensor, suficiente = _erros_janelas_autoencoder(autoencoder, janelas, n_leituras)
+    return _classificar_janelas(
+        erro_reconstrucao, erros_sensor, suficiente, autoencoder.threshold, limiares, tanques
+    )
+
+def _erros_janelas_autoencoder(autoencoder, janelas, n_leituras):
+    ultimas = np.nan_to_num(autoencoder.normalizar(janelas[:, -autoencoder.lookback:]))
+    erros_sensor = autoencoder.erros_por_sensor(ultimas)
+    return erros_sensor.mean(axis=1), erros_sensor, n_leituras >= autoencoder.lookback
+
+def _classificar_janelas(erro_reconstrucao, diferencas, suficiente, threshold, limiares=None, tanques=None):
+    """
+    Nível de alerta e parâmetro crítico de cada janela, em um lote de resultados
+    (array estruturado, ver resultados.novo_lote)
+    diferencas: contribuição de cada sensor para o erro (janelas, sensores)
+    suficiente: janelas com leituras suficientes para a detecção
+    """
+    n_tanques = len(erro_reconstrucao)
+    if tanques is None:
+        tanques = np.arange(n_tanques)
+    threshold = np.full(n_tanques, threshold, dtype=float)
+    threshold_critico = threshold * 2
+    if limiares is not None:
+        threshold, threshold_critico = limiares.limiares_lote(tanques, threshold)
+        diferencas = limiares.relativos_lote(tanques, diferencas)
+    
+    erro_reconstrucao = np.where(suficiente, erro_reconstrucao, np.nan)
+    lote = novo_lote(tanques)
+    lote['dados_suficientes'] = suficiente
+    lote['score_anomalia'] = erro_reconstrucao
+    lote['threshold'] = threshold
+    lote['threshold_critico'] = threshold_critico
+    lote['nivel_alerta'] = np.where(
+        suficiente,
+        np.select(
+            [erro_reconstrucao > threshold_critico, erro_reconstrucao > threshold],
+            [NivelAlerta.CRITICO, NivelAlerta.ATENCAO],
+            NivelAlerta.NORMAL
+        ),
+        SEM_NIVEL
+    )
+    lote['parametro_critico'] = np.where(suficiente, np.argmax(np.nan_to_num(diferencas), axis=1), SEM_NIVEL)
+    return lote
+
+def hash_arquivo(caminho):
+    """SHA-256 do arquivo, lido em blocos"""
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+def caminho_joblib(caminho):
+    return os.path.splitext(caminho)[0] + ".joblib"
+
+def converter_para_joblib(caminho):
+    """
+    Grava uma cópia do modelo em joblib ao lado do .pkcls (chamada ao salvar o
+    modelo treinado, depois do .pkcls, para a cópia ficar mais nova que ele)
+    Os arrays NumPy do modelo passam a ser abertos via mmap, sem cópia
+    """
+    import joblib
+    
+    with open(caminho, "rb") as f:
+        modelo = pickle.load(f)
+    destino = caminho_joblib(caminho)
+    # Gravação atômica: carregar_artefato nunca abre uma cópia pela metade
+    temporario = f"{destino}.{os.getpid()}.tmp"
+    joblib.dump(modelo, temporario)
+    os.replace(temporario, destino)
+    return destino
+
+def carregar_artefato(caminho):
+    """Carrega o modelo, preferindo a cópia joblib (mmap) quando ela é mais nova que o .pkcls"""
+    if caminho.endswith(".npz"):
+        return AutoencoderLSTM.carregar(caminho)
+    
+    rapido = caminho_joblib(caminho)
+    if os.path.exists(rapido) and os.path.getmtime(rapido) >= os.path.getmtime(caminho):
+        import joblib
+        return joblib.load(rapido, mmap_mode="r")
+    
+    with open(caminho, "rb") as f:
+        return pickle.load(f)
+
+def _nome_modelo(caminho):
+    """Nome base do modelo no registro (ex.: 'modelo_parasitos_cnn')"""
+    return os.path.splitext(os.path.basename(caminho))[0]
+
+def _diagnostico_em_cache(cache, chave):
+    guardado = cache.obter_diagnostico(chave)
+    return None if guardado is None else ResultadoDiagnostico.de_dict(guardado)
+
+class ModeloPreguicoso:
+    """
+    Referência a um modelo em disco, carregado apenas no primeiro uso
+    Várias threads podem chamar obter() ao mesmo tempo: o carregamento acontece
+    uma única vez. Após uma falha, só tenta de novo quando o arquivo mudar
+    ao_carregar(modelo, versao): prepara o estado que acompanha o modelo (ex.:
+    cache do diagnóstico, limiares) antes de publicá-lo; modelo, versão e
+    estado são trocados juntos, então quem lê com obter_com_estado() nunca
+    combina o modelo novo com o estado da versão anterior
+    """
+    
+    def __init__(self, caminho, nome, ao_carregar=None):
+        self.caminho = caminho
+        self.nome = nome
+        self.ao_carregar = ao_carregar
+        self._atual = (None, None, None)  # (modelo, versão, estado), trocados sempre juntos
+        self._lock = threading.Lock()
+        self._falhou = False
+        self._assinatura_falha = None
+    
+    @property
+    def modelo(self):
+        return self._atual[0]
+    
+    @property
+    def versao(self):
+        return self._atual[1]
+    
+    @property
+    def estado(self):
+        return self._atual[2]
+    
+    @estado.setter
+    def estado(self, estado):
+        with self._lock:
+            self._atual = (*self._atual[:2], estado)
+    
+    def obter(self):
+        return self.obter_com_estado()[0]
+    
+    def obter_com_estado(self):
+        """(modelo, estado) da mesma versão, carregando o modelo no primeiro uso"""
+        atual = self._atual
+        if atual[0] is not None:
+            return atual[0], atual[2]
         
-    def carregar_modelos(self):
-        """Carrega os modelos treinados no Orange"""
+        with self._lock:
+            if self.modelo is None and (not self._falhou or self._assinatura() != self._assinatura_falha):
+                self._carregar()
+            atual = self._atual
+        return atual[0], atual[2]
+    
+    def definir(self, modelo, versao=None):
+        """Substitui o modelo em memória (ex.: modelo já carregado por outro meio), mantendo o estado"""
+        with self._lock:
+            self._atual = (modelo, versao, self._atual[2])
+            self._falhou = False
+    
+    def trocar(self, modelo, versao, caminho=None):
+        """
+        Troca atômica para um modelo já carregado e aquecido: quem chama
+        obter() recebe o modelo antigo ou o novo, nunca um estado intermediário
+        """
+        estado = self._preparar(modelo, versao)
+        with self._lock:
+            if caminho is not None:
+                self.caminho = caminho
+            self._atual = (modelo, versao, estado)
+            self._falhou = False
+    
+    def _preparar(self, modelo, versao):
+        return self.ao_carregar(modelo, versao) if self.ao_carregar is not None else self._atual[2]
+    
+    def _assinatura(self):
         try:
-            # Carregar modelo CNN para diagnóstico de parasitos
-            with open("modelo_parasitos_cnn.pkcls", "rb") as f:
-                self.modelo_cnn = pickle.load(f)
-            print("✓ Modelo CNN carregado com sucesso")
-            
-            # Carregar modelo LSTM para qualidade da água
-            with open("modelo_qualidade_lstm.pkcls", "rb") as f:
-                self.modelo_lstm = pickle.load(f)
-            print("✓ Modelo LSTM carregado com sucesso")
-            
+            info = os.stat(self.caminho)
+            return (info.st_mtime_ns, info.st_size)
+        except FileNotFoundError:
+            return None
+    
+    def _carregar(self):
+        # Chamado com o lock: o estado é preparado antes e publicado junto com o modelo
+        try:
+            with medir(f"modelo.carregar.{self.nome}"):
+                modelo = carregar_artefato(self.caminho)
+            with medir("modelo.hash"):
+                versao = hash_arquivo(self.caminho)[:16]
         except FileNotFoundError as e:
+            self._falhou = True
+            self._assinatura_falha = self._assinatura()
             print(f"❌ Erro ao carregar modelo: {e}")
             print("Execute primeiro os workflows no Orange Canvas")
+            return
+        
+        self._atual = (modelo, versao, self._preparar(modelo, versao))
+        self._falhou = False
+        print(f"✓ Modelo {self.nome} carregado com sucesso")
+
+class SistemaMonitoramentoIA:
+    def __init__(self):
+        from registro_modelos import resolver_artefato
+        
+        # O artefato de cada modelo é escolhido pela mesma regra do registro de modelos
+        # (versão fixada ou o mais recente, .pkcls do Orange ou .npz do autoencoder em NumPy)
+        caminho_cnn = resolver_artefato(_nome_modelo(CAMINHO_MODELO_CNN)) or CAMINHO_MODELO_CNN
+        caminho_lstm = resolver_artefato(_nome_modelo(CAMINHO_MODELO_LSTM)) or CAMINHO_MODELO_LSTM
+        self._modelo_cnn = ModeloPreguicoso(caminho_cnn, "CNN", ao_carregar=self._preparar_cache)
+        self._modelo_lstm = ModeloPreguicoso(caminho_lstm, "LSTM", ao_carregar=self._preparar_limiares)
+        self.detectores = {}
+        self.scaler = None
+        # Limiares usados até o modelo LSTM ser carregado; depois vêm do estado do modelo
+        self._limiares = (
+            LimiaresAdaptativos.carregar(CAMINHO_LIMIARES) if os.path.exists(CAMINHO_LIMIARES)
+            else LimiaresAdaptativos()
+        )
+    
+    @property
+    def cache(self):
+        """CacheEmbeddings da versão em uso do modelo de diagnóstico"""
+        return self._modelo_cnn.estado
+    
+    @cache.setter
+    def cache(self, cache):
+        self._modelo_cnn.estado = cache
+    
+    @property
+    def limiares(self):
+        """LimiaresAdaptativos da versão em uso do modelo de qualidade da água"""
+        limiares = self._modelo_lstm.estado
+        return limiares if limiares is not None else self._limiares
+    
+    @property
+    def modelo_cnn(self):
+        """Modelo de diagnóstico de parasitos, carregado no primeiro acesso"""
+        return self._modelo_cnn.obter()
+    
+    @modelo_cnn.setter
+    def modelo_cnn(self, modelo):
+        self._modelo_cnn.definir(modelo)
+    
+    @property
+    def modelo_lstm(self):
+        """Modelo de qualidade da água, carregado no primeiro acesso"""
+        return self._modelo_lstm.obter()
+    
+    @modelo_lstm.setter
+    def modelo_lstm(self, modelo):
+        self._modelo_lstm.definir(modelo)
+        
+    @cronometrado("modelo.carregar_modelos")
+    def carregar_modelos(self, preguicoso=True):
+        """
+        Prepara os modelos treinados no Orange
+        Por padrão cada modelo só é lido do disco no primeiro uso;
+        com preguicoso=False ambos são carregados imediatamente
+        """
+        if not preguicoso:
+            self._modelo_cnn.obter()
+            self._modelo_lstm.obter()
+    
+    def iniciar_registro(self, diretorio=".", intervalo=5.0):
+        """
+        Acompanha novas versões dos modelos no diretório e as coloca em uso
+        sem reiniciar o processo (ver registro_modelos.RegistroModelos)
+        """
+        from registro_modelos import RegistroModelos, aquecer_modelo
+        
+        registro = RegistroModelos(
+            {
+                _nome_modelo(CAMINHO_MODELO_CNN): (self._modelo_cnn, aquecer_modelo),
+                _nome_modelo(CAMINHO_MODELO_LSTM): (self._modelo_lstm, None),
+            },
+            diretorio=diretorio,
+            intervalo=intervalo
+        )
+        registro.iniciar()
+        return registro
+    
+    def _preparar_cache(self, modelo, versao):
+        # Diagnósticos em cache valem apenas para esta versão do modelo
+        return CacheEmbeddings(versao_modelo=versao)
+    
+    def _preparar_limiares(self, modelo, versao):
+        # Scores de outra versão do modelo estão em outra escala: recomeça o aprendizado
+        limiares = self.limiares
+        if limiares.versao_modelo != versao:
+            limiares = LimiaresAdaptativos(versao_modelo=versao)
+        return limiares
+    
+    def _modelo_e_limiares(self):
+        """Modelo LSTM e limiares da mesma versão, lidos de uma só vez"""
+        modelo, limiares = self._modelo_lstm.obter_com_estado()
+        return modelo, limiares if limiares is not None else self._limiares
     
+    def versao_deteccao(self):
+        """Versão do modelo LSTM e dos limiares em uso: muda quando a detecção pode mudar"""
+        _, limiares = self._modelo_e_limiares()
+        return self._modelo_lstm.versao, limiares.versao
+    
+    def salvar_limiares(self, caminho=CAMINHO_LIMIARES):
+        """Grava os limiares aprendidos, para que outros processos (ex.: o dashboard) os usem"""
+        self.limiares.salvar(caminho)
+    
+    @cronometrado("diagnostico.parasito")
     def diagnosticar_parasito(self, caminho_imagem):
         """
         Diagnóstica parasitos a partir de uma imagem microscópica
+        caminho_imagem: caminho do arquivo ou arquivo já carregado em memória
         """
-        if not self.modelo_cnn:
+        modelo, cache = self._modelo_cnn.obter_com_estado()
+        if not modelo:
             return "Modelo CNN não carregado"
         
         try:
-            # Simular o processamento que seria feito pelo Image Embedding
-            # Em uma implementação real, seria necessário replicar exatamente
-            # o mesmo pré-processamento usado no Orange
-            
-            # Para esta demonstração, vamos simular uma previsão
-            classes = ['saudavel', 'ictio', 'monogenoidea']
-            probabilidades = np.random.dirichlet([1, 1, 1])  # Simulação
-            
-            classe_predita = classes[np.argmax(probabilidades)]
-            confianca = max(probabilidades)
-            
-            return {
-                'diagnostico': classe_predita,
-                'confianca': f"{confianca:.2%}",
-                'probabilidades': {
-                    classes[i]: f"{prob:.2%}" 
-                    for i, prob in enumerate(probabilidades)
-                },
-                'recomendacao': self._get_recomendacao(classe_predita)
-            }
+            return self._diagnosticar(modelo, cache, [caminho_imagem], n_processos=1)[0]
             
         except Exception as e:
             return f"Erro no diagnóstico: {e}"
     
-    def detectar_anomalia_agua(self, dados_recentes):
+    @cronometrado("diagnostico.lote")
+    def diagnosticar_lote(self, caminhos_imagens, n_processos=None):
+        """
+        Diagnostica várias imagens de uma vez: a decodificação e o cálculo das
+        características são distribuídos entre todos os núcleos e o modelo é
+        aplicado uma única vez ao lote inteiro
+        """
+        modelo, cache = self._modelo_cnn.obter_com_estado()
+        if not modelo:
+            return "Modelo CNN não carregado"
+        
+        try:
+            return self._diagnosticar(modelo, cache, list(caminhos_imagens), n_processos=n_processos)
+            
+        except Exception as e:
+            return f"Erro no diagnóstico em lote: {e}"
+    
+    def _diagnosticar(self, modelo, cache, origens, n_processos=None):
+        """
+        Imagens já diagnosticadas por este modelo vêm do cache; as demais passam
+        pelo mesmo pré-processamento e características usados no treino
+        modelo e cache: da mesma versão (ModeloPreguicoso.obter_com_estado)
+        """
+        with medir("diagnostico.cache"):
+            chaves = [cache.chave(o) for o in origens] if cache else None
+            resultados = [_diagnostico_em_cache(cache, c) for c in chaves] if cache else [None] * len(origens)
+        faltando = [i for i, resultado in enumerate(resultados) if resultado is None]
+        contar("diagnostico.cache_acertos", len(origens) - len(faltando))
+        contar("diagnostico.cache_faltas", len(faltando))
+        
+        # Lâminas muito grandes são avaliadas por ladrilhos (o tamanho vem do cabeçalho)
+        laminas = {i for i in faltando if eh_lamina(origens[i])}
+        imagens = [i for i in faltando if i not in laminas]
+        
+        if imagens:
+            with medir("diagnostico.caracteristicas"):
+                caracteristicas = extrair_caracteristicas_lote(
+                    [origens[i] for i in imagens],
+                    n_processos=n_processos,
+                    cache=cache,
+                    chaves=[chaves[i] for i in imagens] if cache else None
+                )
+            with medir("diagnostico.predicao"):
+                classes, probabilidades = prever_probabilidades(modelo, caracteristicas)
+            
+            for i, prob in zip(imagens, probabilidades):
+                resultados[i] = self._montar_diagnostico(classes, prob)
+        
+        for i in sorted(laminas):
+            with medir("diagnostico.ladrilhos"):
+                caracteristicas = embeddings_ladrilhos(origens[i])
+            contar("diagnostico.ladrilhos", len(caracteristicas))
+            with medir("diagnostico.predicao"):
+                classes, probabilidades = prever_probabilidades(modelo, caracteristicas)
+            resultados[i] = self._montar_diagnostico(classes, probabilidades_lamina(classes, probabilidades))
+        
+        if cache:
+            for i in faltando:
+                cache.guardar_diagnostico(chaves[i], resultados[i].para_dict())
+        
+        return resultados
+    
+    def _montar_diagnostico(self, classes, probabilidades):
+        """ResultadoDiagnostico a partir das probabilidades de uma imagem"""
+        return ResultadoDiagnostico(tuple(str(c) for c in classes), tuple(float(p) for p in probabilidades))
+    
+    @cronometrado("deteccao.agua")
+    def detectar_anomalia_agua(self, dados_recentes, tanque=None):
         """
         Detecta anomalias na qualidade da água usando dados das últimas 24h
         dados_recentes: DataFrame com colunas ['ph', 'temperatura', 'oxigenio', 'turbidez']
+        tanque: usa os limiares aprendidos para o tanque (sem atualizá-los)
         """
-        if not self.modelo_lstm:
+        modelo, limiares = self._modelo_e_limiares()
+        if not modelo:
             return "Modelo LSTM não carregado"
+        limiares = limiares if tanque is not None else None
         
         try:
+            if isinstance(modelo, AutoencoderLSTM):
+                return self._detectar_com_autoencoder(modelo, dados_recentes, tanque, limiares)
+            
+            if self.scaler is None:
+                from sklearn.preprocessing import MinMaxScaler
+                self.scaler = MinMaxScaler()
+            
             # Normalizar dados
-            dados_norm = self.scaler.fit_transform(dados_recentes)
+            with medir("deteccao.normalizacao"):
+                dados_norm = self.scaler.fit_transform(dados_recentes[SENSORES])
             
             # Simulação do erro de reconstrução
-            if len(dados_norm) >= 24:
-                sequencia_atual = dados_norm[-24:]  # Últimas 24 horas
+            if len(dados_norm) >= HORAS_JANELA:
+                sequencia_atual = dados_norm[-HORAS_JANELA:]  # Últimas 24 horas
                 media_atual = np.mean(sequencia_atual, axis=0)
-                media_anterior = np.mean(dados_norm[-48:-24], axis=0) if len(dados_norm) >= 48 else media_atual
+                media_anterior = np.mean(dados_norm[-2*HORAS_JANELA:-HORAS_JANELA], axis=0) if len(dados_norm) >= 2*HORAS_JANELA else media_atual
                 
                 erro_reconstrucao = np.mean((media_atual - media_anterior)**2)
-                
-                # Threshold para anomalia (ajustável)
-                threshold = 0.015
-                is_anomalia = erro_reconstrucao > threshold
-                
-                # Identificar parâmetro mais crítico
                 diferencas = np.abs(media_atual - media_anterior)
-                parametros = ['pH', 'Temperatura', 'Oxigênio', 'Turbidez']
-                param_critico = parametros[np.argmax(diferencas)]
                 
-                return {
-                    'anomalia_detectada': is_anomalia,
-                    'score_anomalia': f"{erro_reconstrucao:.4f}",
-                    'threshold': f"{threshold:.4f}",
-                    'parametro_critico': param_critico,
-                    'nivel_alerta': 'CRÍTICO' if erro_reconstrucao > threshold * 2 else 'ATENÇÃO' if is_anomalia else 'NORMAL',
-                    'valores_atuais': {
-                        'pH': f"{dados_recentes['ph'].iloc[-1]:.2f}",
-                        'Temperatura': f"{dados_recentes['temperatura'].iloc[-1]:.1f}°C",
-                        'Oxigênio': f"{dados_recentes['oxigenio'].iloc[-1]:.2f} mg/L",
-                        'Turbidez': f"{dados_recentes['turbidez'].iloc[-1]:.1f} NTU"
-                    }
-                }
+                return _montar_resultado_anomalia(
+                    erro_reconstrucao, diferencas, dados_recentes.iloc[-1],
+                    limiares=limiares, tanque=tanque
+                )
             else:
-                return {'erro': 'Dados insuficientes (necessário pelo menos 24h)'}
+                return DadosInsuficientes(HORAS_JANELA, len(dados_recentes))
                 
         except Exception as e:
             return f"Erro na detecção de anomalia: {e}"
     
-    def _get_recomendacao(self, diagnostico):
-        """Retorna recomendações baseadas no diagnóstico"""
-        recomendacoes = {
-            'saudavel': "✓ Condição normal. Manter práticas atuais de manejo.",
-            'ictio': "⚠️ URGENTE: Ictiofitiríase detectada. Iniciar tratamento com sal (3-5g/L) ou formalina. Melhorar qualidade da água.",
-            'monogenoidea': "⚠️ Monogenoidea detectado. Tratar com praziquantel ou organofosforados. Verificar densidade de estocagem."
-        }
-        return recomendacoes.get(diagnostico, "Consultar veterinário.")
+    def _detectar_com_autoencoder(self, autoencoder, dados_recentes, tanque=None, limiares=None):
+        """Erro de reconstrução do autoencoder na janela mais recente"""
+        if len(dados_recentes) < autoencoder.lookback:
+            return DadosInsuficientes(autoencoder.lookback, len(dados_recentes))
+        
+        with medir("deteccao.normalizacao"):
+            valores = dados_recentes[SENSORES].to_numpy(dtype=float)[-autoencoder.lookback:]
+            janela = autoencoder.normalizar(valores)[None]
+        with medir("deteccao.pontuacao"):
+            erros_sensor = autoencoder.erros_por_sensor(janela)[0]
+        
+        return _montar_resultado_anomalia(
+            erros_sensor.mean(), erros_sensor, dados_recentes.iloc[-1], autoencoder.threshold,
+            limiares=limiares, tanque=tanque
+        )
+    
+    @cronometrado("deteccao.lote")
+    def detectar_anomalia_lote(self, dados, tanques=None, coluna_tanque='tanque'):
+        """
+        Detecta anomalias em vários tanques em uma única passada vetorizada
+        dados: DataFrame longo com colunas [coluna_tanque, 'timestamp', 'ph', 'temperatura',
+               'oxigenio', 'turbidez'] ou array (tanques, horas, sensores)
+        tanques: identificadores dos tanques quando dados é um array
+        Retorna um array estruturado com um registro por tanque (ver resultados.novo_lote;
+        resultados.formatar_lote o converte em DataFrame)
+        """
+        modelo, limiares = self._modelo_e_limiares()
+        if not modelo:
+            return "Modelo LSTM não carregado"
+        
+        try:
+            tamanho_janela = 2 * HORAS_JANELA
+            
+            if isinstance(dados, pd.DataFrame):
+                if 'timestamp' in dados.columns:
+                    dados = dados.sort_values([coluna_tanque, 'timestamp'], kind='stable')
+                codigos, tanques = pd.factorize(dados[coluna_tanque], sort=True)
+                valores = dados[SENSORES].to_numpy(dtype=float)
+                
+                # Posição de cada leitura contada a partir da mais recente do tanque
+                posicao_fim = dados.groupby(codigos, sort=False).cumcount(ascending=False).to_numpy()
+                mantidos = posicao_fim < tamanho_janela
+                
+                janelas = np.full((len(tanques), tamanho_janela, len(SENSORES)), np.nan)
+                janelas[codigos[mantidos], tamanho_janela - 1 - posicao_fim[mantidos]] = valores[mantidos]
+                n_leituras = np.minimum(np.bincount(codigos, minlength=len(tanques)), tamanho_janela)
+            else:
+                janelas = np.asarray(dados, dtype=float)[:, -tamanho_janela:, :]
+                n_leituras = np.full(len(janelas), janelas.shape[1])
+                if janelas.shape[1] < tamanho_janela:
+                    preenchimento = np.full((len(janelas), tamanho_janela - janelas.shape[1], len(SENSORES)), np.nan)
+                    janelas = np.concatenate([preenchimento, janelas], axis=1)
+                if tanques is None:
+                    tanques = np.arange(len(janelas))
+            
+            if isinstance(modelo, AutoencoderLSTM):
+                pontuacao = _pontuar_janelas_autoencoder(modelo, janelas, n_leituras, limiares, tanques)
+            else:
+                pontuacao = _pontuar_janelas(janelas, n_leituras, limiares=limiares, tanques=tanques)
+            pontuacao['n_leituras'] = n_leituras
+            
+            # Valores atuais (última leitura de cada tanque)
+            for k, sensor in enumerate(SENSORES):
+                pontuacao[sensor] = janelas[:, -1, k]
+            
+            return pontuacao
+            
+        except Exception as e:
+            return f"Erro na detecção de anomalia em lote: {e}"
+    
+    @cronometrado("deteccao.streaming")
+    def processar_leitura(self, leitura, tanque='principal'):
+        """
+        Alimenta o detector incremental do tanque com uma nova leitura
+        e retorna o resultado atualizado, sem reprocessar o histórico
+        """
+        modelo, limiares = self._modelo_e_limiares()
+        if not modelo:
+            return "Modelo LSTM não carregado"
+        
+        try:
+            detector = self.detectores.get(tanque)
+            if detector is None:
+                detector = self.detectores[tanque] = DetectorAnomaliaStreaming(tanque=tanque)
+            # Acompanha trocas de versão do modelo sem perder o histórico do tanque
+            detector.autoencoder = modelo if isinstance(modelo, AutoencoderLSTM) else None
+            detector.limiares = limiares
+            return detector.push(leitura)
+            
+        except Exception as e:
+            return f"Erro na detecção de anomalia: {e}"
+
+class DetectorAnomaliaStreaming:
+    """
+    Versão incremental de detectar_anomalia_agua: recebe uma leitura por vez
+    e mantém mínimos/máximos e somas das janelas de 24h em O(1) amortizado.
+    O resultado equivale a chamar detectar_anomalia_agua nas últimas 48 leituras
+    Com um autoencoder, pontua as últimas `lookback` leituras do buffer com ele
+    Com limiares adaptativos, cada score novo também alimenta os quantis do tanque
+    """
+    
+    def __init__(self, horas_janela=HORAS_JANELA, threshold=THRESHOLD_ANOMALIA, autoencoder=None,
+                 limiares=None, tanque='principal'):
+        self.horas_janela = horas_janela
+        self.threshold = threshold
+        self.autoencoder = autoencoder
+        self.limiares = limiares
+        self.tanque = tanque
+        self.tamanho_janela = 2 * horas_janela
+        
+        # Buffer circular com as últimas 48 leituras
+        self._buffer = np.zeros((self.tamanho_janela, len(SENSORES)))
+        self._n_leituras = 0
+        self._ultima_leitura = None
+        
+        # Somas das 24h atuais e das 24h anteriores
+        self._soma_atual = np.zeros(len(SENSORES))
+        self._soma_anterior = np.zeros(len(SENSORES))
+        
+        # Filas monotônicas (índice, valor) por sensor para mínimo e máximo da janela
+        self._minimos = [deque() for _ in SENSORES]
+        self._maximos = [deque() for _ in SENSORES]
+    
+    def push(self, leitura):
+        """
+        Adiciona uma leitura e retorna o resultado atualizado
+        leitura: dict ou Series com as chaves ['ph', 'temperatura', 'oxigenio', 'turbidez']
+        """
+        valores = np.array([float(leitura[sensor]) for sensor in SENSORES])
+        n = self._n_leituras
+        posicao = n % self.tamanho_janela
+        
+        # Leitura mais antiga sai da janela anterior
+        if n >= self.tamanho_janela:
+            self._soma_anterior -= self._buffer[posicao]
+        
+        # Leitura de 24h atrás passa da janela atual para a anterior
+        if n >= self.horas_janela:
+            saindo = self._buffer[(n - self.horas_janela) % self.tamanho_janela]
+            self._soma_atual -= saindo
+            self._soma_anterior += saindo
+        
+        self._buffer[posicao] = valores
+        self._soma_atual += valores
+        
+        limite = n - self.tamanho_janela
+        for k, valor in enumerate(valores):
+            minimos, maximos = self._minimos[k], self._maximos[k]
+            while minimos and minimos[-1][1] >= valor:
+                minimos.pop()
+            minimos.append((n, valor))
+            if minimos[0][0] <= limite:
+                minimos.popleft()
+            
+            while maximos and maximos[-1][1] <= valor:
+                maximos.pop()
+            maximos.append((n, valor))
+            if maximos[0][0] <= limite:
+                maximos.popleft()
+        
+        self._n_leituras = n + 1
+        self._ultima_leitura = leitura
+        
+        pontuacao = self._pontuar()
+        if pontuacao is None:
+            return self._insuficiente()
+        
+        # Classifica com os limiares atuais e só então inclui o score no histórico
+        resultado = self._montar_resultado(pontuacao)
+        if self.limiares is not None:
+            self.limiares.atualizar(self.tanque, pontuacao[0], pontuacao[1])
+        return resultado
+    
+    def resultado(self):
+        """Resultado da detecção para a janela atual, sem reprocessar o histórico"""
+        pontuacao = self._pontuar()
+        if pontuacao is None:
+            return self._insuficiente()
+        return self._montar_resultado(pontuacao)
+    
+    def _insuficiente(self):
+        necessarias = self.autoencoder.lookback if self.autoencoder is not None else self.horas_janela
+        return DadosInsuficientes(necessarias, self._n_leituras)
+    
+    def _montar_resultado(self, pontuacao):
+        erro_reconstrucao, diferencas, threshold = pontuacao
+        return _montar_resultado_anomalia(
+            erro_reconstrucao, diferencas, self._ultima_leitura, threshold, self.limiares, self.tanque
+        )
+    
+    def _pontuar(self):
+        """(erro de reconstrução, contribuição por sensor, threshold padrão) ou None sem dados suficientes"""
+        if self.autoencoder is not None:
+            return self._pontuar_autoencoder()
+        if self._n_leituras < self.horas_janela:
+            return None
+        
+        # Mesma normalização do MinMaxScaler, aplicada diretamente às médias
+        minimo = np.array([fila[0][1] for fila in self._minimos])
+        maximo = np.array([fila[0][1] for fila in self._maximos])
+        amplitude = maximo - minimo
+        amplitude[amplitude < 10 * np.finfo(float).eps] = 1.0
+        
+        media_atual = (self._soma_atual / self.horas_janela - minimo) / amplitude
+        if self._n_leituras >= self.tamanho_janela:
+            media_anterior = (self._soma_anterior / self.horas_janela - minimo) / amplitude
+        else:
+            media_anterior = media_atual
+        
+        erro_reconstrucao = np.mean((media_atual - media_anterior)**2)
+        diferencas = np.abs(media_atual - media_anterior)
+        return erro_reconstrucao, diferencas, self.threshold
+    
+    def _pontuar_autoencoder(self):
+        lookback = self.autoencoder.lookback
+        if self._n_leituras < lookback:
+            return None
+        
+        # Últimas leituras do buffer circular, da mais antiga para a mais recente
+        posicoes = (self._n_leituras - lookback + np.arange(lookback)) % self.tamanho_janela
+        janela = self.autoencoder.normalizar(self._buffer[posicoes])
+        erros_sensor = self.autoencoder.erros_por_sensor(janela[None])[0]
+        return erros_sensor.mean(), erros_sensor, self.autoencoder.threshold
 
 # Exemplo de uso
 if __name__ == "__main__":
@@ -128,10 +739,26 @@ if __name__ == "__main__":
     # Teste 1: Diagnóstico de parasito
     print("\n=== TESTE DIAGNÓSTICO DE PARASITO ===")
     resultado_parasito = sistema.diagnosticar_parasito("dados_demo/imagens/ictio/amostra_001.jpg")
+    if isinstance(resultado_parasito, ResultadoDiagnostico):
+        resultado_parasito = formatar_diagnostico(resultado_parasito)
     print(f"Diagnóstico: {resultado_parasito}")
     
     # Teste 2: Detecção de anomalia na água
     print("\n=== TESTE DETECÇÃO ANOMALIA ÁGUA ===")
     dados_agua = pd.read_csv("dados_demo/qualidade_agua.csv")
     resultado_agua = sistema.detectar_anomalia_agua(dados_agua.tail(48))  # Últimas 48 horas
-    print(f"Anomalia: {resultado_agua}")
\ No newline at end of file
+    if isinstance(resultado_agua, (ResultadoAnomalia, DadosInsuficientes)):
+        resultado_agua = formatar_anomalia(resultado_agua)
+    print(f"Anomalia: {resultado_agua}")
+    
+    # Teste 3: Detecção incremental, leitura a leitura
+    print("\n=== TESTE DETECÇÃO INCREMENTAL ===")
+    detector = DetectorAnomaliaStreaming()
+    for _, leitura in dados_agua.iterrows():
+        resultado_stream = detector.push(leitura)
+    print(f"Anomalia: {formatar_anomalia(resultado_stream)}")
+    
+    # Teste 4: Detecção em lote para vários tanques
+    print("\n=== TESTE DETECÇÃO EM LOTE ===")
+    resultado_lote = sistema.detectar_anomalia_lote(dados_agua.assign(tanque='tanque_01'))
+    print(formatar_lote(resultado_lote) if isinstance(resultado_lote, np.ndarray) else resultado_lote)
\ No newline at end of file
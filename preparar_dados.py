@@ -1,67 +1,127 @@
 # Script para o widget Python Script no Orange
 # Prepara dados de série temporal para LSTM
 
+import os
+
 import numpy as np
-import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 from Orange.data import Table, Domain, ContinuousVariable
+from Orange.data.pandas_compat import table_to_frame
 from sklearn.preprocessing import MinMaxScaler
 
-def criar_sequencias_lstm(dados, lookback=24):
+COLUNAS_SENSORES = ['ph', 'temperatura', 'oxigenio', 'turbidez']
+THRESHOLD_ANOMALIA = 0.01
+QUANTIL_ANOMALIA = 0.95  # mesmo quantil do nível ATENÇÃO em limiares_adaptativos.py
+CAMINHO_AUTOENCODER = "modelo_qualidade_lstm.npz"
+
+def valores_sensores(dados):
+    """Leituras dos sensores da Orange Table (n_amostras, n_sensores), sem lacunas"""
+    df = table_to_frame(dados)
+    return df[COLUNAS_SENSORES].ffill().to_numpy(dtype=np.float64)
+
+def normalizar_sensores(valores):
     """
-    Transforma dados de série temporal em sequências para LSTM
-    lookback: quantas horas anteriores usar para prever anomalia
+    Normaliza as leituras em uma matriz (n_amostras, n_sensores)
+    contígua em memória, pronta para o janelamento sem cópia
     """
-    
-    # Converter Orange Table para pandas DataFrame
-    df = dados.to_pandas()
-    
-    # Selecionar apenas colunas numéricas de sensores
-    colunas_sensores = ['ph', 'temperatura', 'oxigenio', 'turbidez']
-    df_sensores = df[colunas_sensores].fillna(method='ffill')
-    
-    # Normalizar dados
     scaler = MinMaxScaler()
-    dados_norm = scaler.fit_transform(df_sensores)
-    
-    # Criar sequências
-    X, y = [], []
-    for i in range(lookback, len(dados_norm)):
-        # Sequência de entrada (últimas 'lookback' horas)
-        X.append(dados_norm[i-lookback:i])
-        
-        # Target: erro de reconstrução simulado
-        # (em produção, seria calculado baseado no modelo LSTM treinado)
-        current_values = dados_norm[i]
-        previous_values = dados_norm[i-1]
-        erro_reconstrucao = np.mean((current_values - previous_values)**2)
-        
-        # Definir anomalia se erro > threshold
-        is_anomaly = 1 if erro_reconstrucao > 0.01 else 0
-        y.append(is_anomaly)
-    
-    # Achatar X para usar em Orange (cada sequência vira uma linha)
-    X_flat = np.array(X).reshape(len(X), -1)
-    y = np.array(y)
-    
-    # Criar nomes de colunas
-    col_names = []
-    for t in range(lookback):
-        for sensor in colunas_sensores:
-            col_names.append(f"{sensor}_t-{lookback-t}")
-    
-    # Criar domínio Orange
+    return np.ascontiguousarray(scaler.fit_transform(valores), dtype=np.float64)
+
+def janelas_achatadas(dados_norm, lookback):
+    """
+    Visão zero-cópia das janelas já achatadas: a linha k corresponde a
+    dados_norm[k:k+lookback].ravel(), na mesma ordem (tempo, sensor) das colunas
+    """
+    n_amostras, n_sensores = dados_norm.shape
+    n_janelas = n_amostras - lookback
+    if n_janelas <= 0:
+        return np.empty((0, lookback * n_sensores), dtype=dados_norm.dtype)
+
+    # Como a matriz é contígua, cada janela é um trecho do buffer achatado
+    # começando a cada n_sensores elementos
+    plano = dados_norm.reshape(-1)
+    return sliding_window_view(plano, lookback * n_sensores)[::n_sensores][:n_janelas]
+
+def alvos_reconstrucao(dados_norm, lookback, threshold=THRESHOLD_ANOMALIA, quantil=None):
+    """
+    Aproximação do erro de reconstrução para cada janela, usada enquanto
+    não há um autoencoder ajustado (ver alvos_autoencoder)
+    quantil: se informado (ex.: QUANTIL_ANOMALIA), substitui o threshold fixo
+    pelo quantil dos erros da própria série. Cada série passa a ter a mesma
+    fração de janelas anômalas, mesmo um tanque sem nenhum evento real
+    """
+    diferencas = np.diff(dados_norm[lookback - 1:], axis=0)
+    erro_reconstrucao = np.mean(diferencas**2, axis=1)
+    if quantil is not None:
+        threshold = np.quantile(erro_reconstrucao, quantil) if len(erro_reconstrucao) else 0.0
+    return (erro_reconstrucao > threshold).astype(np.float64)
+
+def alvos_autoencoder(valores, lookback, autoencoder):
+    """
+    Rótulo de anomalia de cada janela pelo erro de reconstrução do autoencoder
+    LSTM, calculado para todas as janelas em uma passada em lote
+    """
+    if autoencoder.lookback != lookback:
+        raise ValueError(f"O autoencoder usa janelas de {autoencoder.lookback} passos, não {lookback}")
+    erros = autoencoder.erros_serie(valores)[:len(valores) - lookback]
+    return (erros > autoencoder.threshold).astype(np.float64)
+
+def carregar_autoencoder(caminho=CAMINHO_AUTOENCODER):
+    """Autoencoder salvo por autoencoder_lstm.py, ou None se ainda não foi ajustado"""
+    if not os.path.exists(caminho):
+        return None
+    from autoencoder_lstm import AutoencoderLSTM
+    return AutoencoderLSTM.carregar(caminho)
+
+def dominio_sequencias(lookback):
+    """Domínio Orange com uma coluna por (passo de tempo, sensor)"""
+    col_names = [
+        f"{sensor}_t-{lookback-t}"
+        for t in range(lookback)
+        for sensor in COLUNAS_SENSORES
+    ]
     attributes = [ContinuousVariable(name) for name in col_names]
     class_var = ContinuousVariable("anomalia")
-    domain = Domain(attributes, class_var)
-    
-    # Criar tabela Orange
-    data_combined = np.column_stack([X_flat, y])
-    table = Table(domain, data_combined)
-    
-    return table
+    return Domain(attributes, class_var)
+
+def _sequencias(dados, lookback, autoencoder, quantil):
+    valores = valores_sensores(dados)
+    dados_norm = normalizar_sensores(valores)
+
+    X_flat = janelas_achatadas(dados_norm, lookback)
+    if autoencoder is not None:
+        y = alvos_autoencoder(valores, lookback, autoencoder)
+    else:
+        y = alvos_reconstrucao(dados_norm, lookback, quantil=quantil)
+    return X_flat, y
+
+def criar_sequencias_lstm(dados, lookback=24, autoencoder=None, quantil=None):
+    """
+    Transforma dados de série temporal em sequências para LSTM
+    lookback: quantas horas anteriores usar para prever anomalia
+    autoencoder: AutoencoderLSTM que rotula as janelas pelo erro de reconstrução
+    quantil: sem autoencoder, rotula pelo quantil da série em vez do threshold fixo
+    """
+    X_flat, y = _sequencias(dados, lookback, autoencoder, quantil)
+
+    # A tabela é criada direto da visão com strides, sem lista intermediária
+    return Table.from_numpy(dominio_sequencias(lookback), X_flat, y)
+
+def gerar_sequencias_lstm_em_blocos(dados, lookback=24, tamanho_bloco=10000, autoencoder=None, quantil=None):
+    """
+    Versão em blocos de criar_sequencias_lstm: produz Orange Tables com no
+    máximo `tamanho_bloco` sequências cada, mantendo o pico de memória limitado
+    independentemente do tamanho da série
+    """
+    domain = dominio_sequencias(lookback)
+    X_flat, y = _sequencias(dados, lookback, autoencoder, quantil)
+
+    for inicio in range(0, len(X_flat), tamanho_bloco):
+        fim = inicio + tamanho_bloco
+        yield Table.from_numpy(domain, X_flat[inicio:fim], y[inicio:fim])
 
 # Executar transformação
-if in_data is not None:
-    out_data = criar_sequencias_lstm(in_data, lookback=24)
+if globals().get('in_data') is not None:
+    out_data = criar_sequencias_lstm(in_data, lookback=24, autoencoder=carregar_autoencoder())
 else:
-    out_data = None
\ No newline at end of file
+    out_data = None
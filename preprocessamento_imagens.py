@@ -0,0 +1,189 @@
+# Decodificação e normalização das imagens microscópicas
+# As imagens vêm de um caminho ou direto do buffer do upload, sem arquivos
+# temporários. JPEGs grandes são decodificados já reduzidos (modo draft do
+# PIL: a redução 1/2, 1/4 ou 1/8 acontece dentro do decodificador), então o
+# custo e a memória dependem do tamanho de saída, não da resolução da câmera.
+# A normalização escreve em buffers float32 reaproveitados por thread.
+#
+# Lâminas muito grandes (varreduras inteiras) são divididas em ladrilhos do
+# tamanho de entrada do modelo, recortados da lâmina decodificada dentro de
+# um orçamento de pixels, em vez de serem reduzidas a uma única imagem
+
+import io
+import os
+import threading
+
+import numpy as np
+
+# Mesmo tamanho e normalização (média/desvio do ImageNet) usados pelas redes do Image Embedding
+TAMANHO_IMAGEM = (224, 224)
+MEDIA_IMAGENET = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+DESVIO_IMAGENET = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# (pixel / 255 - média) / desvio == pixel * ESCALA + DESLOCAMENTO
+ESCALA = (1.0 / (255.0 * DESVIO_IMAGENET)).astype(np.float32)
+DESLOCAMENTO = (-MEDIA_IMAGENET / DESVIO_IMAGENET).astype(np.float32)
+
+# O draft decodifica com pelo menos FOLGA_DRAFT vezes o tamanho pedido, para o
+# LANCZOS ainda ter pixels para suavizar (mesmo critério do Image.thumbnail)
+FOLGA_DRAFT = 2.0
+
+LIMITE_PIXELS_LAMINA = 50_000_000  # acima disso a imagem é tratada como lâmina e dividida em ladrilhos
+# Orçamento de pixels decodificados por imagem (~300 MB em RGB). JPEGs maiores
+# são decodificados já reduzidos (1/2, 1/4, 1/8) para caber nele; os demais
+# formatos não têm redução no decodificador e acima dele são recusados
+PIXELS_MAXIMOS_DECODIFICADOS = 100_000_000
+REDUCAO_MAXIMA_DRAFT = 8
+LADO_MINIATURA = 800
+
+_buffers = threading.local()
+
+def abrir(origem, pixels_maximos=None):
+    """
+    Abre a imagem sem decodificar os pixels (só o cabeçalho)
+    origem: caminho, bytes ou arquivo em memória (BytesIO, UploadedFile do Streamlit)
+    pixels_maximos: orçamento de pixels decodificados de quem vai reduzir a imagem no
+    draft. JPEGs são aceitos até o que a redução 1/8 deixa dentro dele, mesmo acima do
+    limite global do PIL (Image.MAX_IMAGE_PIXELS), que não é alterado; outros formatos
+    acima do orçamento levantam DecompressionBombError. Sem orçamento vale só o limite global
+    """
+    from PIL import Image, JpegImagePlugin
+
+    if isinstance(origem, (bytes, bytearray, memoryview)):
+        origem = io.BytesIO(origem)
+    elif not isinstance(origem, (str, os.PathLike)) and hasattr(origem, "getvalue"):
+        # BytesIO sobre os mesmos bytes: independe da posição de leitura do upload
+        origem = io.BytesIO(origem.getvalue())
+    if pixels_maximos is None or not _eh_jpeg(origem):
+        img = Image.open(origem)
+        limite = pixels_maximos
+    else:
+        # O plugin do JPEG lê só o cabeçalho, sem a checagem global do Image.open
+        img = JpegImagePlugin.JpegImageFile(origem)
+        limite = pixels_maximos * REDUCAO_MAXIMA_DRAFT ** 2
+    if limite is not None and img.width * img.height > limite:
+        img.close()
+        raise Image.DecompressionBombError(
+            f"Imagem {img.width}x{img.height} acima do orçamento de {pixels_maximos} pixels decodificados"
+        )
+    return img
+
+def _eh_jpeg(origem):
+    if isinstance(origem, (str, os.PathLike)):
+        with open(origem, "rb") as f:
+            assinatura = f.read(3)
+    else:
+        posicao = origem.tell()
+        assinatura = origem.read(3)
+        origem.seek(posicao)
+    return assinatura == b"\xff\xd8\xff"
+
+def dimensoes(origem, pixels_maximos=PIXELS_MAXIMOS_DECODIFICADOS):
+    """(largura, altura) lidas do cabeçalho"""
+    with abrir(origem, pixels_maximos) as img:
+        return img.size
+
+def eh_lamina(origem):
+    largura, altura = dimensoes(origem)
+    return largura * altura > LIMITE_PIXELS_LAMINA
+
+def _reduzir(img, tamanho):
+    """
+    Decodifica já reduzida (JPEG) e converte para RGB
+    tamanho: tamanho final, com a proporção da imagem quando ela for mantida
+    """
+    img.draft('RGB', (int(tamanho[0] * FOLGA_DRAFT), int(tamanho[1] * FOLGA_DRAFT)))
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+def _conter(img, lado):
+    """Tamanho com a proporção de img e o maior lado limitado a lado"""
+    escala = min(1.0, lado / max(img.size))
+    return max(1, round(img.width * escala)), max(1, round(img.height * escala))
+
+def decodificar(origem, tamanho=TAMANHO_IMAGEM, pixels_maximos=PIXELS_MAXIMOS_DECODIFICADOS):
+    """Imagem RGB (PIL) redimensionada para tamanho"""
+    from PIL import Image
+
+    with abrir(origem, pixels_maximos) as img:
+        img = _reduzir(img, tamanho)
+        return img.resize(tamanho, Image.LANCZOS, reducing_gap=FOLGA_DRAFT)
+
+def miniatura(origem, lado=LADO_MINIATURA, pixels_maximos=PIXELS_MAXIMOS_DECODIFICADOS):
+    """Cópia reduzida para exibição, com a proporção original"""
+    from PIL import Image
+
+    with abrir(origem, pixels_maximos) as img:
+        alvo = _conter(img, lado)
+        return _reduzir(img, alvo).resize(alvo, Image.LANCZOS, reducing_gap=FOLGA_DRAFT)
+
+def normalizar(img, saida=None):
+    """
+    Pixels normalizados como o Image Embedding do Orange, em float32 (altura, largura, 3)
+    saida: array onde escrever; por padrão um buffer da thread, sobrescrito
+    na próxima chamada com o mesmo tamanho (copie se for guardar o resultado)
+    """
+    pixels = np.asarray(img)
+    if saida is None:
+        saida = buffer_thread(pixels.shape)
+    np.multiply(pixels, ESCALA, out=saida)
+    np.add(saida, DESLOCAMENTO, out=saida)
+    return saida
+
+def buffer_thread(forma):
+    """Buffer float32 da thread atual, reaproveitado entre imagens do mesmo tamanho"""
+    buffers = getattr(_buffers, 'por_forma', None)
+    if buffers is None:
+        buffers = _buffers.por_forma = {}
+    buffer = buffers.get(forma)
+    if buffer is None:
+        buffer = buffers[forma] = np.empty(forma, dtype=np.float32)
+    return buffer
+
+def posicoes_ladrilhos(comprimento, lado):
+    """Inícios dos ladrilhos em um eixo; o último encosta na borda (sobrepondo o anterior)"""
+    if comprimento <= lado:
+        return [0]
+    posicoes = list(range(0, comprimento - lado + 1, lado))
+    if posicoes[-1] + lado < comprimento:
+        posicoes.append(comprimento - lado)
+    return posicoes
+
+def fator_reducao(dimensoes, pixels_maximos=PIXELS_MAXIMOS_DECODIFICADOS):
+    """Menor potência de 2 que, dividindo cada lado, deixa a imagem com até pixels_maximos"""
+    largura, altura = dimensoes
+    fator = 1
+    while (largura // fator) * (altura // fator) > pixels_maximos:
+        fator *= 2
+    return fator
+
+def ladrilhos(origem, tamanho=TAMANHO_IMAGEM, pixels_maximos=PIXELS_MAXIMOS_DECODIFICADOS):
+    """
+    Gera os ladrilhos normalizados de uma lâmina grande, da esquerda para a
+    direita e de cima para baixo, recortados da lâmina na escala original
+    ou, acima de pixels_maximos, da versão reduzida pelo decodificador JPEG
+    (a memória fica limitada ao orçamento, qualquer que seja a resolução).
+    Cada ladrilho reaproveita o mesmo buffer
+    """
+    from PIL import Image
+
+    with abrir(origem, pixels_maximos) as img:
+        fator = fator_reducao(img.size, pixels_maximos)
+        if fator > 1:
+            # O decodificador reduz até 1/8 (abrir garante que isso cabe no orçamento);
+            # o restante é feito por Image.reduce sobre a imagem já reduzida
+            alvo = (max(1, img.width // fator), max(1, img.height // fator))
+            img.draft('RGB', alvo)
+            resto = img.width // alvo[0]
+            if resto > 1:
+                img = img.reduce(resto)
+        img = img if img.mode == 'RGB' else img.convert('RGB')
+        if img.width < tamanho[0] or img.height < tamanho[1]:
+            yield normalizar(img.resize(tamanho, Image.LANCZOS))
+            return
+
+        # Uma faixa de ladrilhos por vez vira array: a lâmina não é copiada inteira
+        largura, altura = tamanho
+        for topo in posicoes_ladrilhos(img.height, altura):
+            faixa = np.asarray(img.crop((0, topo, img.width, topo + altura)))
+            for esquerda in posicoes_ladrilhos(img.width, largura):
+                yield normalizar(faixa[:, esquerda:esquerda + largura])
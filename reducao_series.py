@@ -0,0 +1,107 @@
+# Redução de séries temporais para gráficos
+# Um gráfico não mostra mais pontos do que tem de pixels na horizontal: as
+# séries são reduzidas no servidor antes de ir para o navegador, preservando
+# picos (min/max por intervalo) ou o formato da curva (LTTB)
+
+import numpy as np
+
+PONTOS_GRAFICO = 1500  # aproximadamente a largura em pixels de um gráfico no layout wide
+METODOS = ('minmax', 'lttb')
+
+def _numerico(x):
+    """Eixo x como float64 (datas viram nanossegundos)"""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+def indices_minmax(y, n_pontos=PONTOS_GRAFICO):
+    """
+    Divide a série em n_pontos/2 intervalos de mesmo tamanho e mantém o mínimo e
+    o máximo de cada um (além do primeiro e do último ponto). Totalmente
+    vetorizado; nenhum pico ou vale some do gráfico
+    Retorna os índices mantidos, em ordem
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    n_baldes = max(1, n_pontos // 2)
+    if n <= n_pontos:
+        return np.arange(n)
+
+    # Intervalos de mesmo tamanho; o último é completado com NaN
+    tamanho = -(-n // n_baldes)
+    n_baldes = -(-n // tamanho)
+    baldes = np.full(n_baldes * tamanho, np.nan)
+    baldes[:n] = y
+    baldes = baldes.reshape(n_baldes, tamanho)
+
+    inicio = np.arange(n_baldes) * tamanho
+    minimos = inicio + np.argmin(np.where(np.isnan(baldes), np.inf, baldes), axis=1)
+    maximos = inicio + np.argmax(np.where(np.isnan(baldes), -np.inf, baldes), axis=1)
+
+    indices = np.concatenate([[0, n - 1], minimos, maximos])
+    return np.unique(indices[indices < n])
+
+def indices_lttb(x, y, n_pontos=PONTOS_GRAFICO):
+    """
+    Largest-Triangle-Three-Buckets (Steinarsson, 2013): em cada intervalo mantém
+    o ponto que forma o maior triângulo com o ponto escolhido no intervalo anterior
+    e a média do seguinte. As médias de todos os intervalos são calculadas de uma
+    vez; só a escolha encadeada percorre os intervalos
+    Retorna os índices mantidos, em ordem
+    """
+    x = _numerico(x)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= n_pontos or n_pontos < 3:
+        return np.arange(n)
+
+    # n_pontos - 2 intervalos entre o primeiro e o último ponto
+    bordas = np.linspace(1, n - 1, n_pontos - 1).astype(np.int64)
+    contagens = np.diff(bordas)
+    media_x = np.add.reduceat(x[:n - 1], bordas[:-1]) / contagens
+    media_y = np.add.reduceat(np.nan_to_num(y[:n - 1]), bordas[:-1]) / contagens
+
+    # Para cada intervalo, a média do intervalo seguinte (o último usa o ponto final)
+    proximo_x = np.append(media_x[1:], x[-1])
+    proximo_y = np.append(media_y[1:], y[-1])
+
+    indices = np.empty(n_pontos, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for b in range(n_pontos - 2):
+        inicio, fim = bordas[b], bordas[b + 1]
+        area = np.abs(
+            (x[a] - proximo_x[b]) * (y[inicio:fim] - y[a])
+            - (x[a] - x[inicio:fim]) * (proximo_y[b] - y[a])
+        )
+        a = inicio + np.argmax(np.nan_to_num(area, nan=-1.0))
+        indices[b + 1] = a
+    return indices
+
+def reduzir(x, y, n_pontos=PONTOS_GRAFICO, metodo='minmax'):
+    """Reduz um par (x, y) a no máximo ~n_pontos pontos; retorna (x, y) reduzidos"""
+    if metodo == 'minmax':
+        indices = indices_minmax(y, n_pontos)
+    elif metodo == 'lttb':
+        indices = indices_lttb(x, y, n_pontos)
+    else:
+        raise ValueError(f"Método de redução desconhecido: {metodo} (use um de {METODOS})")
+    return np.asarray(x)[indices], np.asarray(y)[indices]
+
+def reduzir_frame(dados, x, colunas, n_pontos=PONTOS_GRAFICO, metodo='minmax'):
+    """
+    Reduz as linhas de um DataFrame para um gráfico com as colunas indicadas
+    Cada coluna é reduzida separadamente e as linhas escolhidas para qualquer
+    uma delas são mantidas, para que todas as curvas compartilhem os mesmos pontos
+    """
+    if len(dados) <= n_pontos:
+        return dados
+    n_por_coluna = max(3, n_pontos // len(colunas))
+    if metodo == 'minmax':
+        partes = [indices_minmax(dados[c].to_numpy(dtype=float), n_por_coluna) for c in colunas]
+    elif metodo == 'lttb':
+        partes = [indices_lttb(dados[x].to_numpy(), dados[c].to_numpy(dtype=float), n_por_coluna) for c in colunas]
+    else:
+        raise ValueError(f"Método de redução desconhecido: {metodo} (use um de {METODOS})")
+    return dados.iloc[np.unique(np.concatenate(partes))]
@@ -0,0 +1,250 @@
+# Registro de versões dos modelos treinados no Orange
+# Acompanha os artefatos .pkcls, carrega versões novas em segundo plano,
+# aquece o modelo e só então o coloca em uso, sem reiniciar o dashboard
+
+import glob
+import json
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from modelos_orange import carregar_artefato, hash_arquivo
+
+ARQUIVO_REGISTRO = "registro_modelos.json"
+EXTENSOES_MODELO = (".pkcls", ".npz")  # modelos do Orange e pesos do autoencoder LSTM
+
+def aquecer_modelo(modelo):
+    """
+    Faz uma predição descartável para que a primeira requisição real não pague
+    a inicialização preguiçosa do modelo (transformações de domínio, caches internos)
+    """
+    if not hasattr(modelo, "original_domain"):
+        return
+    from diagnostico_imagens import prever_probabilidades
+
+    n_atributos = len(modelo.original_domain.attributes)
+    prever_probabilidades(modelo, np.zeros((1, n_atributos), dtype=np.float32))
+
+def artefatos_modelo(nome, diretorio="."):
+    """Caminhos de <nome>.pkcls, <nome>-<rótulo>.pkcls (e .npz) no diretório"""
+    caminhos = []
+    for extensao in EXTENSOES_MODELO:
+        caminhos += glob.glob(os.path.join(diretorio, f"{nome}{extensao}"))
+        caminhos += glob.glob(os.path.join(diretorio, f"{nome}-*{extensao}"))
+    return caminhos
+
+def escolher_artefato(candidatos, modificado_em, checksum, fixada=None):
+    """
+    Regra única de qual artefato usar: o da versão fixada, se houver, senão o
+    modificado por último (qualquer extensão); None sem candidatos
+    modificado_em, checksum: funções caminho -> data de modificação / SHA-256
+    """
+    if fixada is not None:
+        candidatos = [c for c in candidatos if checksum(c) == fixada]
+    return max(candidatos, key=modificado_em, default=None)
+
+def ler_registro(diretorio="."):
+    caminho = os.path.join(diretorio, ARQUIVO_REGISTRO)
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho, encoding="utf-8") as f:
+        return json.load(f)
+
+def resolver_artefato(nome, diretorio="."):
+    """
+    Artefato a carregar na inicialização, pela mesma regra do RegistroModelos:
+    o da versão fixada no registro_modelos.json ou, se ele não estiver no
+    diretório, o modificado por último. None se o modelo não tiver artefatos
+    """
+    candidatos = artefatos_modelo(nome, diretorio)
+    fixada = ler_registro(diretorio).get(nome, {}).get('fixada')
+    return (
+        escolher_artefato(candidatos, os.path.getmtime, hash_arquivo, fixada)
+        or escolher_artefato(candidatos, os.path.getmtime, hash_arquivo)
+    )
+
+class RegistroModelos:
+    """
+    Para cada modelo (nome base, ex.: 'modelo_parasitos_cnn') considera os artefatos
+        <nome>.pkcls e <nome>-<rótulo>.pkcls (ou .npz, para o autoencoder LSTM)
+    identificados pelo SHA-256 do conteúdo. O artefato modificado mais
+    recentemente é a versão desejada; quando ela difere da versão em uso, é
+    carregada e aquecida nesta thread e trocada atomicamente no ModeloPreguicoso.
+    Uma versão ativada manualmente (ex.: rollback) fica fixada: as verificações
+    deixam de promover o artefato mais recente até liberar() ser chamado.
+    As versões vistas e a fixação ficam registradas em registro_modelos.json
+    """
+
+    def __init__(self, modelos, diretorio=".", intervalo=5.0):
+        """
+        modelos: {nome base: (ModeloPreguicoso, função de aquecimento ou None)}
+        """
+        self.modelos = modelos
+        self.diretorio = diretorio
+        self.intervalo = intervalo
+        self.caminho_registro = os.path.join(diretorio, ARQUIVO_REGISTRO)
+
+        self._vistos = {}  # caminho -> assinatura (mtime, tamanho) da última verificação
+        self._checksums = {}  # caminho -> (assinatura, sha256)
+        self._invalidos = set()  # sha256 de artefatos que falharam ao carregar
+        self._parar = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._registro = ler_registro(diretorio)
+
+    def iniciar(self):
+        """Verifica o diretório periodicamente em uma thread de fundo"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._observar, name="registro-modelos", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def versoes(self, nome):
+        """Versões conhecidas de um modelo, da mais antiga para a mais nova"""
+        with self._lock:
+            versoes = self._registro.get(nome, {}).get('versoes', {})
+            return sorted(
+                ({'sha256': sha, **info} for sha, info in versoes.items()),
+                key=lambda v: v['registrado_em']
+            )
+
+    def ativa(self, nome):
+        with self._lock:
+            return self._registro.get(nome, {}).get('ativa')
+
+    def fixada(self, nome):
+        """SHA-256 da versão fixada por ativar(), ou None"""
+        with self._lock:
+            return self._registro.get(nome, {}).get('fixada')
+
+    def ativar(self, nome, caminho, fixar=True):
+        """
+        Carrega, aquece e coloca em uso um artefato específico (ex.: rollback)
+        fixar: mantém esta versão em uso mesmo que surjam artefatos mais novos
+        """
+        sha = self._ativar(nome, caminho)
+        self._fixar(nome, sha if fixar else None)
+
+    def liberar(self, nome):
+        """Desfaz a fixação: a próxima verificação volta a usar o artefato mais recente"""
+        self._fixar(nome, None)
+
+    def _ativar(self, nome, caminho):
+        modelo_preguicoso, aquecer = self.modelos[nome]
+        sha = hash_arquivo(caminho)
+        modelo = carregar_artefato(caminho)
+        if aquecer is not None:
+            aquecer(modelo)
+
+        modelo_preguicoso.trocar(modelo, sha[:16], caminho=caminho)
+        self._registrar(nome, caminho, sha, ativa=True)
+        print(f"✓ Modelo {modelo_preguicoso.nome} atualizado para a versão {sha[:16]} ({os.path.basename(caminho)})")
+        return sha
+
+    def verificar(self):
+        """Uma rodada de verificação do diretório; retorna os modelos trocados"""
+        trocados = []
+        for nome, (modelo_preguicoso, _) in self.modelos.items():
+            candidatos = self._artefatos_estaveis(nome)
+            if not candidatos:
+                continue
+
+            for caminho in candidatos:
+                self._registrar(nome, caminho, self._checksum(caminho))
+
+            # Versão desejada: a fixada ou o artefato modificado por último
+            # (sem o artefato fixado no diretório, a versão em uso é mantida)
+            caminho = escolher_artefato(candidatos, lambda c: self._vistos[c][0], self._checksum, self.fixada(nome))
+            if caminho is None:
+                continue
+            sha = self._checksum(caminho)
+
+            if modelo_preguicoso.modelo is None:
+                # Ainda não usado: apenas aponta o carregamento preguiçoso para o artefato
+                modelo_preguicoso.caminho = caminho
+                continue
+            if modelo_preguicoso.versao == sha[:16]:
+                self._registrar(nome, caminho, sha, ativa=True)
+                continue
+            if sha in self._invalidos:
+                continue
+
+            try:
+                self._ativar(nome, caminho)
+                trocados.append(nome)
+            except Exception as e:
+                # Artefato inválido ou incompleto: mantém a versão em uso
+                # (só tenta de novo quando o conteúdo do arquivo mudar)
+                print(f"❌ Erro ao carregar nova versão de {nome} ({os.path.basename(caminho)}): {e}")
+                self._invalidos.add(sha)
+        return trocados
+
+    def _observar(self):
+        while not self._parar.is_set():
+            try:
+                self.verificar()
+            except Exception as e:
+                print(f"❌ Erro no registro de modelos: {e}")
+            self._parar.wait(self.intervalo)
+
+    def _artefatos_estaveis(self, nome):
+        """
+        Artefatos do modelo cujo tamanho e data não mudaram desde a verificação
+        anterior, para não carregar um arquivo ainda sendo gravado
+        """
+        estaveis = []
+        for caminho in artefatos_modelo(nome, self.diretorio):
+            try:
+                info = os.stat(caminho)
+            except FileNotFoundError:
+                continue
+            assinatura = (info.st_mtime_ns, info.st_size)
+            if self._vistos.get(caminho) == assinatura:
+                estaveis.append(caminho)
+            self._vistos[caminho] = assinatura
+        return estaveis
+
+    def _checksum(self, caminho):
+        assinatura = self._vistos[caminho]
+        anterior = self._checksums.get(caminho)
+        if anterior is None or anterior[0] != assinatura:
+            anterior = (assinatura, hash_arquivo(caminho))
+            self._checksums[caminho] = anterior
+        return anterior[1]
+
+    def _registrar(self, nome, caminho, sha, ativa=False):
+        with self._lock:
+            entrada = self._registro.setdefault(nome, {'ativa': None, 'versoes': {}})
+            alterado = sha not in entrada['versoes']
+            if alterado:
+                entrada['versoes'][sha] = {
+                    'arquivo': os.path.basename(caminho),
+                    'tamanho': os.path.getsize(caminho),
+                    'registrado_em': datetime.now().isoformat(timespec='seconds'),
+                }
+            if ativa and entrada['ativa'] != sha:
+                entrada['ativa'] = sha
+                alterado = True
+            if alterado:
+                self._gravar_registro()
+
+    def _fixar(self, nome, sha):
+        with self._lock:
+            entrada = self._registro.setdefault(nome, {'ativa': None, 'versoes': {}})
+            if entrada.get('fixada') != sha:
+                entrada['fixada'] = sha
+                self._gravar_registro()
+
+    def _gravar_registro(self):
+        temporario = self.caminho_registro + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(self._registro, f, ensure_ascii=False, indent=2)
+        os.replace(temporario, self.caminho_registro)
@@ -0,0 +1,273 @@
+# Relatórios em PDF do histórico de um tanque, gerados em segundo plano
+# O botão do dashboard só enfileira o pedido: um pool de threads monta o
+# relatório e a página acompanha o progresso do pedido.
+#
+# Os relatórios usam apenas as agregações (hora, dia, semana) e o histórico de
+# alertas, nunca as leituras brutas, então meses de dados custam o mesmo que
+# alguns dias. Relatórios prontos ficam em disco, identificados por (tanque,
+# período, versão das partições do período, versão dos episódios de alerta do
+# período): pedir de novo o mesmo relatório é imediato, e só leituras novas ou
+# alertas abertos, atualizados ou fechados dentro do período geram um relatório novo
+#
+# O PDF é desenhado com o matplotlib (já instalado com o Orange3), pela API
+# orientada a objetos: sem pyplot, cada thread usa suas próprias figuras
+
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from agregacoes import AgregacoesSensores, escolher_resolucao
+from armazenamento_sensores import TANQUE_PADRAO
+from instrumentacao import contar, medir
+from resultados import PARAMETROS, SENSORES
+
+DIRETORIO_RELATORIOS = "dados_demo/relatorios"
+MAX_RELATORIOS = 32  # relatórios mantidos em disco; os mais antigos são apagados
+PONTOS_RELATORIO = 400  # baldes por curva nos gráficos
+TAMANHO_PAGINA = (8.27, 11.69)  # A4, em polegadas
+LINHAS_ALERTAS = 40  # episódios listados no relatório
+
+# Linhas de referência dos gráficos (mesmas do dashboard)
+REFERENCIAS = {'ph': (6.5, 8.5), 'oxigenio': (4.0,)}
+
+@dataclass(slots=True)
+class PedidoRelatorio:
+    """
+    Um relatório pedido ao GeradorRelatorios
+    progresso vai de 0 a 1; etapa descreve o que está sendo feito
+    """
+    tanque: str
+    inicio: pd.Timestamp
+    fim: pd.Timestamp
+    versao: object
+    caminho: str
+    progresso: float = 0.0
+    etapa: str = "Na fila"
+    erro: str = None
+    futuro: Future = None
+
+    @property
+    def concluido(self):
+        return self.futuro is None or self.futuro.done()
+
+    @property
+    def pronto(self):
+        return self.concluido and self.erro is None and os.path.exists(self.caminho)
+
+    @property
+    def nome_arquivo(self):
+        return f"relatorio_{self.tanque}_{self.inicio:%Y%m%d}_{self.fim:%Y%m%d}.pdf"
+
+    def conteudo(self):
+        with open(self.caminho, "rb") as f:
+            return f.read()
+
+    def _avancar(self, progresso, etapa):
+        self.progresso, self.etapa = progresso, etapa
+
+class GeradorRelatorios:
+    """
+    Fila de relatórios com um pool de threads
+    agregacoes: AgregacoesSensores por tanque já em uso no processo (as que
+    faltarem são abertas aqui); alertas: MotorAlertas para a lista de episódios
+    """
+
+    def __init__(self, armazenamento, agregacoes=None, alertas=None,
+                 diretorio=DIRETORIO_RELATORIOS, n_threads=2):
+        self.armazenamento = armazenamento
+        self.alertas = alertas
+        self.diretorio = diretorio
+        self._agregacoes = dict(agregacoes or {})
+        self._pedidos = {}  # só pedidos em andamento; os concluídos ficam no disco
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix="relatorios")
+
+    def solicitar(self, inicio, fim, tanque=TANQUE_PADRAO):
+        """
+        Pede o relatório do período; retorna o PedidoRelatorio (já concluído
+        se o mesmo relatório estiver em disco ou em andamento)
+        """
+        tanque = str(tanque)
+        inicio, fim = pd.Timestamp(inicio), pd.Timestamp(fim)
+        versao = self.armazenamento.versao_periodo(inicio, fim, tanque)
+        versao_alertas = None
+        if self.alertas is not None:
+            self.alertas.sincronizar()
+            versao_alertas = self.alertas.versao_periodo(tanque, inicio, fim)
+        chave = (tanque, inicio.value, fim.value, versao, versao_alertas)
+
+        with self._lock:
+            self._pedidos = {c: p for c, p in self._pedidos.items() if not p.concluido}
+            pedido = self._pedidos.get(chave)
+            if pedido is not None:
+                contar("relatorio.reaproveitado")
+                return pedido
+
+            pedido = PedidoRelatorio(tanque, inicio, fim, versao, self._caminho(chave))
+            self._pedidos[chave] = pedido
+            if os.path.exists(pedido.caminho):
+                contar("relatorio.cache")
+                pedido._avancar(1.0, "Concluído")
+            else:
+                pedido.futuro = self._executor.submit(self._gerar, pedido)
+        return pedido
+
+    def encerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _caminho(self, chave):
+        resumo = hashlib.sha1(repr(chave).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.diretorio, f"{chave[0]}_{resumo}.pdf")
+
+    def _agregacoes_tanque(self, tanque):
+        with self._lock:
+            agregacoes = self._agregacoes.get(tanque)
+            if agregacoes is None:
+                agregacoes = self._agregacoes[tanque] = AgregacoesSensores(self.armazenamento, tanque)
+        return agregacoes
+
+    def _gerar(self, pedido):
+        try:
+            with medir("relatorio.gerar"):
+                self._montar(pedido)
+            pedido._avancar(1.0, "Concluído")
+        except Exception as erro:
+            pedido.erro = f"Erro ao gerar relatório: {erro}"
+            raise
+        finally:
+            self._limpar()
+
+    def _montar(self, pedido):
+        pedido._avancar(0.05, "Atualizando agregações")
+        agregacoes = self._agregacoes_tanque(pedido.tanque)
+        agregacoes.sincronizar()
+
+        pedido._avancar(0.2, "Calculando estatísticas")
+        estatisticas = agregacoes.estatisticas(pedido.inicio, pedido.fim)
+        resolucao = escolher_resolucao(pedido.inicio, pedido.fim, PONTOS_RELATORIO) or 'hora'
+        serie = agregacoes.serie(resolucao, pedido.inicio, pedido.fim)
+
+        pedido._avancar(0.35, "Listando alertas")
+        # O log de alertas já foi sincronizado em solicitar, ao montar a chave do pedido
+        episodios = []
+        if self.alertas is not None:
+            episodios = self.alertas.episodios(pedido.tanque, pedido.inicio, pedido.fim)
+
+        os.makedirs(self.diretorio, exist_ok=True)
+        temporario = f"{pedido.caminho}.{threading.get_ident()}.tmp"
+        try:
+            self._desenhar(pedido, temporario, estatisticas, serie, resolucao, agregacoes.sensores, episodios)
+            os.replace(temporario, pedido.caminho)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+
+    def _desenhar(self, pedido, caminho, estatisticas, serie, resolucao, sensores, episodios):
+        from matplotlib.backends.backend_pdf import PdfPages
+
+        with PdfPages(caminho) as pdf:
+            pedido._avancar(0.5, "Desenhando resumo")
+            pdf.savefig(_pagina_resumo(pedido, estatisticas, episodios))
+
+            pedido._avancar(0.65, "Desenhando gráficos")
+            pdf.savefig(_pagina_series(serie, resolucao, sensores))
+
+            pedido._avancar(0.85, "Desenhando alertas")
+            pdf.savefig(_pagina_alertas(episodios))
+
+            informacoes = pdf.infodict()
+            informacoes['Title'] = f"AquaIA - Relatório do tanque {pedido.tanque}"
+            informacoes['Subject'] = f"{pedido.inicio:%d/%m/%Y} a {pedido.fim:%d/%m/%Y}"
+
+    def _limpar(self):
+        """Apaga os relatórios mais antigos além de MAX_RELATORIOS"""
+        if not os.path.isdir(self.diretorio):
+            return
+        arquivos = [
+            os.path.join(self.diretorio, nome) for nome in os.listdir(self.diretorio) if nome.endswith(".pdf")
+        ]
+        arquivos.sort(key=os.path.getmtime, reverse=True)
+        for caminho in arquivos[MAX_RELATORIOS:]:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+# Páginas do relatório
+
+def _nova_pagina():
+    from matplotlib.figure import Figure
+    return Figure(figsize=TAMANHO_PAGINA)
+
+def _pagina_resumo(pedido, estatisticas, episodios):
+    figura = _nova_pagina()
+    figura.text(0.08, 0.94, "AquaIA Amapá - Relatório de Qualidade da Água", fontsize=16, weight='bold')
+    linhas = [
+        f"Tanque: {pedido.tanque}",
+        f"Período: {pedido.inicio:%d/%m/%Y} a {pedido.fim:%d/%m/%Y}",
+        f"Leituras no período: {int(estatisticas.loc['count'].iloc[0]):,}",
+        f"Alertas no período: {len(episodios)}",
+        f"Gerado em: {pd.Timestamp.now():%d/%m/%Y %H:%M}",
+    ]
+    for k, linha in enumerate(linhas):
+        figura.text(0.08, 0.90 - 0.025 * k, linha, fontsize=10)
+
+    eixo = figura.add_axes([0.2, 0.45, 0.72, 0.28])
+    eixo.axis('off')
+    figura.text(0.08, 0.75, "Estatísticas do período", fontsize=12)
+    tabela = estatisticas.drop(index='count').T
+    nomes = dict(zip(SENSORES, PARAMETROS))
+    eixo.table(
+        cellText=[[f"{v:.2f}" if np.isfinite(v) else "-" for v in linha] for linha in tabela.to_numpy()],
+        rowLabels=[nomes.get(sensor, sensor) for sensor in tabela.index],
+        colLabels=[{'mean': 'média', 'std': 'desvio'}.get(c, c) for c in tabela.columns],
+        loc='upper center'
+    ).scale(1, 1.6)
+    return figura
+
+def _pagina_series(serie, resolucao, sensores):
+    figura = _nova_pagina()
+    figura.suptitle(f"Tendências (média, mínimo e máximo por {resolucao})", x=0.08, ha='left', fontsize=12)
+    eixos = figura.subplots(len(sensores), 1, sharex=True)
+    nomes = dict(zip(SENSORES, PARAMETROS))
+    for eixo, sensor in zip(np.atleast_1d(eixos), sensores):
+        eixo.fill_between(serie['timestamp'], serie[f"{sensor}_min"], serie[f"{sensor}_max"], alpha=0.25, linewidth=0)
+        eixo.plot(serie['timestamp'], serie[sensor], linewidth=1)
+        for referencia in REFERENCIAS.get(sensor, ()):
+            eixo.axhline(referencia, color='red', linestyle='--', linewidth=0.8)
+        eixo.set_ylabel(nomes.get(sensor, sensor))
+        eixo.grid(alpha=0.3)
+    figura.autofmt_xdate()
+    figura.subplots_adjust(top=0.94, bottom=0.08)
+    return figura
+
+def _pagina_alertas(episodios):
+    figura = _nova_pagina()
+    eixo = figura.add_axes([0.05, 0.05, 0.9, 0.85])
+    eixo.axis('off')
+    eixo.set_title("Alertas no período", loc='left', fontsize=12)
+    if not episodios:
+        eixo.text(0, 0.95, "Nenhum alerta no período", fontsize=10)
+        return figura
+
+    episodios = sorted(episodios, key=lambda e: e.inicio, reverse=True)
+    linhas = [
+        [
+            PARAMETROS[e.parametro], e.nivel_maximo.rotulo, f"{e.inicio:%d/%m %H:%M}",
+            "ativo" if e.fim is None else f"{e.fim:%d/%m %H:%M}", str(e.n_ocorrencias), f"{e.score_maximo:.4f}",
+        ]
+        for e in episodios[:LINHAS_ALERTAS]
+    ]
+    eixo.table(
+        cellText=linhas,
+        colLabels=['Parâmetro', 'Nível máximo', 'Início', 'Fim', 'Ocorrências', 'Score máximo'],
+        loc='upper center'
+    ).scale(1, 1.3)
+    if len(episodios) > LINHAS_ALERTAS:
+        eixo.text(0, 0, f"... e mais {len(episodios) - LINHAS_ALERTAS} episódios", fontsize=9)
+    return figura
@@ -0,0 +1,417 @@
+# Reprocessamento (backfill) do histórico dos sensores
+# Uso: python reprocessamento.py --processos 4 [--tanques principal tanque_02] [--aprender-limiares]
+#
+# Recalcula o score de anomalia e o nível de alerta de cada leitura do histórico,
+# exatamente como detectar_anomalia_agua faria naquele instante (janela das 48
+# leituras anteriores), mas sem reajustar um MinMaxScaler por passo: a série de
+# cada tanque é dividida em partições com sobreposição de uma janela, pontuadas
+# em lote por um pool de processos. Séries e scores ficam em memória compartilhada
+# (multiprocessing.shared_memory), sem cópia para os processos.
+#
+# Os resultados são gravados, em ordem, em um armazenamento colunar próprio
+# (mesmo formato do armazenamento dos sensores). Ele serve de checkpoint: ao ser
+# interrompido, o reprocessamento continua da última leitura gravada. Se o
+# modelo ou a configuração mudar, recomeça do zero
+
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from armazenamento_sensores import ArmazenamentoSensores
+from instrumentacao import medir
+from limiares_adaptativos import LimiaresAdaptativos
+from modelos_orange import (CAMINHO_LIMIARES, HORAS_JANELA, SENSORES, THRESHOLD_ANOMALIA,
+                            _classificar_janelas, _erros_janelas, _erros_janelas_autoencoder)
+from resultados import SEM_NIVEL, NivelAlerta
+
+CAMINHO_SCORES = "dados_demo/scores"
+COLUNAS_SCORES = (
+    ['score_anomalia'] + [f"score_{sensor}" for sensor in SENSORES]
+    + ['threshold', 'threshold_critico', 'nivel_alerta', 'parametro_critico']
+)
+TAMANHO_PARTICAO = 20_000  # leituras por tarefa do pool
+TAMANHO_BLOCO = 4096  # janelas pontuadas de uma vez dentro de uma tarefa
+ARQUIVO_ESTADO = "reprocessamento.json"
+ARQUIVO_LIMIARES = "limiares.json"  # aponta para o .npz (LimiaresAdaptativos.salvar) do último checkpoint
+
+# Processos do pool: entrada (leituras) e saída (scores brutos) compartilhadas
+
+_processo = {}
+
+def _iniciar_processo(nome_entrada, nome_saida, n_linhas, autoencoder, horas_janela):
+    # Os blocos pertencem ao processo principal, que os remove ao final
+    entrada, saida = shared_memory.SharedMemory(name=nome_entrada), shared_memory.SharedMemory(name=nome_saida)
+    _processo.update(
+        memorias=(entrada, saida),
+        entrada=np.ndarray((n_linhas, len(SENSORES)), dtype=np.float64, buffer=entrada.buf),
+        saida=np.ndarray((n_linhas, 1 + len(SENSORES)), dtype=np.float64, buffer=saida.buf),
+        autoencoder=autoencoder,
+        horas_janela=horas_janela,
+    )
+
+def tamanho_janela(autoencoder=None, horas_janela=HORAS_JANELA):
+    return max(2 * horas_janela, autoencoder.lookback if autoencoder is not None else 0)
+
+def _pontuar_particao(tarefa):
+    """
+    Pontua as linhas [inicio, fim) de uma série que começa em inicio_serie,
+    gravando (score, score por sensor) na saída compartilhada (NaN sem dados suficientes)
+    """
+    inicio_serie, inicio, fim = tarefa
+    entrada, saida = _processo['entrada'], _processo['saida']
+    autoencoder, horas_janela = _processo['autoencoder'], _processo['horas_janela']
+    janela = tamanho_janela(autoencoder, horas_janela)
+
+    for bloco in range(inicio, fim, TAMANHO_BLOCO):
+        bloco_fim = min(bloco + TAMANHO_BLOCO, fim)
+
+        # A janela de cada linha inclui as leituras anteriores, nunca de outro tanque
+        contexto = max(inicio_serie, bloco - (janela - 1))
+        trecho = entrada[contexto:bloco_fim]
+        preenchimento = (janela - 1) - (bloco - contexto)
+        if preenchimento:
+            trecho = np.concatenate([np.full((preenchimento, len(SENSORES)), np.nan), trecho])
+        janelas = sliding_window_view(trecho, janela, axis=0).transpose(0, 2, 1)
+        n_leituras = np.minimum(np.arange(bloco, bloco_fim) - inicio_serie + 1, janela)
+
+        if autoencoder is not None:
+            erro, diferencas, suficiente = _erros_janelas_autoencoder(autoencoder, janelas, n_leituras)
+        else:
+            erro, diferencas, suficiente = _erros_janelas(janelas, n_leituras, horas_janela)
+        saida[bloco:bloco_fim, 0] = np.where(suficiente, erro, np.nan)
+        saida[bloco:bloco_fim, 1:] = np.where(suficiente[:, None], diferencas, np.nan)
+    return inicio, fim
+
+def _classificar_particao(tarefa):
+    """
+    Classifica as linhas [inicio, fim), já pontuadas, aprendendo os limiares de um
+    tanque (uma cópia de LimiaresAdaptativos.separar); retorna a classificação e
+    os limiares atualizados, para o processo principal incorporar
+    """
+    tanque, inicio, fim, threshold, limiares = tarefa
+    return _classificar_aprendendo(tanque, _processo['saida'][inicio:fim], threshold, limiares), limiares
+
+# Classificação e gravação
+
+def _classificar_fixos(tanque, scores, threshold, limiares):
+    """Níveis de todas as linhas de uma vez, com os limiares atuais do tanque"""
+    suficiente = ~np.isnan(scores[:, 0])
+    lote = _classificar_janelas(
+        scores[:, 0], scores[:, 1:], suficiente, threshold, limiares,
+        [tanque] * len(scores) if limiares is not None else None
+    )
+    return lote['threshold'], lote['threshold_critico'], lote['nivel_alerta'], lote['parametro_critico']
+
+def _classificar_aprendendo(tanque, scores, threshold, limiares):
+    """
+    Linha a linha, como o detector incremental: cada score é classificado com os
+    limiares aprendidos até ali e só então entra no histórico do tanque
+    """
+    n = len(scores)
+    limiar, limiar_critico = np.full(n, np.nan), np.full(n, np.nan)
+    nivel, parametro = np.full(n, SEM_NIVEL), np.full(n, SEM_NIVEL)
+    for k in np.flatnonzero(~np.isnan(scores[:, 0])):
+        score, scores_sensor = scores[k, 0], scores[k, 1:]
+        limiar[k], limiar_critico[k] = limiares.limiares(tanque, threshold)
+        nivel[k] = (
+            NivelAlerta.CRITICO if score > limiar_critico[k]
+            else NivelAlerta.ATENCAO if score > limiar[k]
+            else NivelAlerta.NORMAL
+        )
+        parametro[k] = np.argmax(limiares.relativos(tanque, scores_sensor))
+        limiares.atualizar(tanque, score, scores_sensor)
+    return limiar, limiar_critico, nivel, parametro
+
+def _frame_scores(timestamps, scores, classificacao):
+    limiar, limiar_critico, nivel, parametro = classificacao
+    dados = {'timestamp': timestamps, 'score_anomalia': scores[:, 0]}
+    for k, sensor in enumerate(SENSORES):
+        dados[f"score_{sensor}"] = scores[:, 1 + k]
+    dados['threshold'] = np.where(nivel == SEM_NIVEL, np.nan, limiar)
+    dados['threshold_critico'] = np.where(nivel == SEM_NIVEL, np.nan, limiar_critico)
+    dados['nivel_alerta'] = np.where(nivel == SEM_NIVEL, np.nan, nivel)
+    dados['parametro_critico'] = np.where(nivel == SEM_NIVEL, np.nan, parametro)
+    return pd.DataFrame(dados)
+
+def _gravar_atomico(caminho, conteudo):
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(conteudo)
+    os.replace(temporario, caminho)
+
+class Reprocessamento:
+    """
+    Reprocessa o histórico de um ou mais tanques para o armazenamento de scores
+    autoencoder: AutoencoderLSTM (None usa a aproximação por médias de detectar_anomalia_agua)
+    limiares: LimiaresAdaptativos usados como estão (sem aprender_limiares)
+    aprender_limiares: aprende limiares novos a partir do histórico, em ordem de tempo
+    """
+
+    def __init__(self, armazenamento, destino=CAMINHO_SCORES, autoencoder=None, versao_modelo=None,
+                 limiares=None, aprender_limiares=False, horas_janela=HORAS_JANELA,
+                 tamanho_particao=TAMANHO_PARTICAO, n_processos=None):
+        self.armazenamento = armazenamento
+        self.destino = destino
+        self.autoencoder = autoencoder
+        self.versao_modelo = versao_modelo
+        self.limiares = limiares
+        self.aprender_limiares = aprender_limiares
+        self.horas_janela = horas_janela
+        self.tamanho_particao = tamanho_particao
+        self.n_processos = n_processos or os.cpu_count() or 1
+        self.threshold = autoencoder.threshold if autoencoder is not None else THRESHOLD_ANOMALIA
+        self.scores = ArmazenamentoSensores(destino, COLUNAS_SCORES)
+        self._alimentado_ate = {}
+        self._checkpoints_limiares = 0
+
+    def configuracao(self):
+        """O que, se mudar, invalida os scores já gravados"""
+        return {
+            'versao_modelo': self.versao_modelo,
+            'modelo': 'autoencoder' if self.autoencoder is not None else 'medias',
+            'horas_janela': self.horas_janela,
+            'limiares': (
+                'aprendidos' if self.aprender_limiares
+                else f"fixos-{self.limiares.assinatura()[:16]}" if self.limiares is not None
+                else 'padrao'
+            ),
+        }
+
+    def executar(self, tanques=None, recomecar=False):
+        """Reprocessa os tanques (padrão: todos) e retorna um resumo por tanque"""
+        tanques = [str(t) for t in (tanques or self.armazenamento.tanques())]
+        self._preparar_destino(recomecar)
+
+        pendentes, resumo = [], {}
+        for tanque in tanques:
+            with medir("reprocessamento.leitura"):
+                dados = self.armazenamento.ler(tanque=tanque)
+            inicio = self._retomar(tanque, dados['timestamp'])
+            resumo[tanque] = {'leituras': len(dados), 'ja_processadas': inicio, 'processadas': 0}
+            if inicio < len(dados):
+                pendentes.append((tanque, dados, inicio))
+
+        if pendentes:
+            self._processar(pendentes, resumo)
+        return resumo
+
+    def _preparar_destino(self, recomecar):
+        caminho_estado = os.path.join(self.destino, ARQUIVO_ESTADO)
+        configuracao = self.configuracao()
+        anterior = None
+        if os.path.exists(caminho_estado):
+            with open(caminho_estado, encoding="utf-8") as f:
+                anterior = json.load(f)
+        if recomecar or (anterior is not None and anterior != configuracao):
+            if anterior is not None and not recomecar:
+                print("Configuração mudou desde o último reprocessamento: recomeçando do zero")
+            shutil.rmtree(self.destino, ignore_errors=True)
+
+        os.makedirs(self.destino, exist_ok=True)
+        _gravar_atomico(caminho_estado, json.dumps(configuracao, indent=2).encode("utf-8"))
+
+        if self.aprender_limiares:
+            caminho_limiares = os.path.join(self.destino, ARQUIVO_LIMIARES)
+            if os.path.exists(caminho_limiares):
+                with open(caminho_limiares, encoding="utf-8") as f:
+                    checkpoint = json.load(f)
+                self.limiares = LimiaresAdaptativos.carregar(os.path.join(self.destino, checkpoint['arquivo']))
+                self._alimentado_ate = checkpoint['alimentado_ate']
+            else:
+                self.limiares, self._alimentado_ate = LimiaresAdaptativos(versao_modelo=self.versao_modelo), {}
+
+            # Limiares que já viram scores ausentes do armazenamento (scores apagados)
+            # não podem ser rebobinados: só recomeçando eles voltam a bater com os scores
+            if not recomecar and self._limiares_adiantados():
+                print("Limiares à frente dos scores gravados: recomeçando do zero")
+                self._preparar_destino(recomecar=True)
+
+    def _limiares_adiantados(self):
+        for tanque, alimentado in self._alimentado_ate.items():
+            self.scores.reparar(tanque)
+            _, ultimo = self.scores.intervalo(tanque)
+            if ultimo is None or ultimo < pd.Timestamp(alimentado):
+                return True
+        return False
+
+    def _retomar(self, tanque, timestamps):
+        """Índice da primeira leitura ainda sem score gravado"""
+        self.scores.reparar(tanque)
+        _, ultimo = self.scores.intervalo(tanque)
+        if ultimo is None:
+            return 0
+
+        # Scores gravados depois do último checkpoint dos limiares voltam a alimentá-los
+        if self.aprender_limiares:
+            alimentado = self._alimentado_ate.get(tanque)
+            inicio = None if alimentado is None else pd.Timestamp(alimentado) + pd.Timedelta(1, 'ns')
+            gravados = self.scores.ler(inicio=inicio, tanque=tanque).dropna(subset=['score_anomalia'])
+            if len(gravados):
+                colunas_sensor = [f"score_{sensor}" for sensor in SENSORES]
+                for score, scores_sensor in zip(gravados['score_anomalia'].to_numpy(), gravados[colunas_sensor].to_numpy()):
+                    self.limiares.atualizar(tanque, score, scores_sensor)
+                self._salvar_limiares(tanque, ultimo)
+
+        return int(np.searchsorted(timestamps.to_numpy('datetime64[ns]'), ultimo.to_datetime64(), side='right'))
+
+    def _processar(self, pendentes, resumo):
+        # Séries de todos os tanques, uma após a outra, em um único bloco compartilhado
+        inicios = np.cumsum([0] + [len(dados) for _, dados, _ in pendentes])
+        n_linhas = int(inicios[-1])
+        entrada = shared_memory.SharedMemory(create=True, size=max(1, n_linhas * len(SENSORES) * 8))
+        saida = shared_memory.SharedMemory(create=True, size=max(1, n_linhas * (1 + len(SENSORES)) * 8))
+        try:
+            valores = np.ndarray((n_linhas, len(SENSORES)), dtype=np.float64, buffer=entrada.buf)
+            scores = np.ndarray((n_linhas, 1 + len(SENSORES)), dtype=np.float64, buffer=saida.buf)
+            for (_, dados, _), inicio_serie in zip(pendentes, inicios):
+                valores[inicio_serie:inicio_serie + len(dados)] = dados[SENSORES].to_numpy(dtype=np.float64)
+
+            tarefas = []
+            for k, (tanque, dados, inicio) in enumerate(pendentes):
+                for particao in range(inicio, len(dados), self.tamanho_particao):
+                    fim = min(particao + self.tamanho_particao, len(dados))
+                    tarefas.append((k, (int(inicios[k]), int(inicios[k] + particao), int(inicios[k] + fim))))
+
+            with ProcessPoolExecutor(
+                max_workers=min(self.n_processos, len(tarefas)),
+                initializer=_iniciar_processo,
+                initargs=(entrada.name, saida.name, n_linhas, self.autoencoder, self.horas_janela)
+            ) as pool:
+                futuros = [(k, pool.submit(_pontuar_particao, tarefa)) for k, tarefa in tarefas]
+                if self.aprender_limiares:
+                    self._classificar_no_pool(pool, futuros, pendentes, inicios, scores, resumo)
+                    futuros = []
+
+                # As partições terminam em qualquer ordem, mas são gravadas em ordem
+                for k, futuro in futuros:
+                    inicio, fim = futuro.result()
+                    tanque, dados, _ = pendentes[k]
+                    classificacao = _classificar_fixos(tanque, scores[inicio:fim], self.threshold, self.limiares)
+                    self._gravar(tanque, dados['timestamp'].to_numpy()[inicio - inicios[k]:fim - inicios[k]],
+                                 scores[inicio:fim].copy(), classificacao)
+                    resumo[tanque]['processadas'] += fim - inicio
+            del valores, scores
+        finally:
+            entrada.close()
+            entrada.unlink()
+            saida.close()
+            saida.unlink()
+
+    def _classificar_no_pool(self, pool, futuros, pendentes, inicios, scores, resumo):
+        """
+        Com limiares aprendidos, cada score depende dos anteriores do mesmo tanque:
+        as partições de um tanque são classificadas em ordem, uma de cada vez, por
+        um processo do pool, e tanques diferentes em paralelo. Cada partição é
+        gravada (com o checkpoint dos limiares) assim que classificada
+        """
+        # Linhas dos tanques criadas na ordem de sempre, qualquer que seja a ordem de término
+        self.limiares._indices([tanque for tanque, _, _ in pendentes], criar=True)
+        particoes = {k: [] for k in range(len(pendentes))}  # partições pontuadas, em ordem
+        pontuando = {futuro: k for k, futuro in futuros}
+        for k, futuro in futuros:
+            particoes[k].append(futuro)
+        classificando = {}  # futuro da classificação -> (k, inicio, fim)
+
+        while pontuando or classificando or any(particoes.values()):
+            # Tanques livres cuja próxima partição já foi pontuada vão para o pool
+            ocupados = {k for k, _, _ in classificando.values()}
+            for k, fila in particoes.items():
+                if k not in ocupados and fila and fila[0].done():
+                    inicio, fim = fila.pop(0).result()
+                    tanque = pendentes[k][0]
+                    tarefa = (tanque, inicio, fim, self.threshold, self.limiares.separar(tanque))
+                    classificando[pool.submit(_classificar_particao, tarefa)] = (k, inicio, fim)
+
+            prontos, _ = wait(list(pontuando) + list(classificando), return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                if pontuando.pop(futuro, None) is not None:
+                    futuro.result()  # erros da pontuação aparecem aqui
+                    continue
+                k, inicio, fim = classificando.pop(futuro)
+                classificacao, limiares = futuro.result()
+                tanque, dados, _ = pendentes[k]
+                self.limiares.incorporar(limiares, tanque)
+                self._gravar(tanque, dados['timestamp'].to_numpy()[inicio - inicios[k]:fim - inicios[k]],
+                             scores[inicio:fim].copy(), classificacao)
+                resumo[tanque]['processadas'] += fim - inicio
+
+    def _gravar(self, tanque, timestamps, scores, classificacao):
+        with medir("reprocessamento.gravacao"):
+            self.scores.anexar(_frame_scores(timestamps, scores, classificacao), tanque=tanque)
+            if self.aprender_limiares:
+                self._salvar_limiares(tanque, timestamps[-1])
+
+    def _salvar_limiares(self, tanque, ultimo):
+        """
+        Checkpoint dos limiares: grava um .npz novo e só então troca o
+        limiares.json que aponta para ele, junto com até onde cada tanque já
+        os alimentou; assim os dois nunca ficam dessincronizados
+        """
+        self._alimentado_ate[tanque] = pd.Timestamp(ultimo).isoformat()
+        self._checkpoints_limiares += 1
+        arquivo = f"limiares-{os.getpid()}-{self._checkpoints_limiares}.npz"
+        self.limiares.salvar(os.path.join(self.destino, arquivo))
+        conteudo = json.dumps({'arquivo': arquivo, 'alimentado_ate': self._alimentado_ate}, indent=2)
+        _gravar_atomico(os.path.join(self.destino, ARQUIVO_LIMIARES), conteudo.encode("utf-8"))
+
+        # Checkpoints anteriores (inclusive de execuções interrompidas) não são mais apontados
+        for nome in os.listdir(self.destino):
+            if nome.startswith("limiares-") and nome.endswith(".npz") and nome != arquivo:
+                os.remove(os.path.join(self.destino, nome))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reprocessa o histórico dos sensores com o modelo atual")
+    parser.add_argument("--armazenamento", default="dados_demo/sensores")
+    parser.add_argument("--destino", default=CAMINHO_SCORES, help="armazenamento dos scores reprocessados")
+    parser.add_argument("--tanques", nargs="+", default=None, help="padrão: todos os tanques do armazenamento")
+    parser.add_argument("--processos", type=int, default=None)
+    parser.add_argument("--particao", type=int, default=TAMANHO_PARTICAO, help="leituras por tarefa")
+    parser.add_argument("--aprender-limiares", action="store_true",
+                        help="aprende limiares adaptativos a partir do histórico, em ordem de tempo")
+    parser.add_argument("--saida-limiares", default=CAMINHO_LIMIARES,
+                        help="onde publicar os limiares aprendidos (com --aprender-limiares)")
+    parser.add_argument("--recomecar", action="store_true", help="descarta scores já gravados")
+    args = parser.parse_args(argv)
+
+    from autoencoder_lstm import AutoencoderLSTM
+    from modelos_orange import SistemaMonitoramentoIA
+
+    sistema = SistemaMonitoramentoIA()
+    modelo = sistema.modelo_lstm
+    if not modelo:
+        parser.error("modelo de qualidade da água não encontrado")
+
+    reprocessamento = Reprocessamento(
+        ArmazenamentoSensores(args.armazenamento),
+        destino=args.destino,
+        autoencoder=modelo if isinstance(modelo, AutoencoderLSTM) else None,
+        versao_modelo=sistema._modelo_lstm.versao,
+        limiares=sistema.limiares,
+        aprender_limiares=args.aprender_limiares,
+        tamanho_particao=args.particao,
+        n_processos=args.processos
+    )
+
+    inicio = time.perf_counter()
+    resumo = reprocessamento.executar(args.tanques, recomecar=args.recomecar)
+    duracao = time.perf_counter() - inicio
+
+    total = sum(r['processadas'] for r in resumo.values())
+    for tanque, r in resumo.items():
+        print(f"{tanque:<16} {r['leituras']:>10,} leituras  {r['ja_processadas']:>10,} já processadas  {r['processadas']:>10,} novas")
+    print(f"✓ {total:,} leituras reprocessadas em {duracao:.1f}s ({total / max(duracao, 1e-9):,.0f} leituras/s) -> {args.destino}")
+
+    if args.aprender_limiares:
+        reprocessamento.limiares.salvar(args.saida_limiares)
+        print(f"✓ Limiares aprendidos publicados em {args.saida_limiares}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# Resultados tipados da detecção de anomalias e do diagnóstico de parasitos
+# Os resultados guardam números e enums, nunca texto formatado: podem ser
+# comparados, serializados e acumulados aos milhões sem reinterpretar strings.
+# Lotes usam arrays estruturados do NumPy (um registro por tanque). A
+# apresentação (porcentagens, unidades, rótulos) fica nas funções formatar_*
+
+import enum
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+SENSORES = ['ph', 'temperatura', 'oxigenio', 'turbidez']
+PARAMETROS = ['pH', 'Temperatura', 'Oxigênio', 'Turbidez']
+FORMATOS_SENSORES = ['{:.2f}', '{:.1f}°C', '{:.2f} mg/L', '{:.1f} NTU']
+
+RECOMENDACOES = {
+    'saudavel': "✓ Condição normal. Manter práticas atuais de manejo.",
+    'ictio': "⚠️ URGENTE: Ictiofitiríase detectada. Iniciar tratamento com sal (3-5g/L) ou formalina. Melhorar qualidade da água.",
+    'monogenoidea': "⚠️ Monogenoidea detectado. Tratar com praziquantel ou organofosforados. Verificar densidade de estocagem."
+}
+RECOMENDACAO_PADRAO = "Consultar veterinário."
+
+class NivelAlerta(enum.IntEnum):
+    """Níveis em ordem de gravidade, para comparar com < e >"""
+    NORMAL = 0
+    ATENCAO = 1
+    CRITICO = 2
+
+    @property
+    def rotulo(self):
+        return ROTULOS_NIVEL[self]
+
+ROTULOS_NIVEL = {NivelAlerta.NORMAL: 'NORMAL', NivelAlerta.ATENCAO: 'ATENÇÃO', NivelAlerta.CRITICO: 'CRÍTICO'}
+SEM_NIVEL = -1  # nível nos lotes para tanques sem leituras suficientes
+
+@dataclass(slots=True, frozen=True)
+class ResultadoAnomalia:
+    """
+    Resultado da detecção de anomalia em uma janela de leituras
+    parametro_critico: índice em SENSORES do sensor mais fora do normal
+    valores_atuais: última leitura, na ordem de SENSORES
+    """
+    score_anomalia: float
+    threshold: float
+    threshold_critico: float
+    nivel_alerta: NivelAlerta
+    parametro_critico: int
+    valores_atuais: tuple
+
+    @property
+    def anomalia_detectada(self):
+        return self.nivel_alerta > NivelAlerta.NORMAL
+
+    @property
+    def nome_parametro_critico(self):
+        return PARAMETROS[self.parametro_critico]
+
+    def para_dict(self):
+        """Valores brutos, serializáveis em JSON"""
+        return {
+            'score_anomalia': self.score_anomalia,
+            'threshold': self.threshold,
+            'threshold_critico': self.threshold_critico,
+            'nivel_alerta': self.nivel_alerta.name,
+            'parametro_critico': SENSORES[self.parametro_critico],
+            'valores_atuais': dict(zip(SENSORES, self.valores_atuais)),
+        }
+
+@dataclass(slots=True, frozen=True)
+class DadosInsuficientes:
+    """Janela com menos leituras do que a detecção precisa"""
+    necessarias: int
+    disponiveis: int
+
+@dataclass(slots=True, frozen=True)
+class ResultadoDiagnostico:
+    """Probabilidades de cada classe para uma imagem, na ordem do modelo"""
+    classes: tuple
+    probabilidades: tuple
+
+    @property
+    def indice(self):
+        return int(np.argmax(self.probabilidades))
+
+    @property
+    def diagnostico(self):
+        return self.classes[self.indice]
+
+    @property
+    def confianca(self):
+        return self.probabilidades[self.indice]
+
+    @property
+    def recomendacao(self):
+        return RECOMENDACOES.get(self.diagnostico, RECOMENDACAO_PADRAO)
+
+    def para_dict(self):
+        return {'classes': list(self.classes), 'probabilidades': list(self.probabilidades)}
+
+    @classmethod
+    def de_dict(cls, dados):
+        """Inverso de para_dict; None se o formato não for reconhecido (ex.: cache antigo)"""
+        try:
+            classes, probabilidades = dados['classes'], dados['probabilidades']
+            if len(classes) != len(probabilidades):
+                return None
+            return cls(tuple(str(c) for c in classes), tuple(float(p) for p in probabilidades))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+def resultado_anomalia(score, threshold, threshold_critico, diferencas, valores_atuais):
+    """Classifica um score nos níveis de alerta e monta o resultado"""
+    score = float(score)
+    if score > threshold_critico:
+        nivel = NivelAlerta.CRITICO
+    elif score > threshold:
+        nivel = NivelAlerta.ATENCAO
+    else:
+        nivel = NivelAlerta.NORMAL
+    return ResultadoAnomalia(
+        score, float(threshold), float(threshold_critico), nivel,
+        int(np.argmax(diferencas)), tuple(float(v) for v in valores_atuais)
+    )
+
+# Lotes: um registro por tanque
+
+CAMPOS_LOTE = [
+    ('dados_suficientes', '?'),
+    ('score_anomalia', 'f8'),
+    ('threshold', 'f8'),
+    ('threshold_critico', 'f8'),
+    ('nivel_alerta', 'i1'),
+    ('parametro_critico', 'i1'),
+    ('n_leituras', 'i4'),
+] + [(sensor, 'f8') for sensor in SENSORES]
+
+def novo_lote(tanques):
+    """Array estruturado vazio com um registro por tanque (campo 'tanque' como texto)"""
+    tanques = np.asarray(tanques).astype(str)
+    dtype = np.dtype([('tanque', tanques.dtype)] + CAMPOS_LOTE)
+    lote = np.zeros(len(tanques), dtype=dtype)
+    lote['tanque'] = tanques
+    return lote
+
+def resultado_do_lote(registro, necessarias):
+    """ResultadoAnomalia de um registro do lote, ou DadosInsuficientes"""
+    if not registro['dados_suficientes']:
+        return DadosInsuficientes(necessarias, int(registro['n_leituras']))
+    return ResultadoAnomalia(
+        float(registro['score_anomalia']), float(registro['threshold']), float(registro['threshold_critico']),
+        NivelAlerta(int(registro['nivel_alerta'])), int(registro['parametro_critico']),
+        tuple(float(registro[sensor]) for sensor in SENSORES)
+    )
+
+# Apresentação
+
+def formatar_valores(valores_atuais):
+    return {
+        parametro: formato.format(valor)
+        for parametro, formato, valor in zip(PARAMETROS, FORMATOS_SENSORES, valores_atuais)
+    }
+
+def formatar_anomalia(resultado):
+    """Textos para exibição de um ResultadoAnomalia (ou mensagem de dados insuficientes)"""
+    if isinstance(resultado, DadosInsuficientes):
+        return {'erro': f'Dados insuficientes (necessário pelo menos {resultado.necessarias}h)'}
+    return {
+        'anomalia_detectada': resultado.anomalia_detectada,
+        'score_anomalia': f"{resultado.score_anomalia:.4f}",
+        'threshold': f"{resultado.threshold:.4f}",
+        'parametro_critico': resultado.nome_parametro_critico,
+        'nivel_alerta': resultado.nivel_alerta.rotulo,
+        'valores_atuais': formatar_valores(resultado.valores_atuais),
+    }
+
+def formatar_diagnostico(resultado):
+    return {
+        'diagnostico': resultado.diagnostico,
+        'confianca': f"{resultado.confianca:.2%}",
+        'probabilidades': {classe: f"{prob:.2%}" for classe, prob in zip(resultado.classes, resultado.probabilidades)},
+        'recomendacao': resultado.recomendacao,
+    }
+
+def formatar_lote(lote):
+    """DataFrame para exibição: um tanque por linha, níveis e parâmetros pelo nome"""
+    tabela = pd.DataFrame(lote).set_index('tanque')
+    suficiente = tabela['dados_suficientes'].to_numpy()
+    rotulos = np.array([ROTULOS_NIVEL[n] for n in NivelAlerta] + [None], dtype=object)
+    nomes = np.array(PARAMETROS + [None], dtype=object)
+    tabela['nivel_alerta'] = rotulos[np.where(suficiente, lote['nivel_alerta'], SEM_NIVEL)]
+    tabela['parametro_critico'] = nomes[np.where(suficiente, lote['parametro_critico'], SEM_NIVEL)]
+    return tabela
@@ -0,0 +1,373 @@
+# Serviço assíncrono de ingestão das leituras dos sensores
+# Uso: python servico_ingestao.py --porta 8765
+#
+# As sondas enviam leituras em JSON por HTTP:
+#   POST /leituras  {"tanque": "principal", "timestamp": "...", "ph": 7.1, "temperatura": 28.0,
+#                    "oxigenio": 6.2, "turbidez": 14.0}   (ou uma lista desses objetos)
+#   GET  /estado    situação da fila e último resultado de cada tanque
+#   GET  /alertas   episódios de alerta ativos e os encerrados mais recentes
+#   GET  /metricas  instrumentação no formato texto do Prometheus (AQUAIA_INSTRUMENTACAO=1)
+#
+# As leituras entram em uma fila limitada e são gravadas em micro-lotes no
+# armazenamento colunar e repassadas ao SistemaMonitoramentoIA. Com a fila cheia
+# o serviço responde 503, empurrando a contenção de volta para as sondas
+
+import argparse
+import asyncio
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from armazenamento_sensores import ArmazenamentoSensores, COLUNAS_SENSORES, TANQUE_PADRAO
+import instrumentacao
+from alertas import CAMINHO_LOG, MotorAlertas
+from resultados import ResultadoAnomalia
+
+TAMANHO_MAXIMO_CORPO = 1024 * 1024
+INTERVALO_SALVAR_LIMIARES = 60.0  # segundos entre gravações dos limiares adaptativos
+PADRAO_TANQUE = re.compile(r"[A-Za-z0-9_-]{1,64}")
+TOLERANCIA_RELOGIO = pd.Timedelta(minutes=5)  # adiantamento máximo aceito no relógio das sondas
+MENSAGENS_HTTP = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+                  413: "Payload Too Large", 503: "Service Unavailable"}
+
+def _nivel(resultado):
+    """Rótulo do nível de alerta; mensagens de erro passam adiante e dados insuficientes viram None"""
+    if isinstance(resultado, ResultadoAnomalia):
+        return resultado.nivel_alerta.rotulo
+    return resultado if isinstance(resultado, str) else None
+
+class CorpoGrandeDemais(ValueError):
+    pass
+
+class ServicoIngestao:
+    """
+    Recebe leituras, acumula em uma fila limitada e processa em micro-lotes
+    A gravação e a detecção rodam em uma única thread dedicada, para não
+    bloquear o laço de eventos e manter as leituras de cada tanque em ordem
+    """
+
+    def __init__(self, armazenamento, sistema=None, tamanho_fila=100_000,
+                 tamanho_lote=5_000, intervalo_lote=0.5, alertas=None):
+        self.armazenamento = armazenamento
+        self.sistema = sistema
+        self.alertas = alertas
+        self.fila = asyncio.Queue(maxsize=tamanho_fila)
+        self.tamanho_lote = tamanho_lote
+        self.intervalo_lote = intervalo_lote
+
+        self.resultados = {}
+        self.contadores = {'recebidas': 0, 'gravadas': 0, 'rejeitadas': 0, 'descartadas': 0, 'lotes': 0}
+        self._ultimo_timestamp = {}
+        self._limiares_salvos_em = time.monotonic()
+        self._gravador = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingestao")
+        self._servidor = None
+        self._tarefa_lotes = None
+
+    async def iniciar(self, host="127.0.0.1", porta=8765):
+        self._servidor = await asyncio.start_server(self._atender_conexao, host, porta)
+        self._tarefa_lotes = asyncio.create_task(self._consumir_fila())
+        return self._servidor.sockets[0].getsockname()[:2]
+
+    async def parar(self):
+        """Fecha o servidor e grava o que ainda estiver na fila"""
+        if self._servidor is not None:
+            self._servidor.close()
+            await self._servidor.wait_closed()
+        if self._tarefa_lotes is not None:
+            await self.fila.join()
+            self._tarefa_lotes.cancel()
+        self._gravador.shutdown(wait=True)
+        if self.sistema is not None:
+            self.sistema.salvar_limiares()
+
+    def enfileirar(self, leituras):
+        """
+        Coloca um conjunto de leituras na fila, tudo ou nada
+        Retorna False quando não há espaço (backpressure)
+        """
+        livres = self.fila.maxsize - self.fila.qsize()
+        if len(leituras) > livres:
+            self.contadores['rejeitadas'] += len(leituras)
+            return False
+        for leitura in leituras:
+            self.fila.put_nowait(leitura)
+        self.contadores['recebidas'] += len(leituras)
+        return True
+
+    def estado(self):
+        return {
+            'fila': self.fila.qsize(),
+            'capacidade_fila': self.fila.maxsize,
+            **self.contadores,
+            'tanques': {
+                tanque: _nivel(resultado)
+                for tanque, resultado in self.resultados.items()
+            },
+            'alertas_ativos': len(self.alertas.ativos()) if self.alertas is not None else 0,
+        }
+
+    def estado_alertas(self, n_historico=50):
+        if self.alertas is None:
+            return {'ativos': [], 'historico': []}
+        return {
+            'ativos': [episodio.para_dict() for episodio in self.alertas.ativos()],
+            'historico': [episodio.para_dict() for episodio in self.alertas.historico(n_historico)],
+        }
+
+    async def _consumir_fila(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Espera a primeira leitura e junta as seguintes até encher o lote ou estourar o intervalo
+            lote = [await self.fila.get()]
+            limite = loop.time() + self.intervalo_lote
+            while len(lote) < self.tamanho_lote:
+                try:
+                    lote.append(self.fila.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                restante = limite - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self.fila.get(), timeout=restante))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await loop.run_in_executor(self._gravador, self._processar_lote, lote)
+            except Exception as e:
+                print(f"❌ Erro ao processar lote de {len(lote)} leituras: {e}")
+            finally:
+                for _ in lote:
+                    self.fila.task_done()
+
+    def _processar_lote(self, lote):
+        dados = pd.DataFrame(lote)
+        dados['timestamp'] = pd.to_datetime(dados['timestamp'])
+        dados = dados.sort_values(['tanque', 'timestamp'], kind='stable')
+
+        # Cada tanque é gravado à parte: um erro em um tanque não descarta os outros
+        for tanque, leituras in dados.groupby('tanque', sort=False):
+            try:
+                self._processar_tanque(tanque, leituras)
+            except Exception as e:
+                self.contadores['descartadas'] += len(leituras)
+                print(f"❌ Erro ao gravar {len(leituras)} leituras do tanque '{tanque}': {e}")
+
+        self.contadores['lotes'] += 1
+
+        # Os limiares aprendidos aqui ficam disponíveis para o dashboard
+        if self.sistema is not None and time.monotonic() - self._limiares_salvos_em >= INTERVALO_SALVAR_LIMIARES:
+            self.sistema.salvar_limiares()
+            self._limiares_salvos_em = time.monotonic()
+
+    def _processar_tanque(self, tanque, leituras):
+        # Leituras mais antigas que o último registro gravado são descartadas;
+        # na primeira vez que o tanque aparece o último registro vem do armazenamento
+        if tanque not in self._ultimo_timestamp:
+            self._ultimo_timestamp[tanque] = self.armazenamento.ultimo(tanque)
+        ultimo = self._ultimo_timestamp[tanque]
+        if ultimo is not None:
+            atrasadas = leituras['timestamp'] < ultimo
+            self.contadores['descartadas'] += int(atrasadas.sum())
+            leituras = leituras[~atrasadas]
+        if leituras.empty:
+            return
+
+        with instrumentacao.medir("ingestao.gravacao"):
+            self.armazenamento.anexar(leituras, tanque=tanque)
+        self._ultimo_timestamp[tanque] = leituras['timestamp'].iloc[-1]
+        self.contadores['gravadas'] += len(leituras)
+
+        if self.sistema is not None:
+            momentos = leituras['timestamp'].tolist()
+            for leitura, momento in zip(leituras[COLUNAS_SENSORES].to_dict('records'), momentos):
+                resultado = self.sistema.processar_leitura(leitura, tanque=tanque)
+                if self.alertas is not None:
+                    self.alertas.avaliar(tanque, resultado, momento)
+            self.resultados[tanque] = resultado
+
+    async def _atender_conexao(self, reader, writer):
+        try:
+            while True:
+                requisicao = await _ler_requisicao(reader)
+                if requisicao is None:
+                    break
+                metodo, caminho, corpo, manter_conexao = requisicao
+                status, resposta = self._rotear(metodo, caminho, corpo)
+                await _responder(writer, status, resposta, manter_conexao)
+                if not manter_conexao:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except CorpoGrandeDemais as e:
+            await _responder(writer, 413, {'erro': str(e)}, False)
+        except ValueError as e:
+            await _responder(writer, 400, {'erro': f"Requisição inválida: {e}"}, False)
+        finally:
+            writer.close()
+
+    def _rotear(self, metodo, caminho, corpo):
+        if metodo == "GET" and caminho == "/estado":
+            return 200, self.estado()
+        if metodo == "GET" and caminho == "/alertas":
+            return 200, self.estado_alertas()
+        if metodo == "GET" and caminho == "/metricas":
+            return 200, instrumentacao.exportar_prometheus()
+        if metodo != "POST" or caminho != "/leituras":
+            return 404, {'erro': 'Rota não encontrada'}
+
+        try:
+            leituras = _validar_leituras(json.loads(corpo))
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            return 400, {'erro': f"Leituras inválidas: {e}"}
+
+        if not self.enfileirar(leituras):
+            return 503, {'erro': 'Fila cheia, tente novamente', 'fila': self.fila.qsize()}
+        return 202, {'aceitas': len(leituras)}
+
+def _validar_leituras(conteudo):
+    leituras = conteudo if isinstance(conteudo, list) else [conteudo]
+    agora = pd.Timestamp.now()
+    validas = []
+    for leitura in leituras:
+        validas.append({
+            'tanque': _validar_tanque(leitura.get('tanque', TANQUE_PADRAO)),
+            'timestamp': _validar_timestamp(leitura.get('timestamp'), agora) if leitura.get('timestamp') else agora,
+            **{sensor: float(leitura[sensor]) for sensor in COLUNAS_SENSORES},
+        })
+    return validas
+
+def _validar_tanque(valor):
+    """O nome do tanque vira diretório do armazenamento: só letras, dígitos, '_' e '-'"""
+    if not isinstance(valor, str) or not PADRAO_TANQUE.fullmatch(valor):
+        raise ValueError(f"tanque inválido (use até 64 caracteres A-Z, a-z, 0-9, _ ou -): {valor!r}")
+    return valor
+
+def _validar_timestamp(valor, agora):
+    """
+    Converte um timestamp ISO 8601 para o formato do armazenamento (sem fuso, hora local)
+    Valores inválidos ou no futuro (além da tolerância de relógio) levantam ValueError
+    e a requisição inteira é recusada com 400
+    """
+    if not isinstance(valor, str):
+        raise ValueError(f"timestamp deve ser texto ISO 8601: {valor!r}")
+    try:
+        momento = pd.to_datetime(valor, format='ISO8601')
+    except ValueError:
+        momento = pd.NaT
+    if pd.isna(momento):
+        raise ValueError(f"timestamp inválido (use ISO 8601): {valor!r}")
+    if momento.tzinfo is not None:
+        momento = pd.Timestamp(momento.to_pydatetime().astimezone()).tz_localize(None)
+    if momento > agora + TOLERANCIA_RELOGIO:
+        raise ValueError(f"timestamp no futuro: {valor!r}")
+    return momento
+
+async def _ler_requisicao(reader):
+    """Lê uma requisição HTTP/1.1; retorna None quando o cliente encerra a conexão"""
+    linha = await reader.readline()
+    if not linha:
+        return None
+    metodo, caminho, versao = linha.decode("latin-1").split()
+
+    cabecalhos = {}
+    while True:
+        linha = await reader.readline()
+        if linha in (b"\r\n", b"\n", b""):
+            break
+        nome, _, valor = linha.decode("latin-1").partition(":")
+        cabecalhos[nome.strip().lower()] = valor.strip()
+
+    tamanho = int(cabecalhos.get("content-length", 0))
+    if tamanho > TAMANHO_MAXIMO_CORPO:
+        raise CorpoGrandeDemais("Corpo da requisição grande demais")
+    corpo = await reader.readexactly(tamanho) if tamanho else b""
+
+    manter_conexao = cabecalhos.get("connection", "").lower() != "close" and versao == "HTTP/1.1"
+    return metodo, caminho, corpo, manter_conexao
+
+async def _responder(writer, status, conteudo, manter_conexao):
+    """Responde em JSON, ou em texto puro quando o conteúdo já é uma string"""
+    if isinstance(conteudo, str):
+        corpo, tipo = conteudo.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+    else:
+        corpo, tipo = json.dumps(conteudo, ensure_ascii=False, default=str).encode("utf-8"), "application/json; charset=utf-8"
+    cabecalhos = [
+        f"HTTP/1.1 {status} {MENSAGENS_HTTP[status]}",
+        f"Content-Type: {tipo}",
+        f"Content-Length: {len(corpo)}",
+        f"Connection: {'keep-alive' if manter_conexao else 'close'}",
+    ]
+    if status == 503:
+        cabecalhos.append("Retry-After: 1")
+    writer.write(("\r\n".join(cabecalhos) + "\r\n\r\n").encode("latin-1") + corpo)
+    await writer.drain()
+
+async def enviar_leituras(leituras, host="127.0.0.1", porta=8765):
+    """
+    Cliente mínimo (usado por sondas simuladas e testes locais)
+    Retorna (status HTTP, resposta JSON)
+    """
+    reader, writer = await asyncio.open_connection(host, porta)
+    try:
+        corpo = json.dumps(leituras, default=str).encode("utf-8")
+        writer.write(
+            f"POST /leituras HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(corpo)}\r\nConnection: close\r\n\r\n".encode("latin-1") + corpo
+        )
+        await writer.drain()
+        resposta = await reader.read()
+    finally:
+        writer.close()
+
+    cabecalho, _, corpo = resposta.partition(b"\r\n\r\n")
+    status = int(cabecalho.split(b" ", 2)[1])
+    return status, json.loads(corpo)
+
+async def _executar(args):
+    armazenamento = ArmazenamentoSensores(args.armazenamento)
+
+    from modelos_orange import SistemaMonitoramentoIA
+    sistema = SistemaMonitoramentoIA()
+    sistema.carregar_modelos()
+
+    servico = ServicoIngestao(
+        armazenamento, sistema,
+        tamanho_fila=args.fila,
+        tamanho_lote=args.lote,
+        intervalo_lote=args.intervalo,
+        alertas=MotorAlertas(args.alertas)
+    )
+    host, porta = await servico.iniciar(args.host, args.porta)
+    print(f"✓ Ingestão ouvindo em http://{host}:{porta}")
+
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"{time.strftime('%H:%M:%S')} {servico.estado()}")
+    finally:
+        await servico.parar()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serviço de ingestão das leituras dos sensores")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--armazenamento", default="dados_demo/sensores")
+    parser.add_argument("--fila", type=int, default=100_000, help="leituras aguardando gravação (máximo)")
+    parser.add_argument("--lote", type=int, default=5_000, help="leituras por micro-lote")
+    parser.add_argument("--intervalo", type=float, default=0.5, help="segundos máximos para fechar um lote")
+    parser.add_argument("--alertas", default=CAMINHO_LOG, help="log JSONL dos eventos de alerta")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(_executar(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Ida e volta das leituras pelo armazenamento colunar, cruzando partições de dia
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from armazenamento_sensores import COLUNAS_SENSORES, ArmazenamentoSensores
+
+def _leituras(inicio="2024-03-01 18:00", n=150, freq="30min", semente=0):
+    rng = np.random.default_rng(semente)
+    dados = pd.DataFrame({'timestamp': pd.date_range(inicio, periods=n, freq=freq)})
+    for coluna in COLUNAS_SENSORES:
+        dados[coluna] = rng.normal(size=n)
+    return dados
+
+@pytest.fixture
+def armazenamento(tmp_path):
+    return ArmazenamentoSensores(raiz=str(tmp_path / "sensores"))
+
+@pytest.fixture
+def dados(armazenamento):
+    # Lotes de tamanhos irregulares, alguns atravessando a meia-noite
+    dados = _leituras()
+    for inicio, fim in [(0, 7), (7, 40), (40, 41), (41, 120), (120, 150)]:
+        armazenamento.anexar(dados.iloc[inicio:fim], tanque='t1')
+    return dados
+
+def test_ler_tudo(armazenamento, dados):
+    assert armazenamento.particoes('t1') == ['2024-03-01', '2024-03-02', '2024-03-03', '2024-03-04']
+    pd.testing.assert_frame_equal(armazenamento.ler(tanque='t1'), dados)
+
+def test_ler_intervalo(armazenamento, dados):
+    inicio, fim = pd.Timestamp("2024-03-01 23:30"), pd.Timestamp("2024-03-03 00:00")
+    esperado = dados[(dados['timestamp'] >= inicio) & (dados['timestamp'] <= fim)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(armazenamento.ler(inicio, fim, tanque='t1'), esperado)
+    assert len(armazenamento.ler(fim=pd.Timestamp("2024-03-01"), tanque='t1')) == 0
+
+@pytest.mark.parametrize("n", [1, 12, 60, 150, 500])
+def test_ultimos(armazenamento, dados, n):
+    pd.testing.assert_frame_equal(armazenamento.ultimos(n, tanque='t1'), dados.tail(n).reset_index(drop=True))
+
+def test_intervalo_e_tanques(armazenamento, dados):
+    assert armazenamento.intervalo('t1') == (dados['timestamp'].iloc[0], dados['timestamp'].iloc[-1])
+    assert armazenamento.ultimo('t1') == dados['timestamp'].iloc[-1]
+    assert armazenamento.tanques() == ['t1']
+    assert armazenamento.intervalo('t2') == (None, None)
+    assert len(armazenamento.ler(tanque='t2')) == 0
+
+def test_rejeita_leituras_fora_de_ordem(armazenamento, dados):
+    with pytest.raises(ValueError):
+        armazenamento.anexar(dados.iloc[:1], tanque='t1')
+    with pytest.raises(ValueError):
+        armazenamento.anexar(dados.iloc[[1, 0]], tanque='t2')
+
+def test_rejeita_tanque_fora_da_raiz(armazenamento, dados):
+    with pytest.raises(ValueError):
+        armazenamento.anexar(dados, tanque='../fora')
+
+def test_ler_desde_incremental(armazenamento):
+    dados = _leituras(n=100)
+    armazenamento.anexar(dados.iloc[:30], tanque='t1')
+    lido, posicao = armazenamento.ler_desde(tanque='t1')
+    partes = [lido]
+
+    # Leituras novas com o mesmo timestamp da última já lida também chegam
+    repetida = dados.iloc[[29]].assign(ph=99.0)
+    armazenamento.anexar(repetida, tanque='t1')
+    for inicio, fim in [(30, 31), (31, 100)]:
+        novo, posicao = armazenamento.ler_desde(posicao, tanque='t1')
+        partes.append(novo)
+        armazenamento.anexar(dados.iloc[inicio:fim], tanque='t1')
+    novo, posicao = armazenamento.ler_desde(posicao, tanque='t1')
+    partes.append(novo)
+
+    esperado = pd.concat([dados.iloc[:30], repetida, dados.iloc[30:]], ignore_index=True)
+    pd.testing.assert_frame_equal(pd.concat(partes, ignore_index=True), esperado)
+    assert len(armazenamento.ler_desde(posicao, tanque='t1')[0]) == 0
+
+def test_particao_sem_indice_e_reparar(armazenamento, dados):
+    # Anexo interrompido: valores gravados numa partição nova, índice ainda não
+    diretorio = os.path.join(armazenamento.raiz, 't1', '2024-03-05')
+    os.makedirs(diretorio)
+    for coluna in COLUNAS_SENSORES:
+        np.arange(3, dtype=np.float64).tofile(os.path.join(diretorio, f"{coluna}.bin"))
+
+    assert armazenamento.ultimo('t1') == dados['timestamp'].iloc[-1]
+    pd.testing.assert_frame_equal(armazenamento.ler(tanque='t1'), dados)
+    assert armazenamento.reparar('t1') == len(COLUNAS_SENSORES)
+
+    seguintes = _leituras("2024-03-05 00:00", n=5, semente=1)
+    armazenamento.anexar(seguintes, tanque='t1')
+    pd.testing.assert_frame_equal(armazenamento.ultimos(5, tanque='t1'), seguintes)
@@ -0,0 +1,70 @@
+# DetectorAnomaliaStreaming deve dar o mesmo resultado que detectar_anomalia_agua
+# chamado a cada leitura sobre as últimas 48 leituras
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from modelos_orange import HORAS_JANELA, SENSORES, DetectorAnomaliaStreaming, SistemaMonitoramentoIA
+from resultados import DadosInsuficientes, ResultadoAnomalia
+
+def _leituras(n, semente=0):
+    """Série horária com ruído e um degrau de oxigênio na metade, para haver alertas"""
+    rng = np.random.default_rng(semente)
+    dados = pd.DataFrame({
+        'ph': 7.0 + rng.normal(0, 0.1, n),
+        'temperatura': 26.0 + rng.normal(0, 0.5, n),
+        'oxigenio': 6.0 + rng.normal(0, 0.2, n),
+        'turbidez': 20.0 + rng.normal(0, 1.0, n),
+    })
+    dados.loc[n // 2:, 'oxigenio'] -= 3.0
+    return dados
+
+@pytest.fixture
+def sistema(tmp_path, monkeypatch):
+    # Diretório vazio: nenhum artefato nem limiares gravados interferem no teste
+    monkeypatch.chdir(tmp_path)
+    sistema = SistemaMonitoramentoIA()
+    sistema.modelo_lstm = object()  # qualquer modelo que não seja o autoencoder usa a regra das médias
+    return sistema
+
+def test_streaming_igual_ao_lote(sistema):
+    dados = _leituras(200)
+    detector = DetectorAnomaliaStreaming()
+    niveis = set()
+
+    for n in range(1, len(dados) + 1):
+        streaming = detector.push(dados.iloc[n - 1])
+        lote = sistema.detectar_anomalia_agua(dados.iloc[max(0, n - 2 * HORAS_JANELA):n])
+
+        if n < HORAS_JANELA:
+            assert isinstance(streaming, DadosInsuficientes)
+            assert isinstance(lote, DadosInsuficientes)
+            continue
+        assert isinstance(streaming, ResultadoAnomalia)
+        assert isinstance(lote, ResultadoAnomalia)
+        assert streaming.score_anomalia == pytest.approx(lote.score_anomalia, rel=1e-9, abs=1e-12)
+        assert streaming.nivel_alerta == lote.nivel_alerta
+        assert streaming.parametro_critico == lote.parametro_critico
+        assert streaming.valores_atuais == pytest.approx(lote.valores_atuais)
+        niveis.add(streaming.nivel_alerta)
+
+    # A série precisa exercitar mais de um nível para o teste ter valor
+    assert len(niveis) > 1
+
+def test_resultado_sem_nova_leitura(sistema):
+    dados = _leituras(60, semente=1)
+    detector = DetectorAnomaliaStreaming()
+    for _, leitura in dados.iterrows():
+        ultimo = detector.push(leitura)
+
+    assert detector.resultado() == ultimo
+    assert ultimo == sistema.detectar_anomalia_agua(dados.iloc[-2 * HORAS_JANELA:])
+
+def test_leitura_aceita_dict():
+    detector = DetectorAnomaliaStreaming()
+    leitura = dict.fromkeys(SENSORES, 1.0)
+    for _ in range(HORAS_JANELA):
+        resultado = detector.push(leitura)
+    assert isinstance(resultado, ResultadoAnomalia)
+    assert resultado.score_anomalia == 0.0
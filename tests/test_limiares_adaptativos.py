@@ -0,0 +1,86 @@
+# Quantis P² comparados com np.quantile sobre o histórico completo
+
+import numpy as np
+import pytest
+
+from limiares_adaptativos import AQUECIMENTO, THRESHOLD_PADRAO, LimiaresAdaptativos, QuantilP2
+
+N_OBSERVACOES = 10_000
+
+def _amostras(semente=42):
+    """Uma série por coluna: normal, exponencial (cauda longa, como os scores) e uniforme"""
+    rng = np.random.default_rng(semente)
+    return np.column_stack([
+        rng.normal(0.0, 1.0, N_OBSERVACOES),
+        rng.exponential(0.01, N_OBSERVACOES),
+        rng.uniform(0.0, 1.0, N_OBSERVACOES),
+    ])
+
+def _amplitude(amostras):
+    return np.quantile(amostras, 0.999, axis=0) - np.quantile(amostras, 0.001, axis=0)
+
+@pytest.mark.parametrize("p", [0.5, 0.95, 0.99])
+def test_quantil_p2_proximo_de_np_quantile(p):
+    amostras = _amostras()
+    estimador = QuantilP2(p, n_series=amostras.shape[1])
+    series = np.arange(amostras.shape[1])
+    for valores in amostras:
+        estimador.atualizar(series, valores)
+
+    estimado = estimador.estimativa(series)
+    exato = np.quantile(amostras, p, axis=0)
+    # Erro abaixo de 2% da amplitude de cada distribuição
+    np.testing.assert_array_less(np.abs(estimado - exato), 0.02 * _amplitude(amostras))
+
+def test_quantil_p2_series_independentes():
+    # Atualizar só parte das séries (e com NaN) não afeta as demais
+    amostras = _amostras(semente=7)[:2_000]
+    juntas = QuantilP2(0.95, n_series=3)
+    sozinha = QuantilP2(0.95, n_series=1)
+    for valores in amostras:
+        juntas.atualizar([0, 1, 2], [valores[0], np.nan, valores[2]])
+        juntas.atualizar([1], [valores[1]])
+        sozinha.atualizar([0], [valores[1]])
+
+    assert juntas.estimativa([1])[0] == sozinha.estimativa([0])[0]
+    assert juntas.contagem.tolist() == [len(amostras)] * 3
+
+def test_quantil_p2_poucas_observacoes():
+    estimador = QuantilP2(0.95, n_series=1)
+    for valor in [3.0, 1.0, 2.0, 5.0]:
+        estimador.atualizar([0], [valor])
+    assert np.isnan(estimador.estimativa([0])[0])
+
+def test_limiares_por_tanque():
+    rng = np.random.default_rng(0)
+    limiares = LimiaresAdaptativos()
+    # O tanque 'b' tem scores dez vezes maiores: seus limiares acompanham
+    scores = {'a': rng.exponential(0.01, 3_000), 'b': rng.exponential(0.1, 3_000)}
+    for i in range(3_000):
+        limiares.atualizar_lote(['a', 'b'], [scores['a'][i], scores['b'][i]], np.zeros((2, 4)))
+
+    for tanque, historico in scores.items():
+        atencao, critico = limiares.limiares(tanque)
+        assert atencao == pytest.approx(np.quantile(historico, 0.95), rel=0.05)
+        assert critico == pytest.approx(np.quantile(historico, 0.99), rel=0.05)
+    assert limiares.limiares('sem_scores') == (THRESHOLD_PADRAO, 2 * THRESHOLD_PADRAO)
+
+def test_limiares_durante_aquecimento():
+    limiares = LimiaresAdaptativos()
+    for _ in range(AQUECIMENTO - 1):
+        limiares.atualizar('a', 1.0, np.ones(4))
+    assert limiares.limiares('a') == (THRESHOLD_PADRAO, 2 * THRESHOLD_PADRAO)
+    limiares.atualizar('a', 1.0, np.ones(4))
+    assert limiares.limiares('a') == (1.0, 1.0)
+
+def test_salvar_e_carregar(tmp_path):
+    rng = np.random.default_rng(3)
+    limiares = LimiaresAdaptativos(versao_modelo="v1")
+    for score in rng.exponential(0.01, 500):
+        limiares.atualizar('a', score, rng.exponential(0.01, 4))
+
+    caminho = str(tmp_path / "limiares.npz")
+    limiares.salvar(caminho)
+    carregados = LimiaresAdaptativos.carregar(caminho)
+    assert carregados.assinatura() == limiares.assinatura()
+    assert carregados.limiares('a') == limiares.limiares('a')
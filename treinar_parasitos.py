@@ -0,0 +1,287 @@
+# Treino sem interface do parasitos_cnn_workflow.ows
+# Uso: python treinar_parasitos.py --imagens dados_demo/imagens --saida modelo_parasitos_cnn.pkcls
+#
+# Reproduz o workflow do Orange Canvas:
+#   File -> Preprocess -> Data Sampler -> Random Forest / SVM -> Test and Score -> Save Model (Random Forest)
+# As características das imagens vêm do mesmo pré-processamento usado no
+# diagnóstico (diagnostico_imagens.py) e ficam no cache entre execuções. As dobras
+# da validação cruzada de todos os modelos e os modelos finais são treinados em
+# paralelo, em processos separados
+
+import argparse
+import glob
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from cache_embeddings import CacheEmbeddings
+from diagnostico_imagens import NOMES_CARACTERISTICAS, VERSAO_PREPROCESSAMENTO, extrair_caracteristicas_lote
+
+EXTENSOES_IMAGEM = ('.jpg', '.jpeg', '.png')
+APRENDIZES = ('rf', 'svm')
+NOMES_APRENDIZES = {'rf': 'Random Forest', 'svm': 'SVM'}
+
+# Padrões dos widgets do workflow
+PROPORCAO_AMOSTRA = 0.7  # Data Sampler: proporção fixa, estratificada
+N_DOBRAS = 5  # Test and Score: validação cruzada estratificada
+N_ARVORES = 10  # Random Forest
+
+def criar_aprendiz(nome, semente):
+    """
+    Aprendiz do Orange com a etapa Preprocess (normalização) embutida: o modelo
+    salvo recebe as características brutas, como em prever_probabilidades
+    """
+    from Orange.classification import RandomForestLearner, SVMLearner
+    from Orange.preprocess import Normalize
+
+    if nome == 'rf':
+        return RandomForestLearner(
+            n_estimators=N_ARVORES, random_state=semente,
+            preprocessors=list(RandomForestLearner.preprocessors) + [Normalize()]
+        )
+    if nome == 'svm':
+        return SVMLearner(probability=True, preprocessors=list(SVMLearner.preprocessors) + [Normalize()])
+    raise ValueError(f"Aprendiz desconhecido: {nome} (use um de {APRENDIZES})")
+
+# Dados
+
+def listar_imagens(diretorio):
+    """Imagens rotuladas pela pasta: <diretorio>/<classe>/<arquivo>"""
+    caminhos, rotulos = [], []
+    for classe in sorted(os.listdir(diretorio)):
+        pasta = os.path.join(diretorio, classe)
+        if not os.path.isdir(pasta):
+            continue
+        for caminho in sorted(glob.glob(os.path.join(pasta, "*"))):
+            if caminho.lower().endswith(EXTENSOES_IMAGEM):
+                caminhos.append(caminho)
+                rotulos.append(classe)
+    return caminhos, rotulos
+
+def dados_de_imagens(diretorio, n_processos=None, cache=None):
+    """
+    Matriz de características (imagens, DIMENSAO_EMBEDDING), rótulos e classes
+    Imagens já vistas em execuções anteriores vêm do cache de características
+    """
+    caminhos, rotulos = listar_imagens(diretorio)
+    if not caminhos:
+        raise ValueError(f"Nenhuma imagem encontrada em {diretorio}/<classe>/")
+
+    X = extrair_caracteristicas_lote(caminhos, n_processos=n_processos, cache=cache)
+    classes = sorted(set(rotulos))
+    y = np.array([classes.index(r) for r in rotulos])
+    return X, y, classes
+
+def dados_de_tabela(caminho):
+    """Tabela de características já extraídas (o que o widget File carregaria)"""
+    from Orange.data import Table
+
+    tabela = Table(caminho)
+    classes = list(tabela.domain.class_var.values)
+    return tabela.X.astype(np.float32), tabela.Y.astype(int), classes, [a.name for a in tabela.domain.attributes]
+
+def amostrar(y, proporcao, semente):
+    """Data Sampler: amostra estratificada com a proporção de cada classe"""
+    rng = np.random.default_rng(semente)
+    escolhidos = []
+    for classe in np.unique(y):
+        indices = np.flatnonzero(y == classe)
+        n = max(1, int(round(len(indices) * proporcao)))
+        escolhidos.append(rng.choice(indices, n, replace=False))
+    return np.sort(np.concatenate(escolhidos))
+
+def dobras_estratificadas(y, n_dobras, semente):
+    """Índices de teste de cada dobra, com as classes distribuídas igualmente"""
+    rng = np.random.default_rng(semente)
+    dobras = [[] for _ in range(n_dobras)]
+    for classe in np.unique(y):
+        indices = rng.permutation(np.flatnonzero(y == classe))
+        for k, parte in enumerate(np.array_split(indices, n_dobras)):
+            dobras[k].append(parte)
+    return [np.sort(np.concatenate(d)) for d in dobras]
+
+# Processos de treino: os dados são enviados uma vez por processo
+
+_dados_processo = None
+
+def _iniciar_processo(X, y, classes, atributos):
+    global _dados_processo
+    _dados_processo = (X, y, classes, atributos)
+
+def _tabela(indices):
+    from Orange.data import ContinuousVariable, DiscreteVariable, Domain, Table
+
+    X, y, classes, atributos = _dados_processo
+    dominio = Domain([ContinuousVariable(a) for a in atributos], DiscreteVariable("classe", classes))
+    return Table.from_numpy(dominio, X[indices], y[indices].astype(float))
+
+def _avaliar_dobra(tarefa):
+    """Treina em todas as dobras menos uma e devolve as probabilidades na dobra de teste"""
+    from Orange.base import Model
+
+    nome, semente, treino, teste = tarefa
+    inicio = time.perf_counter()
+    modelo = criar_aprendiz(nome, semente)(_tabela(treino))
+    probabilidades = modelo(_tabela(teste), Model.Probs)
+    return nome, teste, probabilidades, time.perf_counter() - inicio
+
+def _treinar_final(tarefa):
+    nome, semente, indices = tarefa
+    inicio = time.perf_counter()
+    modelo = criar_aprendiz(nome, semente)(_tabela(indices))
+    return nome, pickle.dumps(modelo, protocol=pickle.HIGHEST_PROTOCOL), time.perf_counter() - inicio
+
+# Métricas (as mesmas colunas do Test and Score) e matriz de confusão
+
+def calcular_metricas(y, probabilidades, classes):
+    from sklearn.metrics import (accuracy_score, confusion_matrix, f1_score, log_loss,
+                                 precision_score, recall_score, roc_auc_score)
+
+    rotulos = np.arange(len(classes))
+    previstos = probabilidades.argmax(axis=1)
+    try:
+        auc = roc_auc_score(y, probabilidades, multi_class='ovr', average='weighted', labels=rotulos)
+    except ValueError:
+        auc = float('nan')
+
+    return {
+        'AUC': float(auc),
+        'CA': float(accuracy_score(y, previstos)),
+        'F1': float(f1_score(y, previstos, average='weighted', labels=rotulos, zero_division=0)),
+        'Precision': float(precision_score(y, previstos, average='weighted', labels=rotulos, zero_division=0)),
+        'Recall': float(recall_score(y, previstos, average='weighted', labels=rotulos, zero_division=0)),
+        'LogLoss': float(log_loss(y, np.clip(probabilidades, 1e-15, 1), labels=rotulos)),
+        'matriz_confusao': confusion_matrix(y, previstos, labels=rotulos).tolist(),
+    }
+
+# Pipeline
+
+def treinar(X, y, classes, atributos=NOMES_CARACTERISTICAS, aprendizes=APRENDIZES, n_dobras=N_DOBRAS,
+            proporcao=PROPORCAO_AMOSTRA, semente=42, modelo_salvo='rf', n_processos=None):
+    """
+    Executa amostragem, validação cruzada e treino final de todos os aprendizes
+    modelo_salvo: aprendiz cujo modelo final é salvo ('rf' como no workflow, ou 'melhor' pelo AUC)
+    Retorna (modelos finais serializados por aprendiz, relatório)
+    """
+    amostra = amostrar(y, proporcao, semente)
+    X_amostra, y_amostra = X[amostra], y[amostra]
+    dobras = dobras_estratificadas(y_amostra, n_dobras, semente)
+    todos = np.arange(len(amostra))
+
+    tarefas_dobras = [
+        (nome, semente, np.setdiff1d(todos, teste), teste)
+        for nome in aprendizes for teste in dobras
+    ]
+    tarefas_finais = [(nome, semente, todos) for nome in aprendizes]
+
+    n_processos = n_processos or os.cpu_count() or 1
+    probabilidades = {nome: np.zeros((len(amostra), len(classes))) for nome in aprendizes}
+    tempos = {nome: {'validacao_s': 0.0, 'treino_final_s': 0.0} for nome in aprendizes}
+    modelos = {}
+
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=min(n_processos, len(tarefas_dobras) + len(tarefas_finais)),
+        initializer=_iniciar_processo,
+        initargs=(X_amostra, y_amostra, list(classes), list(atributos))
+    ) as pool:
+        futuros_finais = [pool.submit(_treinar_final, tarefa) for tarefa in tarefas_finais]
+        for nome, teste, probs, duracao in pool.map(_avaliar_dobra, tarefas_dobras):
+            probabilidades[nome][teste] = probs
+            tempos[nome]['validacao_s'] += duracao
+        for futuro in futuros_finais:
+            nome, modelo, duracao = futuro.result()
+            modelos[nome] = modelo
+            tempos[nome]['treino_final_s'] = duracao
+
+    avaliacao = {
+        NOMES_APRENDIZES[nome]: {**calcular_metricas(y_amostra, probabilidades[nome], classes), **tempos[nome]}
+        for nome in aprendizes
+    }
+    if modelo_salvo == 'melhor':
+        modelo_salvo = max(aprendizes, key=lambda nome: np.nan_to_num(avaliacao[NOMES_APRENDIZES[nome]]['AUC']))
+
+    relatorio = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'n_exemplos': int(len(y)),
+        'n_amostra': int(len(amostra)),
+        'classes': list(classes),
+        'exemplos_por_classe': {c: int((y_amostra == i).sum()) for i, c in enumerate(classes)},
+        'versao_preprocessamento': VERSAO_PREPROCESSAMENTO,
+        'validacao': f"{n_dobras} dobras estratificadas",
+        'semente': semente,
+        'avaliacao': avaliacao,
+        'modelo_salvo': NOMES_APRENDIZES[modelo_salvo],
+        'duracao_total_s': time.perf_counter() - inicio,
+    }
+    return modelos[modelo_salvo], relatorio
+
+def salvar_modelo(modelo_serializado, caminho):
+    """
+    Grava o modelo de forma atômica: o registro de modelos e o dashboard
+    nunca veem um arquivo pela metade
+    """
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(modelo_serializado)
+    os.replace(temporario, caminho)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Treina e avalia o modelo de diagnóstico de parasitos")
+    origem = parser.add_mutually_exclusive_group()
+    origem.add_argument("--imagens", default="dados_demo/imagens", help="diretório com uma pasta por classe")
+    origem.add_argument("--dados", default=None, help="tabela de características já extraídas (.tab/.csv)")
+    parser.add_argument("--saida", default="modelo_parasitos_cnn.pkcls")
+    parser.add_argument("--relatorio", default=None, help="JSON de métricas (padrão: <saida>.metricas.json)")
+    parser.add_argument("--aprendizes", nargs="+", choices=APRENDIZES, default=list(APRENDIZES))
+    parser.add_argument("--modelo", default="rf", choices=list(APRENDIZES) + ['melhor'], help="modelo final salvo")
+    parser.add_argument("--dobras", type=int, default=N_DOBRAS)
+    parser.add_argument("--proporcao", type=float, default=PROPORCAO_AMOSTRA, help="proporção do Data Sampler")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--processos", type=int, default=None)
+    parser.add_argument("--sem-cache", action="store_true", help="não usar o cache de características")
+    args = parser.parse_args(argv)
+
+    if args.modelo in APRENDIZES and args.modelo not in args.aprendizes:
+        parser.error(f"--modelo {args.modelo} precisa estar entre os --aprendizes")
+
+    inicio = time.perf_counter()
+    if args.dados:
+        X, y, classes, atributos = dados_de_tabela(args.dados)
+    else:
+        cache = None if args.sem_cache else CacheEmbeddings()
+        X, y, classes = dados_de_imagens(args.imagens, args.processos, cache)
+        atributos = NOMES_CARACTERISTICAS
+    print(f"{len(y)} exemplos, {len(classes)} classes, características em {time.perf_counter() - inicio:.1f}s")
+
+    modelo, relatorio = treinar(
+        X, y, classes, atributos,
+        aprendizes=args.aprendizes,
+        n_dobras=args.dobras,
+        proporcao=args.proporcao,
+        semente=args.semente,
+        modelo_salvo=args.modelo,
+        n_processos=args.processos
+    )
+    relatorio['origem'] = args.dados or args.imagens
+
+    for nome, metricas in relatorio['avaliacao'].items():
+        print(f"{nome:<14} AUC {metricas['AUC']:.3f}  CA {metricas['CA']:.3f}  F1 {metricas['F1']:.3f}  "
+              f"Precision {metricas['Precision']:.3f}  Recall {metricas['Recall']:.3f}")
+
+    salvar_modelo(modelo, args.saida)
+    # Cópia joblib ao lado do .pkcls: o dashboard abre os arrays do modelo via mmap
+    from modelos_orange import converter_para_joblib
+    converter_para_joblib(args.saida)
+    caminho_relatorio = args.relatorio or os.path.splitext(args.saida)[0] + ".metricas.json"
+    with open(caminho_relatorio, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    print(f"✓ Modelo {relatorio['modelo_salvo']} salvo em {args.saida} (relatório em {caminho_relatorio})")
+
+if __name__ == "__main__":
+    main()